@@ -2,18 +2,39 @@ import sys
 import argparse
 import struct
 import os
+from array import array
+
+from binary_image import Image, Segment, write_image, SEGMENT_TEXT, SEGMENT_STATIC, SEGMENT_HEAP, SEGMENT_STACK, SEGMENT_INTERRUPT
+from symbols import SymbolTable, symbols_path
+
+WORD_MASK = (1 << 64) - 1
+
+
+class SourceLine(str):
+    # Preprocessed line that remembers the file and line number it came from, for the symbol file
+    def __new__(cls, text, source, number):
+        line = super().__new__(cls, text)
+        line.source = source
+        line.number = number
+        return line
+
 
 class Assembler:
+    # Mnemonic -> opcode map, shared with the CPU's dispatch table
+    INSTRUCTIONS = {
+        'ADD': 1, 'SUB': 2, 'FADD': 3, 'FSUB': 4, 'VADD': 5, 'VSUB': 6,
+        'MUL': 7, 'DIV': 8, 'FMUL': 9, 'FDIV': 10, 'VMUL': 11, 'VDIV': 12,
+        'LOAD': 13, 'STORE': 14, 'CMP': 15, 'FCMP': 16, 'JUMP': 17, 'JZ': 18,
+        'JNZ': 19, 'FMOV': 20, 'HALT': 21, 'PIM_ADD': 22, 'PIM_SUB': 23,
+        'PIM_MUL': 24, 'PIM_DIV': 25, 'PIM_FADD': 26, 'PIM_FSUB': 27, 'PIM_FMUL': 28,
+        'PIM_FDIV': 29, 'INT': 30, 'IRET': 31, 'IN': 32, 'OUT': 33, 'LOADF': 34,
+        'CALL': 35, 'RET': 36, 'MOV': 37, 'ADDI': 38, 'WFI': 39, 'PIM_RADD': 40, 'PIM_RSUB': 41,
+        'PIM_RMUL': 42, 'PIM_RDIV': 43, 'PIM_RFADD': 44, 'PIM_RFSUB': 45, 'PIM_RFMUL': 46, 'PIM_RFDIV': 47,
+        'PIM_STRIDE': 48, 'VLOAD': 49, 'VSTORE': 50, 'VSUM': 51, 'VDOT': 52, 'VMAX': 53, 'VSETMASK': 54
+    }
+
     def __init__(self):
-        self.instructions = {
-            'ADD': 1, 'SUB': 2, 'FADD': 3, 'FSUB': 4, 'VADD': 5, 'VSUB': 6,
-            'MUL': 7, 'DIV': 8, 'FMUL': 9, 'FDIV': 10, 'VMUL': 11, 'VDIV': 12,
-            'LOAD': 13, 'STORE': 14, 'CMP': 15, 'FCMP': 16, 'JUMP': 17, 'JZ': 18,
-            'JNZ': 19, 'FMOV': 20, 'HALT': 21, 'PIM_ADD': 22, 'PIM_SUB': 23,
-            'PIM_MUL': 24, 'PIM_DIV': 25, 'PIM_FADD': 26, 'PIM_FSUB': 27, 'PIM_FMUL': 28,
-            'PIM_FDIV': 29, 'INT': 30, 'IRET': 31, 'IN': 32, 'OUT': 33, 'LOADF': 34,
-            'CALL': 35, 'RET': 36, 'MOV': 37, 'ADDI': 38
-        }
+        self.instructions = dict(Assembler.INSTRUCTIONS)
         self.labels = {}
         self.defines = {}
         self.text_segment = []
@@ -24,10 +45,11 @@ class Assembler:
         self.current_segment = self.text_segment
         self.current_address = 0
         self.conditions_stack = []
+        self.line_table = {}  # address -> (source file, line number) of the line that emitted it
 
-    def preprocess(self, lines):
+    def preprocess(self, lines, source='<input>'):
         processed_lines = []
-        for line in lines:
+        for number, line in enumerate(lines, 1):
             line = line.split(';')[0].strip()  # Remove comments
             if not line:
                 continue
@@ -44,7 +66,7 @@ class Assembler:
                     if os.path.exists(include_path):
                         with open(include_path, 'r') as inc_file:
                             included_lines = inc_file.readlines()
-                            processed_lines.extend(self.preprocess(included_lines))
+                            processed_lines.extend(self.preprocess(included_lines, include_path))
                 continue
             elif line.startswith('#ifdef'):
                 parts = line.split()
@@ -65,7 +87,7 @@ class Assembler:
             if not any(self.conditions_stack) or all(self.conditions_stack):
                 for key, value in self.defines.items():
                     line = line.replace(key, value)
-                processed_lines.append(line)
+                processed_lines.append(SourceLine(line, source, number))
 
         return processed_lines
 
@@ -83,6 +105,9 @@ class Assembler:
         elif operand.startswith('%F'):  # Floating point register
             operand_type = 1
             return int(operand[2:]), operand_type #+ 100  # Let's assume floating point registers start from 100
+        elif operand.startswith('%V'):  # Vector register
+            operand_type = 1
+            return int(operand[2:]), operand_type
         elif operand.startswith('#0x'):  # Immediate value in hex
             operand_type = 2
             return int(operand[1:], 16), operand_type
@@ -142,8 +167,8 @@ class Assembler:
                         self.current_address += 4 * (len(parts) - 1)
 
     def second_pass(self, lines):
-        for line in lines:
-            line = line.split(';')[0].strip()  # Remove comments
+        for source_line in lines:
+            line = source_line.split(';')[0].strip()  # Remove comments
             if not line:
                 continue
 
@@ -182,8 +207,10 @@ class Assembler:
                     operands_type.append(0)
                     print("operands_type = ", operands_type[0], operands_type[1])
                     self.current_segment.append((self.current_address, opcode,operands_type[0], operands_type[1], operands))
+                    self.record_line(source_line)
                     self.current_address += 1
                 elif instruction in ('db', 'dw', 'dd', 'df'):
+                    self.record_line(source_line)
                     self.handle_data_directive(instruction, parts[1:])
                 else:
                     raise ValueError(f"Unknown instruction or directive: {instruction}")
@@ -225,6 +252,17 @@ class Assembler:
                 else:
                     raise ValueError(f"Unknown instruction or directive: {instruction}")
 
+    def record_line(self, source_line):
+        if isinstance(source_line, SourceLine):
+            self.line_table[self.current_address] = (source_line.source, source_line.number)
+
+    def symbol_table(self):
+        emitted = [entry[0] for kind, segment in self.segment_lists() for entry in segment]
+        return SymbolTable.from_labels(self.labels, self.line_table, max(emitted) + 1 if emitted else 0)
+
+    def write_symbols(self, output_file):
+        self.symbol_table().save(output_file)
+
     def handle_data_directive(self, directive, operands):
         if directive == 'db':
             values = [int(x, 0) for x in operands]
@@ -248,54 +286,99 @@ class Assembler:
                 self.current_segment.append((self.current_address, packed_value))
                 self.current_address += 4
 
+    def encode_entry(self, entry):
+        # (address, hex code) for one segment entry; instruction codes are left-aligned in 16 hex digits
+        if len(entry) == 5:
+            address, opcode, operand0_type, operand1_type, operands = entry
+            if opcode == 17 or opcode == 18 or opcode == 19:
+                hex_code = f"{opcode:02X}"
+                hex_code += f"{operands[0]:014X}"
+                return address, hex_code.ljust(16, '0')
+
+            hex_code = f"{opcode:02X}"
+            hex_code += f"{operand0_type:01X}"
+            hex_code += f"{operand1_type:01X}"
+            for operand in operands:
+                hex_code += f"{operand:03X}"
+            return address, hex_code.ljust(16, '0')
+        else:
+            address, value = entry
+            return address, f"{value:016X}"
+
+    def segment_lists(self):
+        return [(SEGMENT_TEXT, self.text_segment), (SEGMENT_STATIC, self.static_segment), (SEGMENT_HEAP, self.heap_segment),
+                (SEGMENT_STACK, self.stack_segment), (SEGMENT_INTERRUPT, self.interrupt_handlers)]
+
+    def encoded_segments(self):
+        for kind, segment in self.segment_lists():
+            yield kind, [self.encode_entry(entry) for entry in segment]
+
     def write_output(self, output_file):
         with open(output_file, 'w') as file:
-            for segment in [self.text_segment, self.static_segment, self.heap_segment, self.stack_segment, self.interrupt_handlers]:
-                for entry in segment:
-                    if len(entry) == 5:
-                        address, opcode, operand0_type, operand1_type, operands = entry
-                        if opcode == 17 or opcode == 18 or opcode == 19:
-                            hex_code = f"{opcode:02X}"
-                            hex_code += f"{operands[0]:014X}"
-                            file.write(f"{address:04X} {hex_code.ljust(16, '0')}\n")
-                            continue
+            for kind, words in self.encoded_segments():
+                for address, hex_code in words:
+                    file.write(f"{address:04X} {hex_code}\n")
 
-                        hex_code = f"{opcode:02X}"
-                        print("------------------------------------")
-                        print("hex_code = ", hex_code)
-                        print("operand_type = ", operand0_type)
-                        #print("operand_type = ", operand_type)
-                        hex_code += f"{operand0_type:01X}"
-                        print("hex_code = ", f"{operand0_type:01X}")
-                        hex_code += f"{operand1_type:01X}"
-                        print("hex_code = ", f"{operand1_type:01X}")
+    def entry_point(self):
+        if 'START' in self.labels:
+            return self.labels['START']
+        if self.text_segment:
+            return min(entry[0] for entry in self.text_segment)
+        return None
 
-                        for operand in operands:
-                            #print(operand)
-                            hex_code += f"{operand:03X}"
-                            print("hex_code = ", f"{operand:03X}")
-                        print("------------------------------------")
-                        file.write(f"{address:04X} {hex_code.ljust(16, '0')}\n")
-                    elif len(entry) == 2:
-                        address, value = entry
-                        #print(type(value))
-                        file.write(f"{address:04X} {value:016X}\n")
+    def write_image(self, output_file, max_gap=8):
+        # Binary image: each segment is split into runs of consecutive addresses. Gaps of up to max_gap
+        # words that no other segment uses are zero-filled instead of starting a new run.
+        encoded = [(kind, [(address, int(hex_code, 16) & WORD_MASK) for address, hex_code in words])
+                   for kind, words in self.encoded_segments()]
+        used = set(address for kind, words in encoded for address, value in words)
+        segments = []
+        for kind, words in encoded:
+            values = {}
+            for address, value in words:
+                values[address] = value - (1 << 64) if value >> 63 else value
+            run_start, run = None, None
+            for address in sorted(values):
+                if run is not None:
+                    gap = address - (run_start + len(run))
+                    if gap <= max_gap and not any(a in used for a in range(run_start + len(run), address)):
+                        run.extend([0] * gap)
+                    else:
+                        segments.append(Segment(kind, run_start, run))
+                        run = None
+                if run is None:
+                    run_start, run = address, array('q')
+                run.append(values[address])
+            if run is not None:
+                segments.append(Segment(kind, run_start, run))
+        write_image(output_file, Image(segments, self.entry_point()))
 
 
 def main():
     parser = argparse.ArgumentParser(description="Assembler for custom CPU")
     parser.add_argument("input_files", type=str, nargs='+', help="Input assembly files")
     parser.add_argument("output_file", type=str, help="Output hex file")
+    parser.add_argument("--format", choices=['auto', 'hex', 'bin'], default='auto', help="Output format (auto: bin for .bin/.img files, hex otherwise)")
+    parser.add_argument("--symbols", type=str, help="Symbol and line table file (default: output file with a .sym extension)")
+    parser.add_argument("--no-symbols", action="store_true", help="Do not write a symbol file")
     args = parser.parse_args()
 
     assembler = Assembler()
     for input_file in args.input_files:
         with open(input_file, 'r') as file:
             lines = file.readlines()
-            preprocessed_lines = assembler.preprocess(lines)
+            preprocessed_lines = assembler.preprocess(lines, input_file)
             assembler.first_pass(preprocessed_lines)
             assembler.second_pass(preprocessed_lines)
-    assembler.write_output(args.output_file)
+    output_format = args.format
+    if output_format == 'auto':
+        output_format = 'bin' if os.path.splitext(args.output_file)[1].lower() in ('.bin', '.img') else 'hex'
+    if output_format == 'bin':
+        assembler.write_image(args.output_file)
+    else:
+        assembler.write_output(args.output_file)
+    if not args.no_symbols:
+        assembler.write_symbols(args.symbols or symbols_path(args.output_file))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,164 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from cpu import CPU, STOP_FAULT, TIMER_BASE, DMA_BASE, read_program
+from memory import Memory
+from peripherial import Storage, BlockStorage, RandomNumberGenerator, Keyboard, Display, NullBackend, Timer, \
+    DMAController
+from snapshot import Snapshot
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CYCLES = 10000000
+
+# Per-worker state: one warmed-up CPU reused for every job, and parsed dump/snapshot files keyed by (path, mtime)
+worker_cpu = None
+worker_dumps = {}
+worker_snapshots = {}
+
+
+def init_worker(jit, memory_backing):
+    global worker_cpu
+    worker_cpu = CPU(memory_backing=memory_backing)
+    worker_cpu.frame_interval = 0
+    if jit:
+        worker_cpu.enable_jit()
+
+
+def cached_program(path):
+    key = (path, os.path.getmtime(path))
+    image = worker_dumps.get(key)
+    if image is None:
+        image = read_program(path)
+        worker_dumps[key] = image
+    return image
+
+
+def cached_snapshot(path):
+    key = (path, os.path.getmtime(path))
+    snapshot = worker_snapshots.get(key)
+    if snapshot is None:
+        snapshot = Snapshot.load(path)
+        worker_snapshots[key] = snapshot
+    return snapshot
+
+
+def attach_peripherals(cpu, disk_image=None):
+    # Window-less device set: the Display draws into memory only, so workers never open a window
+    for peripheral in list(cpu.peripherals.values()):
+        cpu.remove_peripheral(peripheral)
+        if isinstance(peripheral, BlockStorage):
+            peripheral.close()
+    cpu.add_peripheral(Storage(base_address=0x400, size=1024))
+    cpu.add_peripheral(Display(base_address=0x800, backend=NullBackend()))
+    cpu.add_peripheral(Keyboard(base_address=0x200))
+    cpu.add_peripheral(RandomNumberGenerator(base_address=0x1000))
+    cpu.add_peripheral(cpu.interrupt_controller)
+    cpu.add_peripheral(Timer(base_address=TIMER_BASE))
+    cpu.add_peripheral(DMAController(base_address=DMA_BASE))
+    if disk_image:
+        cpu.add_peripheral(BlockStorage(base_address=0x300, image_path=disk_image))
+
+
+def run_job(indexed_job):
+    index, job = indexed_job
+    cpu = worker_cpu
+    result = {'index': index, 'id': job.get('id', index)}
+    start = time.perf_counter()
+    try:
+        attach_peripherals(cpu, job.get('disk_image'))
+        if job.get('snapshot'):
+            cpu.restore(cached_snapshot(job['snapshot']))
+        else:
+            cpu.reset()
+        if job.get('keyboard_script'):
+            cpu.peripherals[0x200].load_script(job['keyboard_script'])
+        entry = None
+        if job.get('interrupt_file'):
+            cpu.load_image(cached_program(job['interrupt_file']))
+        if job.get('memory_dump'):
+            image = cached_program(job['memory_dump'])
+            cpu.load_image(image)
+            entry = image.entry
+        if 'start_address' in job:
+            cpu.pc = int(str(job['start_address']), 0)
+        elif entry is not None:
+            cpu.pc = entry
+        elif not job.get('snapshot'):
+            cpu.pc = 0x100
+        reason = cpu.run_until(cycles=job.get('cycles', DEFAULT_CYCLES))
+    except Exception as e:  # Bad job description or unreadable files
+        reason, cpu.fault = STOP_FAULT, e
+    result.update({
+        'stop_reason': reason,
+        'fault': repr(cpu.fault) if cpu.fault is not None else None,
+        'pc': cpu.pc,
+        'retired': cpu.retired,
+        'elapsed': time.perf_counter() - start,
+        'registers': cpu.registers,
+        'floating_point_registers': cpu.floating_point_registers,
+        'flags': cpu.flags,
+        'worker': os.getpid(),
+    })
+    if job.get('screen'):
+        result['screen'] = cpu.peripherals[0x800].screen_text()
+    block_storage = cpu.peripherals.get(0x300)
+    if block_storage is not None:
+        # Written sectors reach the image now; a worker's last job is never followed by attach_peripherals
+        cpu.remove_peripheral(block_storage)
+        block_storage.close()
+    return result
+
+
+def read_manifest(path):
+    # One JSON object per line: {"memory_dump": ..., "interrupt_file": ..., "start_address": ..., "cycles": ...}
+    # A "snapshot" path starts the job from a saved machine state; dump files are then loaded on top of it.
+    # "screen": true adds the Display's text lines to the result; "disk_image" attaches block storage at 0x300
+    # and "keyboard_script" types a file's bytes into the keyboard.
+    jobs = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                jobs.append(json.loads(line))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many guest programs in a process pool")
+    parser.add_argument("manifest", type=str, help="JSON lines file with memory_dump, interrupt_file, start_address and cycles per job")
+    parser.add_argument("-o", "--output", type=str, help="JSON lines result file (default: stdout)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--cycles", type=int, default=DEFAULT_CYCLES, help="Cycle budget for jobs that do not set one")
+    parser.add_argument("--chunksize", type=int, default=1, help="Jobs handed to a worker at a time")
+    parser.add_argument("--jit", action="store_true", help="Run guests with the basic-block translator")
+    parser.add_argument("--memory-backing", type=str, default='paged', choices=Memory.BACKINGS, help="Memory backing store for worker CPUs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+    jobs = read_manifest(args.manifest)
+    for job in jobs:
+        job.setdefault('cycles', args.cycles)
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    start = time.perf_counter()
+    retired = 0
+    try:
+        with multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(args.jit, args.memory_backing)) as pool:
+            for result in pool.imap_unordered(run_job, enumerate(jobs), args.chunksize):
+                retired += result['retired']
+                output.write(json.dumps(result) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+    print(f"{len(jobs)} jobs, {retired} instructions in {elapsed:.3f} s ({retired / elapsed:,.0f} instr/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import contextlib
+import io
+import os
+import time
+
+from assembler import Assembler
+from cpu import CPU
+
+# Tight counting loop: MOV/ADDI/CMP/JNZ are the hot opcodes of typical guest code
+BENCHMARK_SOURCE = """
+.text
+.org 0x100
+START:
+        MOV %R2, {inner}
+        MOV %R3, 0x0
+        MOV %R4, {outer}
+OUTER:
+        MOV %R1, 0x0
+INNER:
+        ADDI %R1, %R1, 0x1
+        CMP %R1, %R2
+        JNZ INNER
+        ADDI %R3, %R3, 0x1
+        CMP %R3, %R4
+        JNZ OUTER
+        HALT
+"""
+
+
+def assemble_benchmark(inner, outer):
+    assembler = Assembler()
+    lines = BENCHMARK_SOURCE.format(inner=hex(inner), outer=hex(outer)).splitlines()
+    with contextlib.redirect_stdout(io.StringIO()):
+        lines = assembler.preprocess(lines)
+        assembler.first_pass(lines)
+        assembler.second_pass(lines)
+    return assembler
+
+
+def run_benchmark(inner, outer, jit=False):
+    assembler = assemble_benchmark(inner, outer)
+    path = "benchmark_%d.hex" % os.getpid()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            assembler.write_output(path)
+            cpu = CPU()
+            cpu.load_memory_dump(path)
+            if jit:
+                cpu.enable_jit()
+    finally:
+        os.remove(path)
+    cpu.pc = 0x100
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        cpu.run()
+        elapsed = time.perf_counter() - start
+    return cpu.retired, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CPU emulator's instruction loop")
+    parser.add_argument("--inner", type=lambda x: int(x, 0), default=0xFFF, help="Inner loop iterations (max 0xFFF)")
+    parser.add_argument("--outer", type=lambda x: int(x, 0), default=0x10, help="Outer loop iterations (max 0xFFF)")
+    parser.add_argument("--jit", action="store_true", help="Run with the basic-block translator enabled")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs; the best one is reported")
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(args.repeat):
+        retired, elapsed = run_benchmark(args.inner, args.outer, args.jit)
+        if best is None or elapsed < best[1]:
+            best = (retired, elapsed)
+    retired, elapsed = best
+    print(f"{retired} instructions in {elapsed:.3f} s ({retired / elapsed:,.0f} instr/s)")
+
+
+if __name__ == "__main__":
+    main()
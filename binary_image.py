@@ -0,0 +1,83 @@
+import struct
+import sys
+from array import array
+
+IMAGE_MAGIC = b'ADVIMG\x00\x00'
+IMAGE_VERSION = 1
+
+# File layout, all integers little-endian:
+#   header:         magic (8 bytes), version (u16), segment count (u16), reserved (u32), entry point (u64)
+#   segment table:  segment count x (kind (u16), reserved (u16), word count (u32), load address (u64), file offset (u64))
+#   data:           each segment's words as packed signed 64-bit integers, at its file offset
+HEADER = struct.Struct('<8sHHIQ')
+SEGMENT = struct.Struct('<HHIQQ')
+
+SEGMENT_TEXT = 0
+SEGMENT_STATIC = 1
+SEGMENT_HEAP = 2
+SEGMENT_STACK = 3
+SEGMENT_INTERRUPT = 4
+SEGMENT_NAMES = {SEGMENT_TEXT: 'text', SEGMENT_STATIC: 'static', SEGMENT_HEAP: 'heap',
+                 SEGMENT_STACK: 'stack', SEGMENT_INTERRUPT: 'interrupt'}
+
+NO_ENTRY = (1 << 64) - 1
+
+
+class Segment:
+    def __init__(self, kind, address, words):
+        self.kind = kind
+        self.address = address  # Load address of the first word
+        self.words = words  # array('q')
+
+    def __repr__(self):
+        return f"Segment({SEGMENT_NAMES.get(self.kind, self.kind)}, {self.address:04X}, {len(self.words)} words)"
+
+
+class Image:
+    def __init__(self, segments, entry=None):
+        self.segments = segments
+        self.entry = entry  # Start address, or None when the image does not define one
+
+
+def is_image(file_path):
+    with open(file_path, 'rb') as file:
+        return file.read(len(IMAGE_MAGIC)) == IMAGE_MAGIC
+
+
+def write_image(file_path, image):
+    table = []
+    data = []
+    offset = HEADER.size + SEGMENT.size * len(image.segments)
+    for segment in image.segments:
+        words = segment.words
+        if sys.byteorder != 'little':
+            words = array('q', words)
+            words.byteswap()
+        table.append(SEGMENT.pack(segment.kind, 0, len(words), segment.address, offset))
+        data.append(words.tobytes())
+        offset += len(words) * 8
+    entry = NO_ENTRY if image.entry is None else image.entry
+    with open(file_path, 'wb') as file:
+        file.write(HEADER.pack(IMAGE_MAGIC, IMAGE_VERSION, len(image.segments), 0, entry))
+        file.write(b''.join(table))
+        file.write(b''.join(data))
+
+
+def read_image(file_path):
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    if len(data) < HEADER.size or not data.startswith(IMAGE_MAGIC):
+        raise ValueError(f"{file_path} is not a binary image")
+    magic, version, count, _, entry = HEADER.unpack_from(data, 0)
+    if version != IMAGE_VERSION:
+        raise ValueError(f"Unsupported image version {version}")
+    view = memoryview(data)
+    segments = []
+    for index in range(count):
+        kind, _, length, address, offset = SEGMENT.unpack_from(data, HEADER.size + index * SEGMENT.size)
+        words = array('q')
+        words.frombytes(view[offset:offset + length * 8])
+        if sys.byteorder != 'little':
+            words.byteswap()
+        segments.append(Segment(kind, address, words))
+    return Image(segments, None if entry == NO_ENTRY else entry)
@@ -0,0 +1,83 @@
+import bisect
+
+DECODE_SHIFT = 8  # Decode cache granularity: 0x100 addresses
+UNCACHEABLE = object()  # Page shared by a device range and something else, decoded with bisect every time
+
+
+class Bus:
+    # I/O address decoder. Devices own explicit [base, base + size) ranges; overlapping ranges are
+    # rejected when mapped. Lookups go through a per-page cache filled from a bisect over the sorted ranges.
+    def __init__(self):
+        self.starts = []  # Sorted range starts
+        self.ranges = []  # (start, end, device), same order as self.starts
+        self.page_cache = {}  # address >> DECODE_SHIFT -> (start, end, device), None (unmapped) or UNCACHEABLE
+
+    def map(self, device, base, size):
+        end = base + size
+        if size <= 0 or base < 0:
+            raise ValueError(f"Invalid I/O range {base:04X}+{size:X}")
+        index = bisect.bisect_right(self.starts, base)
+        if index > 0 and self.ranges[index - 1][1] > base:
+            other = self.ranges[index - 1]
+            raise ValueError(f"I/O range {base:04X}-{end - 1:04X} overlaps {other[2].__class__.__name__} at {other[0]:04X}-{other[1] - 1:04X}")
+        if index < len(self.ranges) and self.ranges[index][0] < end:
+            other = self.ranges[index]
+            raise ValueError(f"I/O range {base:04X}-{end - 1:04X} overlaps {other[2].__class__.__name__} at {other[0]:04X}-{other[1] - 1:04X}")
+        self.starts.insert(index, base)
+        self.ranges.insert(index, (base, end, device))
+        self.page_cache.clear()
+
+    def unmap(self, device):
+        for index in reversed(range(len(self.ranges))):
+            if self.ranges[index][2] is device:
+                del self.starts[index]
+                del self.ranges[index]
+        self.page_cache.clear()
+
+    def clear(self):
+        self.starts.clear()
+        self.ranges.clear()
+        self.page_cache.clear()
+
+    def find(self, address):
+        index = bisect.bisect_right(self.starts, address) - 1
+        if index >= 0:
+            entry = self.ranges[index]
+            if address < entry[1]:
+                return entry
+        return None
+
+    def decode_page(self, page):
+        first = page << DECODE_SHIFT
+        last = first + (1 << DECODE_SHIFT) - 1
+        entry = self.find(first)
+        if entry is not None and entry[1] > last:
+            result = entry  # Whole page belongs to one device
+        elif entry is None and self.find(last) is None and \
+                bisect.bisect_right(self.starts, last) == bisect.bisect_right(self.starts, first):
+            result = None  # Nothing mapped anywhere in the page
+        else:
+            result = UNCACHEABLE
+        self.page_cache[page] = result
+        return result
+
+    def lookup(self, address):
+        # (start, end, device) for an address, IndexError when no device is mapped there
+        page = address >> DECODE_SHIFT
+        try:
+            entry = self.page_cache[page]
+        except KeyError:
+            entry = self.decode_page(page)
+        if entry is UNCACHEABLE:
+            entry = self.find(address)
+        if entry is None:
+            raise IndexError("Peripheral address out of range")
+        return entry
+
+    def read(self, address):
+        start, end, device = self.lookup(address)
+        return device.read(address - start)
+
+    def write(self, address, value):
+        start, end, device = self.lookup(address)
+        device.write(address - start, value)
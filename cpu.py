@@ -1,5 +1,6 @@
 import time
 import argparse
+import logging
 import threading
 import queue
 import sys
@@ -7,11 +8,6 @@ import os
 from multiprocessing import Process, Queue, Manager, Pipe
 import multiprocessing
 import numpy as np
-import platform
-if platform.system() == "Windows":
-    import tkinter as tk
-else:
-    import Tkinter as tk
 
 if os.name == "nt":
     import msvcrt
@@ -20,15 +16,96 @@ else:
     import tty
 
 import subprocess
-from memory import Memory
-from peripherial import Peripheral, Terminal, Storage, RandomNumberGenerator, Display, Keyboard
+from array import array
+from memory import Memory, to_word, WORD_MASK
+from binary_image import Image, Segment, is_image, read_image, SEGMENT_TEXT
+from assembler import Assembler
+from jit import BlockCompiler, BLOCK_DROPPED
+from snapshot import Snapshot
+from profiler import Profiler, PROFILED_OPCODES, OP_IN, OP_OUT
+from symbols import SymbolTable
+from replay import ReplayRecorder, ReplayPlayer
+from tracer import TraceRecorder, REGISTER, FLOAT_REGISTER, FLAGS, PORT_IN, PORT_OUT, INTERRUPT, flag_bits, word_bits
+from bus import Bus
+from peripherial import Peripheral, Terminal, Storage, BlockStorage, RandomNumberGenerator, Display, Keyboard, \
+    InterruptController, Timer, DMAController, \
+    DISPLAY_BACKENDS, make_display_backend
+
+TRACE = 5  # Per-instruction trace level, below logging.DEBUG
+logging.addLevelName(TRACE, "TRACE")
+logger = logging.getLogger("cpu")  # Not __name__: that is "__main__" when cpu.py runs as a script
+
+# Reasons returned by CPU.step / CPU.run_until
+STOP_HALT = 'halt'
+STOP_BREAKPOINT = 'breakpoint'
+STOP_BUDGET = 'budget'
+STOP_FAULT = 'fault'
+
+INTERRUPT_CONTROLLER_BASE = 0xC00  # Port immediates are 12 bits, so devices the guest drives live below 0x1000
+TIMER_BASE = 0xD00
+DMA_BASE = 0xE00
+WFI_TIMEOUT = 0.05  # Seconds WFI sleeps before returning to the run loop
+NO_LIMIT = 1 << 62  # batch_end when a run has no cycle budget
+RUN_BATCH = 100000  # Instructions per batch when CPU.run does not render
+VECTOR_REGISTERS = 16
+VECTOR_LENGTH = 4  # Default lanes per vector register; at most 64, so VSETMASK can take a lane bitmap from a register
+
+def read_hex_dump(file_path):
+    # [(address, value)] from an assembler output file of "ADDR VALUE" hex lines
+    words = []
+    with open(file_path, 'r') as file:
+        for line in file:
+            parts = line.strip().split()
+            if len(parts) == 2:
+                words.append((int(parts[0], 16), int(parts[1], 16)))
+    return words
+
+
+def read_program(file_path):
+    # Image from either a binary image or an assembler hex dump; hex words are grouped into runs of consecutive addresses
+    if is_image(file_path):
+        return read_image(file_path)
+    segments = []
+    for address, value in read_hex_dump(file_path):
+        value = to_word(value)
+        if segments and address == segments[-1].address + len(segments[-1].words):
+            segments[-1].words.append(value)
+        else:
+            segments.append(Segment(SEGMENT_TEXT, address, array('q', [value])))
+    return Image(segments)
+
 
 class ROM:
     def __init__(self, size):
         self.size = size
         self.memory = [0] * size
+        self.write_listeners = []  # Called as listener(address, length) after every write, as for Memory
+
+    def add_write_listener(self, listener):
+        self.write_listeners.append(listener)
+
+    def remove_write_listener(self, listener):
+        self.write_listeners.remove(listener)
+
+    def notify(self, address, length):
+        for listener in self.write_listeners:
+            listener(address, length)
+
+    def load(self, address, value):
+        if not 0 <= address < self.size:
+            raise IndexError("ROM address out of range")
+        self.memory[address] = value
+        self.notify(address, 1)
+
+    def load_block(self, address, words):
+        self.memory[address:address + len(words)] = words
+        self.notify(address, len(words))
 
     def load_from_file(self, file_path):
+        if is_image(file_path):
+            for segment in read_image(file_path).segments:
+                self.load_block(segment.address, segment.words.tolist())
+            return
         with open(file_path, 'r') as file:
             for line in file:
                 parts = line.strip().split()
@@ -36,6 +113,7 @@ class ROM:
                     address = int(parts[0], 16)
                     value = int(parts[1], 16)
                     self.memory[address] = value
+        self.notify(0, self.size)
 
     def read(self, address):
         if 0 <= address < self.size:
@@ -47,12 +125,19 @@ class ROM:
 class CPU:
     INTERRUPT_VECTOR_BASE = 0x80  # Fixed address for interrupt vector table
 
-    def __init__(self):
+    def __init__(self, memory_backing='paged', vector_length=VECTOR_LENGTH):
+        if not 1 <= vector_length <= 64:
+            raise ValueError(f"Vector length must be 1..64, not {vector_length}")
         self.registers = [0] * 64
         self.floating_point_registers = [0.0] * 64
-        self.vector_registers = [[0.0] * 4 for _ in range(4)]
-        self.memory = Memory()
+        self.vector_length = vector_length
+        self.vector_registers = np.zeros((VECTOR_REGISTERS, vector_length))  # One float64 row per register
+        self.vector_mask = np.ones(vector_length, dtype=bool)  # Lanes the vector ops write, set by VSETMASK
+        self.lane_bits = np.left_shift(np.uint64(1), np.arange(vector_length, dtype=np.uint64))
+        self.pim_stride = 1  # Address step of the range PIM instructions
+        self.memory = Memory(backing=memory_backing)
         self.rom = ROM(0x10)  # 64KB ROM
+        self.registers[14] = self.reset_sp()
         self.pc = 0
         self.flags = {
             'Z': 0,  # Zero flag
@@ -60,43 +145,180 @@ class CPU:
             'C': 0,  # Carry flag
             'V': 0   # Overflow flag
         }
-        self.interrupt_flag = 0
+        self.interrupt_pending = False  # Kept by the interrupt controller: an enabled interrupt is waiting
+        self.wakeup = threading.Event()  # Set when an interrupt is requested; WFI waits on it
+        self.interrupt_sources = 0  # Devices that can raise interrupts from other threads (WFI blocks only if any)
+        self.timers = []  # Timer devices; batches end at their deadlines
+        self.batch_end = NO_LIMIT  # Retired count at which the running batch returns
+        self.interrupt_controller = InterruptController(base_address=INTERRUPT_CONTROLLER_BASE)
+        self.interrupt_controller.attach(self)
         self.peripherals = {}
+        self.bus = Bus()
         self.storage = {}
-        print("mem size = ", self.memory.size)
-    def load_memory_dump(self, dump_path):
-        with open(dump_path, 'r') as file:
-            for line in file:
-                print("instr = ", line)
-                parts = line.strip().split()
-                if len(parts) == 2:
-                    address = int(parts[0], 16)
-                    handler_code = int(parts[1], 16)
-                    print(handler_code)
-                    self.memory.load(address, handler_code)
+        self.decode_cache = {}  # address -> (opcode, operands, operands_type)
+        self.memory.add_write_listener(self.invalidate_decoded)
+        self.rom.add_write_listener(self.invalidate_decoded)
+        self.retired = 0  # Instructions executed so far
+        self.jit = None  # BlockCompiler once enable_jit() is called
+        self.profiler = None  # Profiler once enable_profiler() is called; runs then take the interpreter path
+        self.tracer = None  # TraceRecorder once enable_tracer() is called; runs then take the traced interpreter loop
+        self.recorder = None  # ReplayRecorder while start_recording() is in effect
+        self.replayer = None  # ReplayPlayer while start_replay() is in effect; devices are then not consulted
+        self.symbols = None  # SymbolTable of the loaded program, used to name PCs in traces, faults and profiles
+        self.breakpoints = set()
+        self.fault = None  # Exception that ended the last run with STOP_FAULT
+        self.trace = logger.isEnabledFor(TRACE)  # Hot paths format nothing unless this is set
+        self.frame_interval = 10000  # Instructions between peripheral renders, 0 = headless
+        self.build_dispatch_table()
+        logger.debug("mem size = %d", self.memory.size)
+
+    def enable_jit(self, max_block_length=64):
+        if self.jit is None:
+            self.jit = BlockCompiler(self, max_block_length)
+            self.memory.add_write_listener(self.jit.invalidate)
+            self.rom.add_write_listener(self.jit.invalidate)
+
+    def disable_jit(self):
+        if self.jit is not None:
+            self.memory.remove_write_listener(self.jit.invalidate)
+            self.rom.remove_write_listener(self.jit.invalidate)
+            self.jit = None
+
+    def enable_profiler(self, names=None):
+        # The traced and profiled runs are separate loops, so only one of the two can be on
+        if self.tracer is not None:
+            raise ValueError("Profiling and tracing cannot be enabled together")
+        if self.profiler is None:
+            self.profiler = Profiler(self, names, self.symbols)
+        return self.profiler
+
+    def describe_pc(self, pc):
+        # "0123 LABEL+2 (prog.asm:14)" when symbols are loaded, else the address
+        return self.symbols.describe(pc) if self.symbols is not None else f"{pc:04X}"
+
+    def disable_profiler(self):
+        self.profiler = None
+
+    def enable_tracer(self, file_path=None, ring_records=None):
+        # Binary execution trace, streamed to file_path or kept in a ring of the newest ring_records records
+        if self.profiler is not None:
+            raise ValueError("Profiling and tracing cannot be enabled together")
+        if self.tracer is None:
+            self.tracer = TraceRecorder(self, file_path, ring_records)
+            self.tracer.attach()
+        return self.tracer
+
+    def disable_tracer(self):
+        # Detaches and closes the trace (a ring is written to its file_path, if it has one)
+        tracer = self.tracer
+        if tracer is not None:
+            tracer.detach()
+            if tracer.file is not None or tracer.file_path is not None:
+                tracer.close()
+            self.tracer = None
+        return tracer
+
+    def set_trace(self, enabled):
+        self.trace = enabled
+        if enabled and not logger.isEnabledFor(TRACE):
+            logger.setLevel(TRACE)
 
+    def reset(self):
+        # Back to power-on state with the same Memory, peripherals and JIT, so a warmed-up CPU can be reused.
+        # Register files and flags are cleared in place because translated blocks hold references to them.
+        self.registers[:] = [0] * len(self.registers)
+        self.registers[14] = self.reset_sp()
+        self.floating_point_registers[:] = [0.0] * len(self.floating_point_registers)
+        self.vector_registers.fill(0.0)
+        self.vector_mask.fill(True)
+        self.pim_stride = 1
+        for flag in self.flags:
+            self.flags[flag] = 0
+        self.pc = 0
+        self.interrupt_controller.reset()
+        self.wakeup.clear()
+        self.retired = 0
+        for timer in self.timers:
+            timer.restart()
+        self.fault = None
+        self.memory.clear()
+
+    def reset_sp(self):
+        # The stack starts at the top of memory, so an interrupt taken before the guest sets its own SP
+        # (a key scripted before the first instruction) has somewhere to push its return address
+        return self.memory.size - 1
+
+    def snapshot(self):
+        self.flush_peripherals()
+        state = {
+            'registers': list(self.registers),
+            'floating_point_registers': list(self.floating_point_registers),
+            'vector_registers': self.vector_registers.tolist(),
+            'vector_mask': self.vector_mask.tolist(),
+            'flags': dict(self.flags),
+            'pim_stride': self.pim_stride,
+            'pc': self.pc,
+            'interrupts': self.interrupt_controller.get_state(),
+            'retired': self.retired,
+            'rom': list(self.rom.memory),
+            'peripherals': {base: peripheral.get_state() for base, peripheral in self.peripherals.items()},
+        }
+        return Snapshot(state, self.memory.snapshot())
+
+    def restore(self, snapshot):
+        # Register files and flags are updated in place (translated blocks hold references to them).
+        # Peripheral state is restored into the devices currently attached at the same base addresses.
+        state = snapshot.state
+        self.registers[:] = state['registers']
+        self.floating_point_registers[:] = state['floating_point_registers']
+        # Older snapshots have fewer registers; a different vector length keeps the overlapping lanes
+        saved = np.array(state['vector_registers'], dtype=np.float64)[:VECTOR_REGISTERS, :self.vector_length]
+        self.vector_registers.fill(0.0)
+        self.vector_registers[:saved.shape[0], :saved.shape[1]] = saved
+        mask = state.get('vector_mask', [])[:self.vector_length]
+        self.vector_mask.fill(True)
+        self.vector_mask[:len(mask)] = mask
+        self.flags.update(state['flags'])
+        self.pim_stride = state.get('pim_stride', 1)
+        self.pc = state['pc']
+        self.retired = state['retired']
+        self.interrupt_controller.set_state(state['interrupts'])
+        self.fault = None
+        self.rom.load_block(0, state['rom'])
+        self.memory.restore(snapshot.memory)
+        for base, peripheral_state in state['peripherals'].items():
+            peripheral = self.peripherals.get(base)
+            if peripheral is not None:
+                peripheral.set_state(peripheral_state)
+
+    def load_image(self, image):
+        for segment in image.segments:
+            self.memory.load_block(segment.address, segment.words)
+
+    def load_memory_dump(self, dump_path):
+        # Accepts binary images and hex dumps; returns the image's entry point (None for hex dumps)
+        image = read_program(dump_path)
+        self.load_image(image)
+        return image.entry
 
     def load_interrupt_handlers(self, interrupt_file):
-        with open(interrupt_file, 'r') as file:
-            for line in file:
-                parts = line.strip().split()
-                if len(parts) == 2:
-                    address = int(parts[0], 16)
-                    handler_code = int(parts[1], 16)
-                    print("address = ", address)
-                    self.memory.load(address, handler_code)
+        self.load_image(read_program(interrupt_file))
 
     def handle_interrupt(self):
-        if self.interrupt_flag:
-            vector_address = self.INTERRUPT_VECTOR_BASE + self.interrupt_flag #* 4
-            isr_address = self.memory.read(vector_address)# >> 40
-            self.push_stack(self.pc)
-            self.pc = isr_address
-            self.interrupt_flag = 0
+        line = self.interrupt_controller.acknowledge()
+        if line is not None:
+            if self.recorder is not None:
+                self.recorder.interrupt(line)
+            self.enter_interrupt(line)
+        return line
+
+    def enter_interrupt(self, line):
+        vector_address = self.INTERRUPT_VECTOR_BASE + line #* 4
+        isr_address = self.memory.read(vector_address)# >> 40
+        self.push_stack(self.pc)
+        self.pc = isr_address
 
     def fetch(self):
-        #self.pc 
-        print("pc = ", self.pc)
         if 0 <= self.pc < len(self.rom.memory):
             instruction = self.rom.read(self.pc)
         else:
@@ -117,9 +339,45 @@ class CPU:
         second_operand = (instruction >> 24) & 0xFFF  # Next 12 bits for the second operand
         third_operand = (instruction >> 12) & 0xFFF  # Next 8 bits for the third operand
         immediate_value = instruction & 0xFFFFFFFFFF  # Lowest 40 bits for the immediate value
-        print("operand type (decode)= ", op_type0, op_type1)
         return opcode, op_type0, op_type1, first_operand, second_operand, third_operand, immediate_value
 
+    def fetch_decoded(self):
+        # Predecoded fetch: decode each address once and reuse it until memory at that address is written
+        pc = self.pc
+        entry = self.decode_cache.get(pc)
+        if entry is None:
+            opcode, *operands = self.decode(self.fetch())
+            entry = (opcode, operands[2:], [operands[0], operands[1]])
+            self.decode_cache[pc] = entry
+        else:
+            self.pc = pc + 1
+        return entry
+
+    def decode_at(self, address):
+        # Same as fetch_decoded without moving the PC
+        entry = self.decode_cache.get(address)
+        if entry is None:
+            pc = self.pc
+            self.pc = address
+            try:
+                entry = self.fetch_decoded()
+            finally:
+                self.pc = pc
+        return entry
+
+    def invalidate_decoded(self, address, length=1):
+        cache = self.decode_cache
+        if not cache:
+            return
+        if length == 1:
+            cache.pop(address, None)
+        elif length < len(cache):
+            for addr in range(address, address + length):
+                cache.pop(addr, None)
+        else:
+            for addr in [addr for addr in cache if address <= addr < address + length]:
+                del cache[addr]
+
     def set_flags(self, result):
         self.flags['Z'] = int(result == 0)
         self.flags['N'] = int(result != 0)
@@ -143,249 +401,732 @@ class CPU:
         self.registers[15] += size
         return addr
 
+    def build_dispatch_table(self):
+        # One handler per opcode, looked up by name from the assembler's opcode map (ADD -> op_add).
+        # Opcodes without a handler (e.g. LOADF) execute as no-ops, as they did in the old if/elif chain.
+        self.dispatch = [self.op_nop] * 256
+        self.opcode_names = {}
+        for mnemonic, opcode in Assembler.INSTRUCTIONS.items():
+            handler = getattr(self, "op_" + mnemonic.lower(), None)
+            if handler is not None:
+                self.register_opcode(opcode, handler, mnemonic)
+
+    def register_opcode(self, opcode, handler, mnemonic=None):
+        # Handlers are called as handler(operands, operands_type); returning 1 halts the CPU
+        self.dispatch[opcode] = handler
+        if mnemonic is not None:
+            self.opcode_names[opcode] = mnemonic
+
     def execute(self, opcode, operands, operands_type):
         try:
-            if opcode == 1:  # ADD
-                result = self.registers[operands[1]] + self.registers[operands[2]]
-                self.registers[operands[0]] = result
-                self.set_flags(result)
-            
-            elif opcode == 38:  # ADDI
-                print("ADDI")
-                print("operands: ", operands)
-                result = self.registers[operands[1]] + operands[2]
-                print(result)
-                #user_input = input("next instr: ")
-                self.registers[operands[0]] = result
-                self.set_flags(result)
-
-            elif opcode == 2:  # SUB
-                result = self.registers[operands[1]] - self.registers[operands[2]]
-                self.registers[operands[0]] = result
-                self.set_flags(result)
-            elif opcode == 3:  # FADD
-                result = self.floating_point_registers[operands[1]] + self.floating_point_registers[operands[2]]
-                self.floating_point_registers[operands[0]] = result
-            elif opcode == 4:  # FSUB
-                result = self.floating_point_registers[operands[1]] - self.floating_point_registers[operands[2]]
-                self.floating_point_registers[operands[0]] = result
-            elif opcode == 5:  # VADD
-                for i in range(4):
-                    self.vector_registers[operands[0]][i] = self.vector_registers[operands[1]][i] + self.vector_registers[operands[2]][i] 
-            elif opcode == 6:  # VSUB
-                for i in range(4):
-                    self.vector_registers[operands[0]][i] = self.vector_registers[operands[1]][i] - self.vector_registers[operands[2]][i]
-            elif opcode == 7:  # MUL
-                result = self.registers[operands[1]] * self.registers[operands[2]]
-                self.registers[operands[0]] = result
-                self.set_flags(result)
-            elif opcode == 8:  # DIV
-                if self.registers[operands[2]] != 0:
-                    result = self.registers[operands[1]] / self.registers[operands[2]]
-                    self.registers[operands[0]] = result
-                    self.set_flags(result)
-                else:
-                    raise ZeroDivisionError("Division by zero")
-            elif opcode == 9:  # FMUL
-                result = self.floating_point_registers[operands[1]] * self.floating_point_registers[operands[2]]
-                self.floating_point_registers[operands[0]] = result
-            elif opcode == 10:  # FDIV
-                if self.floating_point_registers[operands[2]] != 0.0:
-                    result = self.floating_point_registers[operands[1]] / self.floating_point_registers[operands[2]]
-                    self.floating_point_registers[operands[0]] = result
-                else:
-                    raise ZeroDivisionError("Division by zero")
-            elif opcode == 11:  # VMUL
-                for i in range(4):
-                    self.vector_registers[operands[0]][i] = self.vector_registers[operands[1]][i] * self.vector_registers[operands[2]][i]
-            elif opcode == 12:  # VDIV
-                for i in range(4):
-                    if self.vector_registers[operands[2]][i] != 0.0:
-                        self.vector_registers[operands[0]][i] = self.vector_registers[operands[1]][i] / self.vector_registers[operands[2]][i]
-                    else:
-                        raise ZeroDivisionError("Division by zero")
-            elif opcode == 13:  # LOAD
-                print("LOAD")
-                print(operands[0])
-                print(operands[1])
-                #print(self.registers[operands[1]])
-                if(operands_type[1] == 1):
-                    print(self.registers[operands[1]])
-                    self.registers[operands[0]] = self.memory.read(self.registers[operands[1]] + operands[2])
-                else:
-                    self.registers[operands[0]] = self.memory.read(operands[1] + operands[2])
-            elif opcode == 14:  # STORE
-                self.memory.load(self.registers[operands[1]] + operands[2], self.registers[operands[0]])
-            elif opcode == 15:  # CMP
-                result = self.registers[operands[0]] - self.registers[operands[1]]
-                #user_input = input("next instr: ")
-                print(result)
-                #user_input = input("next instr: ")
-                self.set_flags(result)
-            elif opcode == 16:  # FCMP
-                result = self.floating_point_registers[operands[0]] - self.floating_point_registers[operands[1]]
-                self.set_flags(result)
-            elif opcode == 17:  # JUMP
-                self.pc = operands[3]
-                print("pc _ after JMP = ", self.pc)
-                #user_input = input("next instr: ")
-            elif opcode == 18:  # JZ (Jump if Zero)
-                #user_input = input("next instr: ")
-                print(self.flags)
-                if self.flags['Z']:
-                    self.pc = operands[3]
-                #user_input = input("next instr: ")
-            elif opcode == 19:  # JNZ (Jump if Not Zero)
-                if not self.flags['Z']:
-                    self.pc = operands[3]
-            elif opcode == 20:  # FMOV
-                self.floating_point_registers[operands[0]] = float(operands[1])
-            elif opcode == 21:  # HALT
-                #exit()
-                return 1
-                #raise SystemExit
-            elif opcode == 22:  # PIM_ADD
-                self.memory.pim_add(operands[0], operands[1], operands[2])
-            elif opcode == 23:  # PIM_SUB
-                self.memory.pim_sub(operands[0], operands[1], operands[2])
-            elif opcode == 24:  # PIM_MUL
-                self.memory.pim_mul(operands[0], operands[1], operands[2])
-            elif opcode == 25:  # PIM_DIV
-                self.memory.pim_div(operands[0], operands[1], operands[2])
-            elif opcode == 26:  # PIM_FADD
-                self.memory.pim_fadd(operands[0], operands[1], operands[2])
-            elif opcode == 27:  # PIM_FSUB
-                self.memory.pim_fsub(operands[0], operands[1], operands[2])
-            elif opcode == 28:  # PIM_FMUL
-                self.memory.pim_fmul(operands[0], operands[1], operands[2])
-            elif opcode == 29:  # PIM_FDIV
-                self.memory.pim_fdiv(operands[0], operands[1], operands[2])
-            elif opcode == 30:  # INT
-                self.push_stack(self.pc)
-                self.interrupt_flag = operands[0]
-            elif opcode == 31:  # IRET
-                self.pc = self.pop_stack()
-            elif opcode == 32:  # IN (Read from peripheral)
-                self.registers[operands[0]] = self.read_from_peripheral(operands[1]) #self.queues[operands[1]].get() #
-            elif opcode == 33:  # OUT (Write to peripheral)
-                print("OUT ex", operands_type)
-                if(operands_type == [1,1]):
-                    self.write_to_peripheral(self.registers[operands[0]], self.registers[operands[1]])
-                    #self.queues[self.registers[operands[0]]].put(self.registers[operands[1]])
-                elif (operands_type == [1,2]):
-                    self.write_to_peripheral(self.registers[operands[0]], operands[1])
-                    #self.queues[self.registers[operands[0]]].put(operands[1])
-                elif (operands_type == [2,2]):
-                    self.write_to_peripheral(operands[0], operands[1])
-                    #self.queues[operands[0]].put(operands[1])
-                elif (operands_type == [2,1]):
-                    self.write_to_peripheral(operands[0], self.registers[operands[1]])
-                    #self.queues[operands[0]].put(self.registers[operands[1]])             
-            elif opcode == 35:  # CALL
-                self.push_stack(self.pc)
-                self.pc = operands[0]
-            elif opcode == 36:  # RET
-                self.pc = self.pop_stack()
-            elif opcode == 37:  # MOV
-                if operands_type[1] == 1:
-                    self.registers[operands[0]] = self.registers[operands[1]]
-                else:
-                    self.registers[operands[0]] = operands[1]
+            return self.dispatch[opcode](operands, operands_type)
         except ZeroDivisionError as e:
-            print(e)
+            logger.warning("pc = %04X: %s", self.pc - 1, e)
+
+    def op_nop(self, operands, operands_type):
+        pass
+
+    def op_add(self, operands, operands_type):
+        result = self.registers[operands[1]] + self.registers[operands[2]]
+        self.registers[operands[0]] = result
+        self.set_flags(result)
+
+    def op_addi(self, operands, operands_type):
+        result = self.registers[operands[1]] + operands[2]
+        if self.trace:
+            logger.log(TRACE, "ADDI R%d = R%d + %d = %s", operands[0], operands[1], operands[2], result)
+        self.registers[operands[0]] = result
+        self.set_flags(result)
+
+    def op_sub(self, operands, operands_type):
+        result = self.registers[operands[1]] - self.registers[operands[2]]
+        self.registers[operands[0]] = result
+        self.set_flags(result)
+
+    def op_fadd(self, operands, operands_type):
+        result = self.floating_point_registers[operands[1]] + self.floating_point_registers[operands[2]]
+        self.floating_point_registers[operands[0]] = result
+
+    def op_fsub(self, operands, operands_type):
+        result = self.floating_point_registers[operands[1]] - self.floating_point_registers[operands[2]]
+        self.floating_point_registers[operands[0]] = result
+
+    # Vector ops work on whole registers with one NumPy call and only write the lanes enabled in vector_mask
+    def vector_op(self, kernel, operands):
+        vectors = self.vector_registers
+        kernel(vectors[operands[1]], vectors[operands[2]], out=vectors[operands[0]], where=self.vector_mask)
+
+    def op_vadd(self, operands, operands_type):
+        self.vector_op(np.add, operands)
+
+    def op_vsub(self, operands, operands_type):
+        self.vector_op(np.subtract, operands)
+
+    def op_mul(self, operands, operands_type):
+        result = self.registers[operands[1]] * self.registers[operands[2]]
+        self.registers[operands[0]] = result
+        self.set_flags(result)
+
+    def op_div(self, operands, operands_type):
+        if self.registers[operands[2]] != 0:
+            result = self.registers[operands[1]] / self.registers[operands[2]]
+            self.registers[operands[0]] = result
+            self.set_flags(result)
+        else:
+            raise ZeroDivisionError("Division by zero")
+
+    def op_fmul(self, operands, operands_type):
+        result = self.floating_point_registers[operands[1]] * self.floating_point_registers[operands[2]]
+        self.floating_point_registers[operands[0]] = result
+
+    def op_fdiv(self, operands, operands_type):
+        if self.floating_point_registers[operands[2]] != 0.0:
+            result = self.floating_point_registers[operands[1]] / self.floating_point_registers[operands[2]]
+            self.floating_point_registers[operands[0]] = result
+        else:
+            raise ZeroDivisionError("Division by zero")
+
+    def op_vmul(self, operands, operands_type):
+        self.vector_op(np.multiply, operands)
+
+    def op_vdiv(self, operands, operands_type):
+        # Lanes dividing by zero are set to 0.0 and set the V flag instead of stopping the whole vector
+        divisor = self.vector_registers[operands[2]]
+        zero = self.vector_mask & (divisor == 0.0)
+        np.divide(self.vector_registers[operands[1]], divisor, out=self.vector_registers[operands[0]],
+                  where=self.vector_mask & ~zero)
+        self.vector_registers[operands[0]][zero] = 0.0
+        self.flags['V'] = int(zero.any())
+
+    def op_vload(self, operands, operands_type):  # VLOAD %Vd, %Ra: vector_length words from memory at Ra
+        words, is_float = self.memory.gather(self.registers[operands[1]], self.vector_length, 1)
+        np.copyto(self.vector_registers[operands[0]], self.memory.float_values(words, is_float), where=self.vector_mask)
+
+    def op_vstore(self, operands, operands_type):  # VSTORE %Vs, %Ra: enabled lanes as float words at Ra + lane
+        values = self.vector_registers[operands[0]].copy()
+        address = self.registers[operands[1]]
+        if self.vector_mask.all():
+            self.memory.scatter(address, 1, values.view(np.int64), values)
+        else:
+            for lane in np.flatnonzero(self.vector_mask).tolist():
+                self.memory.load(address + lane, float(values[lane]))
+
+    def op_vsum(self, operands, operands_type):  # VSUM %Fd, %Vs
+        self.floating_point_registers[operands[0]] = float(self.vector_registers[operands[1]][self.vector_mask].sum())
 
-    def add_peripheral(self, peripheral):
+    def op_vdot(self, operands, operands_type):  # VDOT %Fd, %Va, %Vb
+        mask = self.vector_mask
+        self.floating_point_registers[operands[0]] = float(np.dot(self.vector_registers[operands[1]][mask],
+                                                                  self.vector_registers[operands[2]][mask]))
+
+    def op_vmax(self, operands, operands_type):  # VMAX %Fd, %Vs; -inf when no lane is enabled
+        lanes = self.vector_registers[operands[1]][self.vector_mask]
+        self.floating_point_registers[operands[0]] = float(lanes.max()) if lanes.size else float('-inf')
+
+    def op_vsetmask(self, operands, operands_type):  # VSETMASK %Rm: lane i is enabled when bit i of Rm is set
+        bits = np.uint64(self.registers[operands[0]] & WORD_MASK)
+        self.vector_mask[:] = (self.lane_bits & bits) != 0
+
+    def op_load(self, operands, operands_type):
+        if(operands_type[1] == 1):
+            address = self.registers[operands[1]] + operands[2]
+        else:
+            address = operands[1] + operands[2]
+        self.registers[operands[0]] = self.memory.read(address)
+        if self.trace:
+            logger.log(TRACE, "LOAD R%d = [%04X] = %s", operands[0], address, self.registers[operands[0]])
+
+    def op_store(self, operands, operands_type):
+        self.memory.load(self.registers[operands[1]] + operands[2], self.registers[operands[0]])
+
+    def op_cmp(self, operands, operands_type):
+        result = self.registers[operands[0]] - self.registers[operands[1]]
+        if self.trace:
+            logger.log(TRACE, "CMP R%d - R%d = %s", operands[0], operands[1], result)
+        self.set_flags(result)
+
+    def op_fcmp(self, operands, operands_type):
+        result = self.floating_point_registers[operands[0]] - self.floating_point_registers[operands[1]]
+        self.set_flags(result)
+
+    def op_jump(self, operands, operands_type):
+        self.pc = operands[3]
+
+    def op_jz(self, operands, operands_type):  # Jump if Zero
+        if self.trace:
+            logger.log(TRACE, "JZ flags = %s", self.flags)
+        if self.flags['Z']:
+            self.pc = operands[3]
+
+    def op_jnz(self, operands, operands_type):  # Jump if Not Zero
+        if not self.flags['Z']:
+            self.pc = operands[3]
+
+    def op_fmov(self, operands, operands_type):
+        self.floating_point_registers[operands[0]] = float(operands[1])
+
+    def op_halt(self, operands, operands_type):
+        return 1
+
+    def op_wfi(self, operands, operands_type):
+        # Wait for interrupt: sleeps until a device requests one. Each wait is bounded so batches, budgets and
+        # rendering keep running; the PC stays on the WFI until an interrupt is pending. Without asynchronous
+        # interrupt sources nothing could wake the CPU, and a running timer only advances with retired
+        # instructions, so in both cases WFI falls through like a NOP.
+        if self.replayer is not None:
+            if self.replayer.waited():
+                self.pc -= 1
+            return
+        if not self.interrupt_pending and self.interrupt_sources and self.next_deadline() is None:
+            self.wakeup.wait(WFI_TIMEOUT)
+            self.wakeup.clear()
+            if not self.interrupt_pending:
+                self.pc -= 1
+                if self.recorder is not None:
+                    self.recorder.waited()
+
+    def op_pim_add(self, operands, operands_type):
+        self.memory.pim_add(operands[0], operands[1], operands[2])
+
+    def op_pim_sub(self, operands, operands_type):
+        self.memory.pim_sub(operands[0], operands[1], operands[2])
+
+    def op_pim_mul(self, operands, operands_type):
+        self.memory.pim_mul(operands[0], operands[1], operands[2])
+
+    def op_pim_div(self, operands, operands_type):
+        self.memory.pim_div(operands[0], operands[1], operands[2])
+
+    def op_pim_fadd(self, operands, operands_type):
+        self.memory.pim_fadd(operands[0], operands[1], operands[2])
+
+    def op_pim_fsub(self, operands, operands_type):
+        self.memory.pim_fsub(operands[0], operands[1], operands[2])
+
+    def op_pim_fmul(self, operands, operands_type):
+        self.memory.pim_fmul(operands[0], operands[1], operands[2])
+
+    def op_pim_fdiv(self, operands, operands_type):
+        self.memory.pim_fdiv(operands[0], operands[1], operands[2])
+
+    # Range PIM: PIM_Rxxx %Rc, %Ra, %Rb, %Rn runs the PIM op over Rn elements of the arrays at Ra and Rb into Rc,
+    # stepping every address by the stride set with PIM_STRIDE %Rs (1 after reset)
+    def pim_range(self, operation, operands):
+        registers = self.registers
+        self.memory.pim_range(operation, registers[operands[1]], registers[operands[2]], registers[operands[0]],
+                              registers[operands[3] & 0xFFF], self.pim_stride)
+
+    def op_pim_radd(self, operands, operands_type):
+        self.pim_range('add', operands)
+
+    def op_pim_rsub(self, operands, operands_type):
+        self.pim_range('sub', operands)
+
+    def op_pim_rmul(self, operands, operands_type):
+        self.pim_range('mul', operands)
+
+    def op_pim_rdiv(self, operands, operands_type):
+        self.pim_range('div', operands)
+
+    def op_pim_rfadd(self, operands, operands_type):
+        self.pim_range('fadd', operands)
+
+    def op_pim_rfsub(self, operands, operands_type):
+        self.pim_range('fsub', operands)
+
+    def op_pim_rfmul(self, operands, operands_type):
+        self.pim_range('fmul', operands)
+
+    def op_pim_rfdiv(self, operands, operands_type):
+        self.pim_range('fdiv', operands)
+
+    def op_pim_stride(self, operands, operands_type):
+        self.pim_stride = self.registers[operands[0]]
+
+    def op_int(self, operands, operands_type):
+        # Software interrupt, entered right away with the next instruction as the return address
+        self.interrupt_controller.enter(operands[0])
+        self.enter_interrupt(operands[0])
+
+    def request_interrupt(self, number):
+        # Device interrupt: sets the line pending on the interrupt controller. May be called from other threads.
+        self.interrupt_controller.raise_line(number)
+
+    def op_iret(self, operands, operands_type):
+        self.pc = self.pop_stack()
+        self.interrupt_controller.end_of_interrupt()
+
+    def op_in(self, operands, operands_type):  # Read from peripheral
+        self.registers[operands[0]] = self.read_from_peripheral(operands[1])
+
+    def op_out(self, operands, operands_type):  # Write to peripheral
+        if(operands_type == [1,1]):
+            self.write_to_peripheral(self.registers[operands[0]], self.registers[operands[1]])
+        elif (operands_type == [1,2]):
+            self.write_to_peripheral(self.registers[operands[0]], operands[1])
+        elif (operands_type == [2,2]):
+            self.write_to_peripheral(operands[0], operands[1])
+        elif (operands_type == [2,1]):
+            self.write_to_peripheral(operands[0], self.registers[operands[1]])
+
+    def op_call(self, operands, operands_type):
+        self.push_stack(self.pc)
+        self.pc = operands[0]
+
+    def op_ret(self, operands, operands_type):
+        self.pc = self.pop_stack()
+
+    def op_mov(self, operands, operands_type):
+        if operands_type[1] == 1:
+            self.registers[operands[0]] = self.registers[operands[1]]
+        else:
+            self.registers[operands[0]] = operands[1]
+
+    def add_peripheral(self, peripheral, size=None):
+        # Maps the device at its base address; size defaults to the device's ADDRESS_SPACE.
+        # Raises ValueError if the range overlaps a device that is already mapped.
+        if size is None:
+            size = getattr(peripheral, 'ADDRESS_SPACE', Peripheral.ADDRESS_SPACE)
+        self.bus.map(peripheral, peripheral.base_address, size)
         self.peripherals[peripheral.base_address] = peripheral
+        peripheral.attach(self)
+
+    def remove_peripheral(self, peripheral):
+        self.bus.unmap(peripheral)
+        self.peripherals.pop(peripheral.base_address, None)
+        peripheral.detach(self)
 
     def read_from_peripheral(self, address):
-        for base_address, peripheral in self.peripherals.items():
-            if base_address <= address < base_address + 0x100:  # Assuming each peripheral uses 16 addresses
-                return peripheral.read(address - base_address)
-        raise IndexError("Peripheral address out of range")
+        if self.replayer is not None:
+            return self.replayer.read(address)
+        if self.recorder is not None:
+            return self.recorder.read(address)
+        return self.bus.read(address)
 
     def write_to_peripheral(self, address, value):
-        for base_address, peripheral in self.peripherals.items():
-            if base_address <= address < base_address + 0x400:  # Assuming each peripheral uses 16 addresses
-                peripheral.write(address - base_address, value)
-                return
-        raise IndexError("Peripheral address out of range")
+        if self.replayer is not None:
+            self.replayer.write(address, value)
+        elif self.recorder is not None:
+            self.recorder.write(address, value)
+        else:
+            self.bus.write(address, value)
+
+    def start_recording(self, file_path):
+        # Logs device input from here on (see replay.py); the log starts with a snapshot of the machine
+        self.recorder = ReplayRecorder(self, file_path)
+        return self.recorder
+
+    def stop_recording(self):
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.close()
+            self.recorder = None
+        return recorder
+
+    def start_replay(self, file_path):
+        # Restores the recorded starting state and feeds the log back. Attached peripherals are bypassed,
+        # so a replay needs none of them.
+        player = ReplayPlayer(self, file_path)
+        player.start()
+        self.interrupt_controller.pending = 0  # Interrupts come from the log only
+        self.interrupt_controller.update()
+        self.replayer = player
+        self.timers.append(player)
+        return player
+
+    def stop_replay(self):
+        player = self.replayer
+        if player is not None:
+            self.timers.remove(player)
+            self.replayer = None
+        return player
+
+    def add_breakpoint(self, address):
+        self.breakpoints.add(address)
+
+    def remove_breakpoint(self, address):
+        self.breakpoints.discard(address)
+
+    def step(self, n=1):
+        return self.run_until(cycles=n)
+
+    def run_until(self, pc=None, cycles=None):
+        # Runs until HALT, a breakpoint (or the given pc), `cycles` more retired instructions, or a fault,
+        # and returns the matching STOP_* reason. A breakpoint at the starting PC does not stop the run,
+        # so run_until() can resume from the breakpoint it last stopped at.
+        breakpoints = self.breakpoints
+        if pc is not None:
+            breakpoints = breakpoints | {pc}
+        limit = self.retired + cycles if cycles is not None else NO_LIMIT
+        self.fault = None
+        resume = True
+        try:
+            while True:
+                # Batches end at the nearest timer deadline so timers need no per-instruction work.
+                # Timers programmed during the batch pull batch_end in through schedule().
+                deadline = self.next_deadline()
+                self.batch_end = deadline if deadline is not None and deadline < limit else limit
+                if self.tracer is not None:
+                    reason = self.run_traced(breakpoints, resume)
+                elif self.profiler is not None:
+                    reason = self.run_profiled(breakpoints, resume)
+                elif self.jit is not None and not self.trace:
+                    reason = self.run_blocks(breakpoints, resume)
+                else:
+                    reason = self.run_interpreted(breakpoints, resume)
+                if reason != STOP_BUDGET or self.retired >= limit:
+                    break
+                self.expire_timers()
+                resume = False
+        except Exception as e:
+            self.fault = e
+            logger.debug("fault at pc = %04X: %r", self.pc, e)
+            return STOP_FAULT
+        if reason == STOP_HALT:
+            self.flush_peripherals()
+        return reason
+
+    def schedule(self, deadline):
+        # A device needs service once `deadline` instructions have retired; ends the running batch there
+        if deadline < self.batch_end:
+            self.batch_end = deadline
+
+    def next_deadline(self):
+        deadline = None
+        for timer in self.timers:
+            if timer.deadline is not None and (deadline is None or timer.deadline < deadline):
+                deadline = timer.deadline
+        return deadline
+
+    def expire_timers(self):
+        for timer in list(self.timers):
+            if timer.deadline is not None and timer.deadline <= self.retired:
+                timer.expire()
+
+    def run_interpreted(self, breakpoints, resume=True):
+        # Runs until self.batch_end instructions have retired. resume: a breakpoint at the starting PC
+        # does not stop the run. self.retired is kept current for devices that read it.
+        trace = self.trace
+        fetch_decoded = self.fetch_decoded
+        execute = self.execute
+        memory_size = self.memory.size
+        retired = self.retired
+        first = resume
+        try:
+            while True:
+                if self.interrupt_pending:
+                    self.handle_interrupt()
+                pc = self.pc
+                if pc >= memory_size:
+                    raise IndexError("PC out of memory range")
+                if retired >= self.batch_end:
+                    return STOP_BUDGET
+                if breakpoints and pc in breakpoints and not first:
+                    return STOP_BREAKPOINT
+                first = False
+                opcode, operands, operands_type = fetch_decoded()
+                if trace:
+                    logger.log(TRACE, "pc = %s opcode = %d registers = %s", self.describe_pc(pc), opcode, self.registers)
+                retired += 1
+                self.retired = retired
+                if execute(opcode, operands, operands_type) == 1:
+                    return STOP_HALT
+        finally:
+            self.retired = retired
+
+    def run_profiled(self, breakpoints, resume=True):
+        # run_interpreted that reports every retired instruction to self.profiler. Kept separate so the
+        # other loops pay nothing for profiling.
+        profiler = self.profiler
+        pc_counts = profiler.pc_counts
+        opcode_counts = profiler.opcode_counts
+        stacks = profiler.stacks
+        fetch_decoded = self.fetch_decoded
+        execute = self.execute
+        memory_size = self.memory.size
+        retired = self.retired
+        first = resume
+        try:
+            while True:
+                if self.interrupt_pending:
+                    line = self.handle_interrupt()
+                    if line is not None:
+                        profiler.interrupt(line, retired)
+                pc = self.pc
+                if pc >= memory_size:
+                    raise IndexError("PC out of memory range")
+                if retired >= self.batch_end:
+                    return STOP_BUDGET
+                if breakpoints and pc in breakpoints and not first:
+                    return STOP_BREAKPOINT
+                first = False
+                opcode, operands, operands_type = fetch_decoded()
+                retired += 1
+                self.retired = retired
+                profiler.retired += 1
+                pc_counts[pc] += 1
+                opcode_counts[opcode] += 1
+                stacks[profiler.stack] += 1
+                if opcode in PROFILED_OPCODES:
+                    profiler.before(opcode, operands, operands_type)
+                    result = execute(opcode, operands, operands_type)
+                    profiler.after(opcode)
+                else:
+                    result = execute(opcode, operands, operands_type)
+                if result == 1:
+                    return STOP_HALT
+        finally:
+            self.retired = retired
+
+    def run_traced(self, breakpoints, resume=True):
+        # run_interpreted that writes each instruction and its effects to self.tracer: the instruction
+        # word, changed registers and flags, port values and delivered interrupts. Memory writes reach
+        # the tracer through its memory write listener.
+        tracer = self.tracer
+        record = tracer.record
+        registers = self.registers
+        floating_point_registers = self.floating_point_registers
+        flags = self.flags
+        rom_size = len(self.rom.memory)
+        fetch_decoded = self.fetch_decoded
+        execute = self.execute
+        memory_size = self.memory.size
+        retired = self.retired
+        first = resume
+        try:
+            while True:
+                if self.interrupt_pending:
+                    line = self.handle_interrupt()
+                    if line is not None:
+                        record(INTERRUPT, line, self.pc, 0)
+                pc = self.pc
+                if pc >= memory_size:
+                    raise IndexError("PC out of memory range")
+                if retired >= self.batch_end:
+                    return STOP_BUDGET
+                if breakpoints and pc in breakpoints and not first:
+                    return STOP_BREAKPOINT
+                first = False
+                opcode, operands, operands_type = fetch_decoded()
+                retired += 1
+                self.retired = retired
+                tracer.instruction(pc, self.rom.read(pc) if pc < rom_size else self.memory.read(pc), retired)
+                saved = registers[:]
+                saved_floats = floating_point_registers[:]
+                saved_flags = flags.copy()
+                if opcode == OP_OUT:
+                    port = registers[operands[0]] if operands_type[0] == 1 else operands[0]
+                    record(PORT_OUT, 0, port, word_bits(registers[operands[1]] if operands_type[1] == 1 else operands[1]))
+                result = execute(opcode, operands, operands_type)
+                if opcode == OP_IN:
+                    record(PORT_IN, 0, operands[1], word_bits(registers[operands[0]]))
+                if registers != saved:
+                    for index, (old, new) in enumerate(zip(saved, registers)):
+                        if old != new:
+                            record(REGISTER, index, isinstance(new, float), word_bits(new))
+                if floating_point_registers != saved_floats:
+                    for index, (old, new) in enumerate(zip(saved_floats, floating_point_registers)):
+                        if old != new:
+                            record(FLOAT_REGISTER, index, 0, word_bits(float(new)))
+                if flags != saved_flags:
+                    record(FLAGS, 0, 0, flag_bits(flags))
+                if result == 1:
+                    return STOP_HALT
+        finally:
+            self.retired = retired
+
+    def run_blocks(self, breakpoints, resume=True):
+        # Same contract as run_interpreted. Blocks see self.retired as the count before the block and
+        # advance it themselves ahead of I/O.
+        lookup = self.jit.lookup
+        fetch_decoded = self.fetch_decoded
+        execute = self.execute
+        memory_size = self.memory.size
+        retired = self.retired
+        first = resume
+        try:
+            while True:
+                if self.interrupt_pending:
+                    self.retired = retired
+                    self.handle_interrupt()
+                pc = self.pc
+                if pc >= memory_size:
+                    raise IndexError("PC out of memory range")
+                batch_end = self.batch_end
+                if retired >= batch_end:
+                    return STOP_BUDGET
+                if breakpoints and pc in breakpoints and not first:
+                    return STOP_BREAKPOINT
+                first = False
+                block = lookup(pc)
+                end = block.end
+                # Single-step when the block would overrun the batch or a breakpoint inside it
+                if retired + block.length > batch_end or \
+                        (breakpoints and any(pc < address < end for address in breakpoints)):
+                    retired += 1
+                    self.retired = retired
+                    if execute(*fetch_decoded()) == 1:
+                        return STOP_HALT
+                    continue
+                self.retired = retired
+                retired += block.length
+                try:
+                    status = block.function()
+                except Exception:
+                    # Faulting instructions set the PC past themselves first, so it tells how far the block got
+                    retired -= block.length - (self.pc - pc)
+                    raise
+                if status is not None:
+                    if status == 1:
+                        return STOP_HALT
+                    if status == BLOCK_DROPPED:
+                        retired -= block.length - (self.pc - pc)
+        finally:
+            self.retired = retired
 
     def run(self):
-        while self.pc < len(self.memory.memory):
-            self.handle_interrupt()
-            instruction = self.fetch()
-            opcode, *operands = self.decode(instruction)
-            print("opcode = ", opcode)
-            # Print all each from self.registers = [0] * 64
-            print("self.registers = ", self.registers)
-            #user_input = input("next instr: ")
-
-            operands_type = []
-            operands_type.append(operands[0])
-            operands_type.append(operands[1])
-            #if opcode != 0:
-                #print(f"{instruction:016X}\n")
-                #print(opcode)
-                #print(operands)
-                #print("operands type = ", operands_type)
-                #print("operands = ", operands[2:])
-
-            if (self.execute(opcode, operands[2:], operands_type) == 1):
+        # Runs to completion in frame-sized batches, rendering peripherals between batches
+        frame_interval = self.frame_interval
+        while True:
+            reason = self.run_until(cycles=frame_interval or RUN_BATCH)
+            if frame_interval:
+                self.render_peripherals()
+            if reason != STOP_BUDGET:
                 break
-            self.render_peripherals()
+        if reason == STOP_FAULT:
+            logger.error("CPU fault at pc = %s: %s", self.describe_pc(self.pc), self.fault)
+        return reason
+
+    def flush_peripherals(self):
+        for peripheral in self.peripherals.values():
+            peripheral.flush()
 
     def render_peripherals(self):
         for peripheral in self.peripherals.values():
-            if isinstance(peripheral, Terminal):
+            if isinstance(peripheral, (Terminal, Display)):
                 peripheral.render()
 
 
 
 def main():
     parser = argparse.ArgumentParser(description="CPU Emulator with Peripheral Support")
-    parser.add_argument("input_file", type=str, help="File with memory dump (address-value pairs)")
-    parser.add_argument("--image_file", type=str, help="File with fat16 image")
-    parser.add_argument("--start_address", type=int, required=True, help="Start address for program execution in memory")
+    parser.add_argument("input_file", type=str, nargs='?', help="File with memory dump (address-value pairs)")
+    parser.add_argument("--image_file", type=str, help="File with fat16 image, attached as block storage at 0x300")
+    parser.add_argument("--sector-cache", type=int, default=64, help="Block storage cache size in sectors (0 = no cache)")
+    parser.add_argument("--keyboard-script", type=str, help="File whose bytes are typed into the keyboard")
+    parser.add_argument("--keyboard-tty", action="store_true", help="Read keys from the terminal in a background thread")
+    parser.add_argument("--rom_file", type=str, help="ROM contents; boots from address 0 (requires input_file)")
+    parser.add_argument("--start_address", type=int, help="Start address for program execution in memory")
     parser.add_argument("--interrupt_file", type=str, help="File with interrupt handlers (address-value pairs)")
+    parser.add_argument("--log-level", type=str, default="WARNING", help="Logging level (TRACE, DEBUG, INFO, WARNING, ...)")
+    parser.add_argument("--trace", action="store_true", help="Log every instruction (same as --log-level TRACE)")
+    parser.add_argument("--memory-backing", choices=Memory.BACKINGS, default='paged', help="Memory backing store")
+    parser.add_argument("--jit", action="store_true", help="Translate basic blocks to Python functions")
+    parser.add_argument("--vector-length", type=int, default=VECTOR_LENGTH, help="Lanes per vector register (1..64)")
+    parser.add_argument("--headless", action="store_true", help="Never render peripherals and do not wait for input at exit")
+    parser.add_argument("--frame-interval", type=int, default=10000, help="Instructions between peripheral renders")
+    parser.add_argument("--display", choices=DISPLAY_BACKENDS, help="Display backend (default: tk, or null with --headless)")
+    parser.add_argument("--frame-dump", type=str, help="Headless display: frame file pattern, e.g. frames/{frame:05d}.png (.raw for raw buffers)")
+    parser.add_argument("--frame-dump-every", type=int, default=0, help="Headless display: dump every n frames (0 = only the final frame)")
+    parser.add_argument("--restore-snapshot", type=str, help="Start from a machine snapshot instead of loading dump files")
+    parser.add_argument("--save-snapshot", type=str, help="Write a machine snapshot when execution stops")
+    parser.add_argument("--trace-file", type=str, help="Record a binary execution trace (interpreter only); decode it with trace_decode.py")
+    parser.add_argument("--trace-ring", type=int, help="With --trace-file: keep only the newest n trace records in memory and write them at exit")
+    parser.add_argument("--record", type=str, help="Log device input and interrupt points for --replay")
+    parser.add_argument("--replay", type=str, help="Rerun a --record log without devices or input files")
+    parser.add_argument("--symbols", type=str, help="Symbol file for traces and profiles (default: input_file's .sym, if any)")
+    parser.add_argument("--profile", type=str, help="Profile the guest (interpreter only) and write a hot-spot report here")
+    parser.add_argument("--profile-stacks", type=str, help="With --profile: collapsed call stacks for flame graphs")
     args = parser.parse_args()
 
-    cpu = CPU()
-    # Add the storage peripheral
-    storage = Storage(base_address=0x400, size=1024)  # Fix spelling and add size
+    logging.basicConfig(level=TRACE if args.trace else args.log_level.upper(), format="%(levelname)s %(message)s")
+    cpu = CPU(memory_backing=args.memory_backing, vector_length=args.vector_length)
+    # A headless display backend still needs frames to dump, everything else skips rendering under --headless
+    cpu.frame_interval = 0 if args.headless and args.display != 'headless' else args.frame_interval
+    if args.profile and args.trace_file:
+        parser.error("--profile and --trace-file cannot be used together")
+    if args.jit:
+        cpu.enable_jit()
+    if args.replay:
+        # Nothing is attached: every device input comes from the log
+        cpu.start_replay(args.replay)
+    else:
+        # Add the storage peripheral
+        storage = Storage(base_address=0x400, size=1024)  # Fix spelling and add size
     
-    print(not args.input_file)
-    print(not args.interrupt_file)
-    print(not (args.start_address != None))
-    print(not args.image_file)
-    if not args.image_file:
-        if not (args.input_file != None) or not (args.interrupt_file != None) or not (args.start_address != None):
-            parser.error("Mode 1 requires --input_file, --interrupt_file, and --start_address")
+        if args.image_file:
+            cpu.add_peripheral(BlockStorage(base_address=0x300, image_path=args.image_file, cache_sectors=args.sector_cache))
+
+        if args.restore_snapshot:
+            cpu.add_peripheral(storage)
+        elif not args.rom_file:
+            if not (args.input_file != None) or not (args.interrupt_file != None):
+                parser.error("Mode 1 requires --input_file, --interrupt_file, and --start_address")
+            if args.start_address is None and not is_image(args.input_file):
+                parser.error("--start_address is required for hex dumps")
         
-        cpu.load_interrupt_handlers(args.interrupt_file)
-        cpu.load_memory_dump(args.input_file)
-        cpu.add_peripheral(storage)
-        cpu.pc = args.start_address
-    elif args.image_file:
-        if not args.input_file or not args.rom_file:
-            parser.error("Mode 2 requires --input_file and --rom_file")
-
-        storage.preload_image_from_file(args.image_file)
-        cpu.add_peripheral(storage)
-        cpu.rom.load_from_file(args.rom_file)
-        cpu.load_memory_dump(args.input_file)
-        cpu.pc = 0  # Start execution from the beginning of ROM
-
-    # Create instances of the peripheral devices
-    display = Display(base_address=0x800)
-    keyboard = Keyboard(base_address=0x0c00)
-    rand_gen = RandomNumberGenerator(base_address=0x1000)
-
-    cpu.add_peripheral(display)
-    cpu.add_peripheral(keyboard)
-    cpu.add_peripheral(rand_gen)
+            cpu.load_interrupt_handlers(args.interrupt_file)
+            entry = cpu.load_memory_dump(args.input_file)
+            cpu.add_peripheral(storage)
+            cpu.pc = args.start_address if args.start_address is not None else entry
+        else:
+            if not args.input_file:
+                parser.error("Mode 2 requires --input_file and --rom_file")
+
+            cpu.add_peripheral(storage)
+            cpu.rom.load_from_file(args.rom_file)
+            cpu.load_memory_dump(args.input_file)
+            cpu.pc = 0  # Start execution from the beginning of ROM
+
+        # Create instances of the peripheral devices
+        display_backend = args.display or ('null' if args.headless else 'tk')
+        display = Display(base_address=0x800, backend=make_display_backend(display_backend, args.frame_dump, args.frame_dump_every))
+        keyboard = Keyboard(base_address=0x200)  # KEYBOARD_INTERRUPT reads its data port at 0x201
+        rand_gen = RandomNumberGenerator(base_address=0x1000)
+
+        cpu.add_peripheral(display)
+        cpu.add_peripheral(keyboard)
+        if args.keyboard_script:
+            keyboard.load_script(args.keyboard_script)
+        if args.keyboard_tty:
+            keyboard.start_host_reader()
+        cpu.add_peripheral(rand_gen)
+        cpu.add_peripheral(cpu.interrupt_controller)
+        cpu.add_peripheral(Timer(base_address=TIMER_BASE))
+        cpu.add_peripheral(DMAController(base_address=DMA_BASE))
+        if args.restore_snapshot:
+            cpu.restore(Snapshot.load(args.restore_snapshot))
+    if args.symbols:
+        cpu.symbols = SymbolTable.load(args.symbols)
+    elif args.input_file:
+        cpu.symbols = SymbolTable.for_program(args.input_file)
+    if args.profile:
+        cpu.enable_profiler()
+    if args.trace_file:
+        cpu.enable_tracer(args.trace_file, args.trace_ring)
+    if args.record:
+        cpu.start_recording(args.record)
     #user_input = input("cpu start ")
-    cpu.run()
-    user_input = input("cpu stop ")
+    reason = cpu.run()
+    cpu.stop_recording()
+    cpu.disable_tracer()
+    if args.replay and reason == STOP_HALT and not cpu.replayer.finished():
+        logger.warning("replay halted before the end of the log")
+    if args.profile:
+        cpu.profiler.write_report(args.profile)
+        if args.profile_stacks:
+            cpu.profiler.write_collapsed(args.profile_stacks)
+    if args.save_snapshot:
+        cpu.snapshot().save(args.save_snapshot)
+    if not args.replay:
+        keyboard.stop_host_reader()
+        display.close()
+    if args.image_file and not args.replay:
+        block_storage = cpu.peripherals[0x300]
+        block_storage.close()
+        logger.info("block storage: %s", block_storage.stats())
+    if not args.headless:
+        user_input = input("cpu stop ")
     print("Registers:", cpu.registers)
     print("Floating Point Registers:", cpu.floating_point_registers)
     print("Vector Registers:", cpu.vector_registers)
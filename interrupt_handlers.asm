@@ -13,7 +13,10 @@ dd 0x9000
 dd KEYBOARD_INTERRUPT:
         ; Handle keyboard input
         IN %R0, #0x201
-        STORE %R0, LAST_KEY_PRESSED
+        STORE %R31, %R14, 0x0   ; R14 is the next free stack slot: keep the interrupted R31 there
+        MOV %R31, 0x0
+        STORE %R0, %R31, LAST_KEY_PRESSED
+        LOAD %R31, %R14, 0x0
         IRET
 .org 0x6000
 DISPLAY_INTERRUPT:
@@ -110,7 +113,7 @@ READ_FILE_CONTENTS:
         ; TODO: Add logic to read the file contents
         RET
 
-.org 0x1000
+.org 0xF00                ; STORE offsets are 12 bits wide
 LAST_KEY_PRESSED:
         dw 0
 BYTES_PER_SECTOR:
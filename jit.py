@@ -0,0 +1,331 @@
+import logging
+
+from assembler import Assembler
+
+logger = logging.getLogger(__name__)
+
+MAX_BLOCK_LENGTH = 64
+BLOCK_DROPPED = 2  # Returned by a block that stopped early because a store dropped it (1 means HALT)
+
+
+class Untranslatable(Exception):
+    pass
+
+
+class Block:
+    __slots__ = ('start', 'end', 'length', 'function', 'source')
+
+    def __init__(self, start, end, function, source):
+        self.start = start
+        self.end = end  # First address after the block
+        self.length = end - start
+        self.function = function  # Runs the whole block, returns 1 on HALT or BLOCK_DROPPED
+        self.source = source
+
+
+class BlockBuilder:
+    # Collects the generated lines of one block and the registers it touches
+    def __init__(self, cpu, start):
+        self.cpu = cpu
+        self.start = start
+        self.synced = 0  # Instructions of this block already added to cpu.retired
+        self.lines = []
+        self.registers = set()
+        self.float_registers = set()
+        self.written = set()
+        self.float_written = set()
+        self.sets_flags = False
+
+    def reg(self, index):
+        if not 0 <= index < len(self.cpu.registers):
+            raise Untranslatable()
+        self.registers.add(index)
+        return f"r{index}"
+
+    def sync_retired(self, next_pc):
+        # run_blocks sets cpu.retired to the count before the block; devices read it, so catch it up before I/O
+        count = next_pc - self.start
+        if count > self.synced:
+            self.lines.append(f"cpu.retired += {count - self.synced}")
+            self.synced = count
+
+    def set_reg(self, index):
+        name = self.reg(index)
+        self.written.add(index)
+        return name
+
+    def freg(self, index):
+        if not 0 <= index < len(self.cpu.floating_point_registers):
+            raise Untranslatable()
+        self.float_registers.add(index)
+        return f"f{index}"
+
+    def set_freg(self, index):
+        name = self.freg(index)
+        self.float_written.add(index)
+        return name
+
+    def zero_flag(self):
+        # Expression that is true when the Z flag is set at this point of the block
+        return "res == 0" if self.sets_flags else "flags['Z']"
+
+
+class BlockCompiler:
+    # Translates straight-line runs of instructions into Python closures with registers held in locals.
+    # A block ends at the first JUMP/JZ/JNZ/HALT (translated inline), after IN/OUT so an interrupt a device
+    # raised is delivered before the next instruction, or at the first instruction that has no inline
+    # translation (CALL/RET/IRET/INT, vector and PIM ops, ...), which the block runs through CPU.execute
+    # as its last step. Blocks are dropped when memory they were translated from is written.
+    # Each STORE checks whether it dropped the running block and if so returns BLOCK_DROPPED with the PC
+    # after the store, so run_blocks continues with freshly translated code as the interpreter would.
+    def __init__(self, cpu, max_length=MAX_BLOCK_LENGTH):
+        self.cpu = cpu
+        self.max_length = max_length
+        self.blocks = {}  # start address -> Block
+        self.owners = {}  # address -> start addresses of the blocks covering it
+        self.emitters = {}
+        for mnemonic, opcode in Assembler.INSTRUCTIONS.items():
+            emitter = getattr(self, "emit_" + mnemonic.lower(), None)
+            if emitter is not None:
+                self.emitters[opcode] = (emitter, "op_" + mnemonic.lower())
+
+    def lookup(self, address):
+        block = self.blocks.get(address)
+        if block is None:
+            block = self.translate(address)
+        return block
+
+    def flush(self):
+        self.blocks.clear()
+        self.owners.clear()
+
+    def invalidate(self, address, length=1):
+        owners = self.owners
+        if not owners:
+            return
+        if length == 1:
+            starts = owners.get(address)
+            if starts:
+                for start in list(starts):
+                    self.drop(start)
+        elif length < len(owners):
+            for addr in range(address, address + length):
+                starts = owners.get(addr)
+                if starts:
+                    for start in list(starts):
+                        self.drop(start)
+        else:
+            for addr in [addr for addr in owners if address <= addr < address + length]:
+                starts = owners.get(addr)
+                if starts:
+                    for start in list(starts):
+                        self.drop(start)
+
+    def drop(self, start):
+        block = self.blocks.pop(start, None)
+        if block is None:
+            return
+        for addr in range(block.start, block.end):
+            starts = self.owners.get(addr)
+            if starts is not None:
+                starts.discard(start)
+                if not starts:
+                    del self.owners[addr]
+
+    def inline_emitter(self, opcode):
+        # Only opcodes still handled by the CPU's built-in handler are translated inline
+        entry = self.emitters.get(opcode)
+        handler = self.cpu.dispatch[opcode]
+        if handler == self.cpu.op_nop:
+            return self.emit_nop
+        if entry is None or handler != getattr(self.cpu, entry[1]):
+            return None
+        return entry[0]
+
+    def translate(self, start):
+        cpu = self.cpu
+        builder = BlockBuilder(cpu, start)
+        tail = None
+        pc = start
+        while pc - start < self.max_length and pc < cpu.memory.size:
+            opcode, operands, operands_type = cpu.decode_at(pc)
+            emitter = self.inline_emitter(opcode)
+            next_pc = pc + 1
+            if emitter is not None:
+                mark = len(builder.lines)
+                try:
+                    terminates = emitter(builder, operands, operands_type, next_pc)
+                except Untranslatable:
+                    del builder.lines[mark:]
+                    emitter = None
+            if emitter is None:
+                tail = (opcode, operands, operands_type, next_pc)
+                pc = next_pc
+                break
+            pc = next_pc
+            if terminates:
+                break
+        else:
+            builder.lines.append(f"cpu.pc = {pc}")
+        source = self.generate(start, builder, tail)
+        namespace = {}
+        exec(compile(source, f"<block {start:04X}>", "exec"), namespace)
+        function = namespace['make_block'](
+            cpu, cpu.registers, cpu.floating_point_registers, cpu.flags, cpu.memory.read, cpu.memory.load,
+            cpu.execute, cpu.read_from_peripheral, cpu.write_to_peripheral, self.blocks,
+            tail[1] if tail else None, tail[2] if tail else None)
+        block = Block(start, pc, function, source)
+        self.blocks[start] = block
+        for addr in range(start, pc):
+            self.owners.setdefault(addr, set()).add(start)
+        return block
+
+    def generate(self, start, builder, tail):
+        out = ["def make_block(cpu, registers, fregs, flags, read, load, execute, read_port, write_port, blocks, tail_operands, tail_type):",
+               "    def block():"]
+        for index in sorted(builder.registers):
+            out.append(f"        r{index} = registers[{index}]")
+        for index in sorted(builder.float_registers):
+            out.append(f"        f{index} = fregs[{index}]")
+        if builder.sets_flags:
+            out.append("        res = None")
+        epilogue = [f"registers[{index}] = r{index}" for index in sorted(builder.written)]
+        epilogue += [f"fregs[{index}] = f{index}" for index in sorted(builder.float_written)]
+        if builder.sets_flags:
+            epilogue += ["if res is not None:", "    flags['Z'] = int(res == 0)", "    flags['N'] = int(res != 0)"]
+        if epilogue and builder.lines:
+            out.append("        try:")
+            out += ["            " + line for line in builder.lines]
+            out.append("        finally:")
+            out += ["            " + line for line in epilogue]
+        else:
+            out += ["        " + line for line in builder.lines]
+        if tail is not None:
+            opcode, operands, operands_type, next_pc = tail
+            if next_pc - start > builder.synced:
+                out.append(f"        cpu.retired += {next_pc - start - builder.synced}")
+            out.append(f"        cpu.pc = {next_pc}")
+            out.append(f"        return execute({opcode}, tail_operands, tail_type)")
+        elif not builder.lines:
+            out.append("        pass")
+        out.append("    return block")
+        return "\n".join(out) + "\n"
+
+    # Emitters append the lines for one instruction and return True when it ends the block.
+
+    def emit_nop(self, b, operands, operands_type, next_pc):
+        return False
+
+    def emit_arith(self, b, operands, op):
+        a, c = b.reg(operands[1]), b.reg(operands[2])
+        d = b.set_reg(operands[0])
+        b.lines.append(f"{d} = {a} {op} {c}")
+        b.lines.append(f"res = {d}")
+        b.sets_flags = True
+        return False
+
+    def emit_add(self, b, operands, operands_type, next_pc):
+        return self.emit_arith(b, operands, "+")
+
+    def emit_sub(self, b, operands, operands_type, next_pc):
+        return self.emit_arith(b, operands, "-")
+
+    def emit_mul(self, b, operands, operands_type, next_pc):
+        return self.emit_arith(b, operands, "*")
+
+    def emit_addi(self, b, operands, operands_type, next_pc):
+        a = b.reg(operands[1])
+        d = b.set_reg(operands[0])
+        b.lines.append(f"{d} = {a} + {operands[2]}")
+        b.lines.append(f"res = {d}")
+        b.sets_flags = True
+        return False
+
+    def emit_float_arith(self, b, operands, op):
+        a, c = b.freg(operands[1]), b.freg(operands[2])
+        d = b.set_freg(operands[0])
+        b.lines.append(f"{d} = {a} {op} {c}")
+        return False
+
+    def emit_fadd(self, b, operands, operands_type, next_pc):
+        return self.emit_float_arith(b, operands, "+")
+
+    def emit_fsub(self, b, operands, operands_type, next_pc):
+        return self.emit_float_arith(b, operands, "-")
+
+    def emit_fmul(self, b, operands, operands_type, next_pc):
+        return self.emit_float_arith(b, operands, "*")
+
+    def emit_fmov(self, b, operands, operands_type, next_pc):
+        b.lines.append(f"{b.set_freg(operands[0])} = {float(operands[1])!r}")
+        return False
+
+    def emit_mov(self, b, operands, operands_type, next_pc):
+        source = b.reg(operands[1]) if operands_type[1] == 1 else operands[1]
+        b.lines.append(f"{b.set_reg(operands[0])} = {source}")
+        return False
+
+    def emit_cmp(self, b, operands, operands_type, next_pc):
+        b.lines.append(f"res = {b.reg(operands[0])} - {b.reg(operands[1])}")
+        b.sets_flags = True
+        return False
+
+    def emit_fcmp(self, b, operands, operands_type, next_pc):
+        b.lines.append(f"res = {b.freg(operands[0])} - {b.freg(operands[1])}")
+        b.sets_flags = True
+        return False
+
+    def emit_load(self, b, operands, operands_type, next_pc):
+        address = f"{b.reg(operands[1])} + {operands[2]}" if operands_type[1] == 1 else operands[1] + operands[2]
+        d = b.set_reg(operands[0])
+        b.lines.append(f"cpu.pc = {next_pc}")
+        b.lines.append(f"{d} = read({address})")
+        return False
+
+    def emit_store(self, b, operands, operands_type, next_pc):
+        value, base = b.reg(operands[0]), b.reg(operands[1])
+        b.lines.append(f"cpu.pc = {next_pc}")
+        b.lines.append(f"load({base} + {operands[2]}, {value})")
+        b.lines.append(f"if {b.start} not in blocks:")  # Self-modifying code: the store hit this block
+        b.lines.append(f"    return {BLOCK_DROPPED}")
+        return False
+
+    def emit_in(self, b, operands, operands_type, next_pc):
+        d = b.set_reg(operands[0])
+        b.lines.append(f"cpu.pc = {next_pc}")
+        b.sync_retired(next_pc)
+        b.lines.append(f"{d} = read_port({operands[1]})")
+        return True  # Reads can raise interrupts too (the keyboard re-raises while keys remain), as for OUT
+
+    def emit_out(self, b, operands, operands_type, next_pc):
+        if operands_type == [1, 1]:
+            port, value = b.reg(operands[0]), b.reg(operands[1])
+        elif operands_type == [1, 2]:
+            port, value = b.reg(operands[0]), operands[1]
+        elif operands_type == [2, 2]:
+            port, value = operands[0], operands[1]
+        elif operands_type == [2, 1]:
+            port, value = operands[0], b.reg(operands[1])
+        else:
+            return False
+        b.lines.append(f"cpu.pc = {next_pc}")
+        b.sync_retired(next_pc)
+        b.lines.append(f"write_port({port}, {value})")
+        return True  # A device may have raised an interrupt; let run_blocks deliver it before the next instruction
+
+    def emit_jump(self, b, operands, operands_type, next_pc):
+        b.lines.append(f"cpu.pc = {operands[3]}")
+        return True
+
+    def emit_jz(self, b, operands, operands_type, next_pc):
+        b.lines.append(f"cpu.pc = {operands[3]} if {b.zero_flag()} else {next_pc}")
+        return True
+
+    def emit_jnz(self, b, operands, operands_type, next_pc):
+        b.lines.append(f"cpu.pc = {next_pc} if {b.zero_flag()} else {operands[3]}")
+        return True
+
+    def emit_halt(self, b, operands, operands_type, next_pc):
+        b.lines.append(f"cpu.pc = {next_pc}")
+        b.lines.append("return 1")
+        return True
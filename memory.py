@@ -2,18 +2,72 @@ import argparse
 import threading
 import queue
 import sys
+import mmap
+import operator
+import struct
+from array import array
+
+import numpy as np
 #import termios
 #import tty
 
+WORD_MASK = (1 << 64) - 1
+PAGE_SHIFT = 12
+PAGE_SIZE = 1 << PAGE_SHIFT  # Words per page
+PAGE_MASK = PAGE_SIZE - 1
+
+
+def to_word(value):
+    # Wrap an integer to the signed 64-bit range of a memory word
+    value &= WORD_MASK
+    return value - (1 << 64) if value >> 63 else value
+
+
+def float_bits(value):
+    return struct.unpack('<q', struct.pack('<d', value))[0]
+
+
 class Memory:
-    def __init__(self, size=32 * 1024 * 1024):  # Increase size for HD resolution
+    # 'paged':   pages of PAGE_SIZE signed 64-bit words, allocated on first write; untouched pages read as zero.
+    # 'compact': signed 64-bit words in an anonymous mmap, zero pages are only committed on first touch.
+    #            Pages written since the last clear are tracked so reset and snapshots skip the rest.
+    #            Words holding floats keep their IEEE-754 bits in the buffer and the float in self.floats.
+    # 'list':    one Python object per word, as before.
+    BACKINGS = ('paged', 'compact', 'list')
+
+    def __init__(self, size=32 * 1024 * 1024, backing='paged'):  # Increase size for HD resolution
+        if backing not in Memory.BACKINGS:
+            raise ValueError(f"Unknown memory backing: {backing}")
         self.size = size
-        self.memory = [0] * size
-        
+        self.backing = backing
+        self.floats = {}  # address -> float value (paged and compact backings)
+        self.write_listeners = []  # Called as listener(address, length) after every write
+        if backing == 'paged':
+            self.pages = {}  # page index -> array('q') of PAGE_SIZE words
+            self.shared = set()  # Pages also referenced by a snapshot, copied before their next write
+            self.memory = None
+            self.read = self.read_paged
+            self.load = self.load_paged
+        elif backing == 'compact':
+            self.buffer = mmap.mmap(-1, size * 8)
+            self.memory = memoryview(self.buffer).cast('q')
+            self.touched = set()  # Indices of pages written since the last clear
+            self.read = self.read_compact
+            self.load = self.load_compact
+        else:
+            self.memory = [0] * size
+
+    def add_write_listener(self, listener):
+        self.write_listeners.append(listener)
+
+    def remove_write_listener(self, listener):
+        self.write_listeners.remove(listener)
 
     def load(self, address, value):
         if 0 <= address < self.size:
             self.memory[address] = value
+            for listener in self.write_listeners:
+                listener(address, 1)
         else:
             raise IndexError("Memory address out of range")
 
@@ -23,6 +77,254 @@ class Memory:
         else:
             raise IndexError("Memory address out of range")
 
+    def allocate_page(self, index):
+        page = array('q', bytes(PAGE_SIZE * 8))
+        self.pages[index] = page
+        return page
+
+    def unshare_page(self, index):
+        page = array('q', self.pages[index])
+        self.pages[index] = page
+        self.shared.discard(index)
+        return page
+
+    def load_paged(self, address, value):
+        if 0 <= address < self.size:
+            page = self.pages.get(address >> PAGE_SHIFT)
+            if page is None:
+                page = self.allocate_page(address >> PAGE_SHIFT)
+            elif self.shared and (address >> PAGE_SHIFT) in self.shared:
+                page = self.unshare_page(address >> PAGE_SHIFT)
+            offset = address & PAGE_MASK
+            try:
+                page[offset] = value
+                if self.floats:
+                    self.floats.pop(address, None)
+            except TypeError:
+                page[offset] = float_bits(value)
+                self.floats[address] = value
+            except OverflowError:
+                page[offset] = to_word(value)
+                if self.floats:
+                    self.floats.pop(address, None)
+            for listener in self.write_listeners:
+                listener(address, 1)
+        else:
+            raise IndexError("Memory address out of range")
+
+    def read_paged(self, address):
+        if 0 <= address < self.size:
+            if self.floats and address in self.floats:
+                return self.floats[address]
+            page = self.pages.get(address >> PAGE_SHIFT)
+            if page is None:
+                return 0
+            return page[address & PAGE_MASK]
+        else:
+            raise IndexError("Memory address out of range")
+
+    def load_compact(self, address, value):
+        if 0 <= address < self.size:
+            self.touched.add(address >> PAGE_SHIFT)
+            try:
+                self.memory[address] = value
+                if self.floats:
+                    self.floats.pop(address, None)
+            except TypeError:
+                self.memory[address] = float_bits(value)
+                self.floats[address] = value
+            except ValueError:
+                self.memory[address] = to_word(value)
+                if self.floats:
+                    self.floats.pop(address, None)
+            for listener in self.write_listeners:
+                listener(address, 1)
+        else:
+            raise IndexError("Memory address out of range")
+
+    def read_compact(self, address):
+        if 0 <= address < self.size:
+            if self.floats and address in self.floats:
+                return self.floats[address]
+            return self.memory[address]
+        else:
+            raise IndexError("Memory address out of range")
+
+    def load_block(self, address, words):
+        # Bulk store of integer words starting at address, one slice assignment per page
+        count = len(words)
+        if count == 0:
+            return
+        if not (0 <= address and address + count <= self.size):
+            raise IndexError("Memory address out of range")
+        if not isinstance(words, array) or words.typecode != 'q':
+            try:
+                words = array('q', list(words))
+            except OverflowError:
+                words = array('q', [to_word(value) for value in words])
+        if self.backing == 'paged':
+            done = 0
+            while done < count:
+                index = (address + done) >> PAGE_SHIFT
+                offset = (address + done) & PAGE_MASK
+                length = min(count - done, PAGE_SIZE - offset)
+                page = self.pages.get(index)
+                if page is None:
+                    page = self.allocate_page(index)
+                elif self.shared and index in self.shared:
+                    page = self.unshare_page(index)
+                page[offset:offset + length] = words[done:done + length]
+                done += length
+        elif self.backing == 'compact':
+            self.memory[address:address + count] = memoryview(words)
+            self.touched.update(range(address >> PAGE_SHIFT, ((address + count - 1) >> PAGE_SHIFT) + 1))
+        else:
+            self.memory[address:address + count] = words.tolist()
+        if self.floats:
+            for float_address in [a for a in self.floats if address <= a < address + count]:
+                del self.floats[float_address]
+        for listener in self.write_listeners:
+            listener(address, count)
+
+    def read_block(self, address, count):
+        # Words [address, address + count) as array('q'); words holding floats come back as their IEEE-754 bits
+        if not (0 <= address and address + count <= self.size):
+            raise IndexError("Memory address out of range")
+        words = array('q')
+        if self.backing == 'paged':
+            done = 0
+            while done < count:
+                offset = (address + done) & PAGE_MASK
+                length = min(count - done, PAGE_SIZE - offset)
+                page = self.pages.get((address + done) >> PAGE_SHIFT)
+                if page is None:
+                    words.frombytes(bytes(length * 8))
+                else:
+                    words.extend(page[offset:offset + length])
+                done += length
+        elif self.backing == 'compact':
+            words.frombytes(self.memory[address:address + count].cast('B'))
+        else:
+            values = self.memory[address:address + count]
+            try:
+                words.fromlist(values)
+            except (TypeError, OverflowError):
+                words.fromlist([float_bits(value) if isinstance(value, float) else to_word(value) for value in values])
+        return words
+
+    def resident_pages(self):
+        # Yields (base address, page words) for every page that may hold non-zero data.
+        # The paged and compact backings track this; the list backing is scanned.
+        if self.backing == 'paged':
+            for index in sorted(self.pages):
+                yield index << PAGE_SHIFT, self.pages[index]
+        elif self.backing == 'compact':
+            for index in sorted(self.touched):
+                base = index << PAGE_SHIFT
+                page = self.memory[base:base + PAGE_SIZE]
+                if any(page):
+                    yield base, page
+        else:
+            for base in range(0, self.size, PAGE_SIZE):
+                page = self.memory[base:base + PAGE_SIZE]
+                if any(page):
+                    yield base, page
+
+    def page_map(self):
+        return [base >> PAGE_SHIFT for base, page in self.resident_pages()]
+
+    def clear(self):
+        if self.backing == 'paged':
+            self.pages.clear()
+            self.shared.clear()
+        elif self.backing == 'compact':
+            zero = memoryview(bytes(PAGE_SIZE * 8)).cast('q')
+            for index in self.touched:
+                base = index << PAGE_SHIFT
+                length = min(PAGE_SIZE, self.size - base)
+                self.memory[base:base + length] = zero[:length]
+            self.touched.clear()
+        else:
+            for base, page in list(self.resident_pages()):
+                self.memory[base:base + len(page)] = [0] * len(page)
+        self.floats.clear()
+        for listener in self.write_listeners:
+            listener(0, self.size)
+
+    def snapshot(self):
+        # (pages, floats) with pages as {page index: array('q')}. For the paged backing the arrays are shared
+        # copy-on-write with this memory, so taking a snapshot copies no page data.
+        if self.backing == 'paged':
+            self.shared = set(self.pages)
+            return dict(self.pages), dict(self.floats)
+        pages = {}
+        floats = dict(self.floats)
+        for base, page in self.resident_pages():
+            if self.backing == 'compact':
+                pages[base >> PAGE_SHIFT] = array('q', page)
+            else:
+                for offset, value in enumerate(page):
+                    if isinstance(value, float):
+                        floats[base + offset] = value
+                pages[base >> PAGE_SHIFT] = array('q', [self.word_bits(value) for value in page])
+        return pages, floats
+
+    def restore(self, snapshot):
+        pages, floats = snapshot
+        if self.backing == 'paged':
+            # Only pages that differ from the snapshot are reported to write listeners
+            changed = [index for index in set(self.pages) | set(pages) if self.pages.get(index) is not pages.get(index)]
+            self.pages = dict(pages)
+            self.shared = set(pages)
+            self.floats = dict(floats)
+            for index in changed:
+                for listener in self.write_listeners:
+                    listener(index << PAGE_SHIFT, PAGE_SIZE)
+            return
+        self.clear()
+        for index, page in pages.items():
+            base = index << PAGE_SHIFT
+            length = min(PAGE_SIZE, self.size - base)
+            if self.backing == 'compact':
+                self.memory[base:base + length] = memoryview(page)[:length]
+                self.touched.add(index)
+            else:
+                self.memory[base:base + length] = page[:length]
+        if self.backing == 'list':
+            for address, value in floats.items():
+                self.memory[address] = value
+        else:
+            self.floats = dict(floats)
+
+    def word_bits(self, value):
+        return float_bits(value) if isinstance(value, float) else to_word(value)
+
+    def dump(self, file_path):
+        # Same address/value text format the CPU loads; only resident pages are walked
+        with open(file_path, 'w') as file:
+            for base, page in self.resident_pages():
+                for offset, value in enumerate(page):
+                    if value:
+                        if isinstance(value, float):  # list backing stores floats as objects
+                            value = float_bits(value)
+                        file.write(f"{base + offset:04X} {value & WORD_MASK:016X}\n")
+
+    def diff(self, other):
+        # [(address, value in self, value in other)] for every word that differs
+        differences = []
+        mine = dict(self.resident_pages())
+        theirs = dict(other.resident_pages())
+        for base in sorted(set(mine) | set(theirs)):
+            for offset in range(PAGE_SIZE):
+                address = base + offset
+                if address >= self.size:
+                    break
+                if (base in mine and mine[base][offset]) or (base in theirs and theirs[base][offset]):
+                    a, b = self.read(address), other.read(address)
+                    if a != b:
+                        differences.append((address, a, b))
+        return differences
+
     def preload_memory_from_file(self, file_path):
         with open(file_path, 'r') as file:
             for line in file:
@@ -33,6 +335,114 @@ class Memory:
                     self.load(address, value)
         print(self.memory)
 
+    # Range PIM: element i of each operand is at base + i * stride, and all operands are read before any result
+    # is stored. Integer kernels wrap to 64 bits like the single-word ops; division and float operands produce
+    # float words. Entries are (kernel, keeps integer words). The list backing applies the single-word ops'
+    # arithmetic per element (PIM_OPERATORS, on floats for the f* ops) in the same read-all-then-store order.
+    PIM_KERNELS = {
+        'add': (np.add, True), 'sub': (np.subtract, True), 'mul': (np.multiply, True), 'div': (np.true_divide, False),
+        'fadd': (np.add, False), 'fsub': (np.subtract, False), 'fmul': (np.multiply, False), 'fdiv': (np.true_divide, False),
+    }
+    PIM_OPERATORS = {'add': operator.add, 'sub': operator.sub, 'mul': operator.mul, 'div': operator.truediv}
+
+    def gather(self, address, count, stride):
+        # (int64 words, bool mask of float words or None) for count words at address + i * stride
+        span = (count - 1) * stride + 1
+        words = np.frombuffer(self.read_block(address, span), dtype=np.int64)[::stride]
+        if self.backing == 'list':
+            is_float = np.array([isinstance(value, float) for value in self.memory[address:address + span:stride]], dtype=bool)
+            return words, is_float if is_float.any() else None
+        if not self.floats:
+            return words, None
+        marked = [a - address for a in self.floats if address <= a < address + span and (a - address) % stride == 0]
+        if not marked:
+            return words, None
+        is_float = np.zeros(count, dtype=bool)
+        is_float[np.array(marked) // stride] = True
+        return words, is_float
+
+    def float_values(self, words, is_float):
+        # float64 value of each gathered word: float words by their bits, integer words converted
+        values = words.astype(np.float64)
+        if is_float is not None:
+            values[is_float] = words[is_float].view(np.float64)
+        return values
+
+    def scatter(self, address, stride, words, values=None, is_float=None):
+        # Stores int64 words at address + i * stride. Elements selected by is_float (all of them when it is
+        # None) become float words holding values (float64); words must then carry those values' bits.
+        count = len(words)
+        span = (count - 1) * stride + 1
+        if not (0 <= address and address + span <= self.size):
+            raise IndexError("Memory address out of range")
+        kept = {}
+        if stride == 1:
+            block = words
+        else:
+            block = np.frombuffer(self.read_block(address, span), dtype=np.int64).copy()
+            block[::stride] = words
+            if self.backing == 'list':
+                kept = {address + offset: value for offset, value in enumerate(self.memory[address:address + span])
+                        if offset % stride and isinstance(value, float)}
+            else:
+                kept = {a: v for a, v in self.floats.items() if address <= a < address + span and (a - address) % stride}
+        packed = array('q')
+        packed.frombytes(block.tobytes())
+        self.load_block(address, packed)
+        if values is not None:
+            addresses = np.arange(address, address + span, stride)
+            if is_float is not None:
+                addresses, values = addresses[is_float], values[is_float]
+            kept.update(zip(addresses.tolist(), values.tolist()))
+        if self.backing == 'list':
+            for float_address, value in kept.items():
+                self.memory[float_address] = value
+        else:
+            self.floats.update(kept)
+
+    def pim_range(self, operation, addr1, addr2, addr3, count, stride=1):
+        # addr3[i] = addr1[i] <operation> addr2[i] for count elements, one NumPy kernel per call
+        kernel, integer = Memory.PIM_KERNELS[operation]
+        if count <= 0:
+            return
+        if stride <= 0:
+            raise ValueError("PIM stride must be positive")
+        if self.backing == 'list':
+            span = (count - 1) * stride + 1
+            for base in (addr1, addr2, addr3):
+                if not (0 <= base and base + span <= self.size):
+                    raise IndexError("Memory address out of range")
+            a = self.memory[addr1:addr1 + span:stride]
+            b = self.memory[addr2:addr2 + span:stride]
+            if operation.startswith('f'):
+                a, b = [float(value) for value in a], [float(value) for value in b]
+            if operation.endswith('div') and not all(b):
+                raise ZeroDivisionError("Division by zero")
+            self.memory[addr3:addr3 + span:stride] = list(map(Memory.PIM_OPERATORS[operation.lstrip('f')], a, b))
+            for listener in self.write_listeners:
+                listener(addr3, span)
+            return
+        a_words, a_float = self.gather(addr1, count, stride)
+        b_words, b_float = self.gather(addr2, count, stride)
+        is_float = None
+        if integer:
+            if a_float is None and b_float is None:
+                with np.errstate(over='ignore'):
+                    self.scatter(addr3, stride, kernel(a_words, b_words))
+                return
+            # Like the single-word ops, only elements with a float operand produce a float
+            is_float = a_float if b_float is None else b_float if a_float is None else a_float | b_float
+        a = self.float_values(a_words, a_float)
+        b = self.float_values(b_words, b_float)
+        if operation in ('div', 'fdiv') and not b.all():
+            raise ZeroDivisionError("Division by zero")
+        values = kernel(a, b)
+        words = values.view(np.int64)
+        if is_float is not None:
+            with np.errstate(over='ignore'):
+                words = np.where(is_float, words, kernel(a_words, b_words))
+        self.scatter(addr3, stride, words, values, is_float)
+
     def pim_add(self, addr1, addr2, addr3):
         self.load(addr3, self.read(addr1) + self.read(addr2))
 
@@ -3,21 +3,100 @@ import threading
 import queue
 import sys
 import os
+import time
 
 #import termios
 #import tty
 import random
-import tkinter as tk
-from PIL import Image, ImageTk, ImageFont, ImageDraw
-import io
-from multiprocessing import Queue
+import mmap
+from collections import OrderedDict, deque
+from array import array
+from multiprocessing import Queue, shared_memory
 import multiprocessing
 import numpy as np
 
-def video_buffer_process(queue, buffer_queue):
-    # Create a video buffer
-    buffer = np.zeros((1024, 1024, 3), dtype=np.int32)
-    image = Image.fromarray((buffer * 255).astype(np.uint8))
+FONT_PATH = '/usr/share/fonts/truetype/dejavu/DejaVuSansMono-Bold.ttf'
+TEXT_BACKGROUND = (73, 109, 137)
+TEXT_FOREGROUND = (255, 255, 0)
+TEXT_MARGIN = 10
+FRAME_RATE = 30  # Viewer redraws per second at most
+
+
+def framebuffer_views(buffer, width, height):
+    # Text cells (one code point per cell) followed by the RGB graphics plane, laid out in one shared block
+    cells = width * height
+    text = np.ndarray((cells,), dtype=np.uint32, buffer=buffer)
+    graphics = np.ndarray((height, width, 3), dtype=np.int32, buffer=buffer, offset=text.nbytes)
+    return text, graphics
+
+
+def framebuffer_size(width, height):
+    return width * height * 4 + width * height * 3 * 4
+
+
+class GlyphAtlas:
+    # Printable ASCII rasterized once into a strip; each cell is then a paste of a tile cut from it.
+    # Other code points are rasterized the first time they are shown.
+    def __init__(self, font_path=FONT_PATH, size=12):
+        from PIL import Image, ImageDraw, ImageFont
+        try:
+            self.font = ImageFont.truetype(font_path, size)
+        except OSError:
+            self.font = ImageFont.load_default()
+        ascent, descent = self.font.getmetrics()
+        self.cell_width = max(1, int(round(self.font.getlength('M'))))
+        self.cell_height = ascent + descent
+        codes = range(0x20, 0x7F)
+        self.atlas = Image.new('RGB', (self.cell_width * len(codes), self.cell_height), TEXT_BACKGROUND)
+        draw = ImageDraw.Draw(self.atlas)
+        for index, code in enumerate(codes):
+            draw.text((index * self.cell_width, 0), chr(code), font=self.font, fill=TEXT_FOREGROUND)
+        self.glyphs = {}
+        for index, code in enumerate(codes):
+            left = index * self.cell_width
+            self.glyphs[code] = self.atlas.crop((left, 0, left + self.cell_width, self.cell_height))
+
+    def glyph(self, code):
+        tile = self.glyphs.get(code)
+        if tile is None:
+            from PIL import Image, ImageDraw
+            tile = Image.new('RGB', (self.cell_width, self.cell_height), TEXT_BACKGROUND)
+            try:
+                ImageDraw.Draw(tile).text((0, 0), chr(code), font=self.font, fill=TEXT_FOREGROUND)
+            except (ValueError, UnicodeEncodeError):  # Not a drawable code point
+                tile = self.glyphs[ord('?')]
+            self.glyphs[code] = tile
+        return tile
+
+    def new_screen(self, width, height):
+        from PIL import Image
+        return Image.new('RGB', (2 * TEXT_MARGIN + width * self.cell_width,
+                                 2 * TEXT_MARGIN + height * self.cell_height), TEXT_BACKGROUND)
+
+    def blit(self, screen, shown, cells, x0, y0, x1, y1):
+        # Paste the cells in the rectangle that differ from what is on screen, then remember them as shown
+        region = cells[y0:y1, x0:x1]
+        rows, columns = np.nonzero(region != shown[y0:y1, x0:x1])
+        for row, column in zip(rows.tolist(), columns.tolist()):
+            screen.paste(self.glyph(int(region[row, column])),
+                         (TEXT_MARGIN + (x0 + column) * self.cell_width, TEXT_MARGIN + (y0 + row) * self.cell_height))
+        shown[y0:y1, x0:x1] = region
+
+
+def video_buffer_process(command_queue, buffer_queue, shm_name, width, height, frame_rate=FRAME_RATE):
+    # The framebuffer is read straight from shared memory; the queue only carries
+    # ('present', mode, x0, y0, x1, y1) notifications for the region changed since the last frame.
+    # The loop sleeps in the queue until the next frame is due, merges everything that arrived
+    # meanwhile into one rectangle per mode, and redraws at most frame_rate times a second.
+    import tkinter as tk
+    from PIL import Image, ImageTk
+    shm = shared_memory.SharedMemory(name=shm_name)
+    text, graphics = framebuffer_views(shm.buf, width, height)
+    text = text.reshape(height, width)
+    atlas = GlyphAtlas()
+    shown = np.full((height, width), ord(' '), dtype=np.uint32)  # Cells currently drawn on text_screen
+    text_screen = atlas.new_screen(width, height)
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
 
     # Create a separate window
     window = tk.Tk()
@@ -27,34 +106,172 @@ def video_buffer_process(queue, buffer_queue):
     # Create a label to display the video buffer
     label = tk.Label(window, text="Video Buffer")
     label.pack()
+    text_photo = ImageTk.PhotoImage(text_screen)
+    graphics_photo = ImageTk.PhotoImage(Image.fromarray(frame))
 
+    frame_time = 1.0 / frame_rate
+    deadline = time.monotonic() + frame_time
+    pending = {}  # mode -> merged dirty rectangle
     mode = None
+    running = True
+    while running:
+        try:
+            message = buffer_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            message = None
+        while message is not None:
+            if message[0] == 'quit':
+                running = False
+                break
+            _, mode, x0, y0, x1, y1 = message
+            rect = pending.get(mode)
+            if rect is not None:
+                x0, y0, x1, y1 = min(x0, rect[0]), min(y0, rect[1]), max(x1, rect[2]), max(y1, rect[3])
+            pending[mode] = (x0, y0, x1, y1)
+            try:
+                message = buffer_queue.get_nowait()
+            except queue.Empty:
+                message = None
+        if running and time.monotonic() < deadline:
+            continue
+        deadline = time.monotonic() + frame_time
 
-    while True:
-        if not buffer_queue.empty():
-            buffer_data = buffer_queue.get()
-            if isinstance(buffer_data, str):  # TEXT MODE
-                mode = Display.TEXT_MODE
-                text_buffer = buffer_data
-                text_image = Image.new('RGB', (1024, 1024), color = (73, 109, 137))
-                fnt = ImageFont.truetype('/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf', 12)
-                d = ImageDraw.Draw(text_image)
-                for i, line in enumerate(text_buffer.split('\n')):
-                    d.text((10, 10 + i * 12), line, font=fnt, fill=(255, 255, 0))
-                photo = ImageTk.PhotoImage(text_image)
-                label.config(image=photo)
-                label.image = photo
-            else:  # GRAPHICS MODE
-                mode = Display.GRAPHICS_MODE
-                buffer = buffer_data
-                image = Image.fromarray((buffer * 255).astype(np.uint8))
-                photo = ImageTk.PhotoImage(image)
+        if pending:
+            rect = pending.pop(Display.TEXT_MODE, None)
+            if rect is not None:
+                atlas.blit(text_screen, shown, text, *rect)
+                text_photo.paste(text_screen)
+            rect = pending.pop(Display.GRAPHICS_MODE, None)
+            if rect is not None:
+                x0, y0, x1, y1 = rect
+                frame[y0:y1, x0:x1] = (graphics[y0:y1, x0:x1] * 255).astype(np.uint8)
+                graphics_photo.paste(Image.fromarray(frame))
+            photo = text_photo if mode == Display.TEXT_MODE else graphics_photo
+            if getattr(label, "image", None) is not photo:
                 label.config(image=photo)
                 label.image = photo
         # Run the window event loop
-        window.update()
+        try:
+            window.update()
+        except tk.TclError:  # Window closed
+            break
+
+    try:
+        window.destroy()
+    except tk.TclError:
+        pass
+    del text, graphics
+    shm.close()
+
+class NullBackend:
+    # Discards frames. The Display keeps working as plain memory, nothing is drawn or written anywhere.
+    SHARED_FRAMEBUFFER = False
+
+    def open(self, display):
+        pass
+
+    def present(self, mode, rect):
+        pass
+
+    def close(self):
+        pass
+
+
+class TkBackend(NullBackend):
+    # Window in a separate viewer process that maps the Display's framebuffer from shared memory
+    SHARED_FRAMEBUFFER = True
+
+    def __init__(self, frame_rate=FRAME_RATE):
+        self.frame_rate = frame_rate
+        self.process = None
+
+    def open(self, display):
+        self.queue = multiprocessing.Queue()
+        self.buffer_queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=video_buffer_process,
+                                               args=(self.queue, self.buffer_queue, display.shm.name,
+                                                     display.width, display.height, self.frame_rate))
+        self.process.start()
+
+    def present(self, mode, rect):
+        self.buffer_queue.put(('present', mode) + rect)
+
+    def close(self):
+        if self.process is not None and self.process.is_alive():
+            self.buffer_queue.put(('quit',))
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.process = None
+
+
+class HeadlessBackend(NullBackend):
+    # Keeps frames in memory and writes them out on request (dump), every `every` presented frames,
+    # or once when closed if `every` is 0. The path pattern may use {frame}; a .raw extension writes the
+    # framebuffer of the current mode as raw bytes (uint32 code points or int32 RGB triples), anything else
+    # is rendered to an image file (PNG for .png).
+    def __init__(self, path=None, every=0):
+        self.path = path
+        self.every = every
+        self.frame = 0
+        self.display = None
+        self.atlas = None
+
+    def open(self, display):
+        self.display = display
+
+    def present(self, mode, rect):
+        self.frame += 1
+        if self.path and self.every and self.frame % self.every == 0:
+            self.dump()
+
+    def close(self):
+        if self.path and not self.every and self.display is not None:
+            self.dump()
+        self.display = None
+
+    def render(self):
+        # Current screen as a PIL image
+        from PIL import Image
+        display = self.display
+        if display.mode == Display.GRAPHICS_MODE:
+            return Image.fromarray((display.graphics_buffer * 255).astype(np.uint8))
+        if self.atlas is None:
+            self.atlas = GlyphAtlas()
+        screen = self.atlas.new_screen(display.width, display.height)
+        shown = np.full((display.height, display.width), ord(' '), dtype=np.uint32)
+        self.atlas.blit(screen, shown, display.text_buffer.reshape(display.height, display.width),
+                        0, 0, display.width, display.height)
+        return screen
+
+    def dump(self, path=None):
+        path = (path or self.path).format(frame=self.frame)
+        if path.endswith('.raw'):
+            display = self.display
+            buffer = display.text_buffer if display.mode == Display.TEXT_MODE else display.graphics_buffer
+            with open(path, 'wb') as file:
+                file.write(buffer.tobytes())
+        else:
+            self.render().save(path)
+        return path
+
+
+DISPLAY_BACKENDS = ('tk', 'headless', 'null')
+
+
+def make_display_backend(name, path=None, every=0):
+    if name == 'tk':
+        return TkBackend()
+    if name == 'headless':
+        return HeadlessBackend(path, every)
+    if name == 'null':
+        return NullBackend()
+    raise ValueError(f"Unknown display backend {name}")
+
 
 class Peripheral:
+    ADDRESS_SPACE = 0x100  # Size of the I/O window the device is mapped at
+
     def __init__(self, base_address):
         self.base_address = base_address
 
@@ -63,6 +280,33 @@ class Peripheral:
 
     def write(self, address, value):
         raise NotImplementedError("Write method not implemented")
+
+    def read_block(self, address, count):
+        # Bulk read of `count` consecutive ports as array('q'); devices backed by buffers override this
+        return array('q', [self.read(address + index) for index in range(count)])
+
+    def write_block(self, address, words):
+        for index, value in enumerate(words):
+            self.write(address + index, value)
+
+    def attach(self, cpu):
+        # Called by CPU.add_peripheral; devices that move data to or from memory keep the CPU here
+        pass
+
+    def detach(self, cpu):
+        # Called by CPU.remove_peripheral
+        pass
+
+    def flush(self):
+        # Write buffered data through to the host; the CPU calls this on HALT and before snapshots
+        pass
+
+    def get_state(self):
+        # Picklable device state for CPU snapshots; stateless devices return None
+        return None
+
+    def set_state(self, state):
+        pass
     
     def input_process(self, queue):
         while True:
@@ -74,16 +318,19 @@ class Peripheral:
             message = self.read()  # Read the value from the peripheral device
             queue.put(message)  # Put the value and port number in the queue
 
-class Storage:
+class Storage(Peripheral):
+    ADDRESS_SPACE = 0x400
+
     def __init__(self, base_address, size):
-        self.base_address = base_address
+        super().__init__(base_address)
         self.storage = [0] * size
     
 
     def preload_image_from_file(self, file_path):
-        with open(file_path, 'r') as file:
-            image = Image.open(io.BytesIO(file.read()))
-            self.storage = image
+        # One byte per word, truncated to the device size
+        with open(file_path, 'rb') as file:
+            data = file.read(len(self.storage))
+        self.storage[:len(data)] = list(data)
 
     def read(self, offset):
         return self.storage[offset]
@@ -91,6 +338,325 @@ class Storage:
     def write(self, offset, value):
         self.storage[offset] = value
 
+    def read_block(self, offset, count):
+        if offset < 0 or offset + count > len(self.storage):
+            raise IndexError("Storage address out of range")
+        return array('q', self.storage[offset:offset + count])
+
+    def write_block(self, offset, words):
+        if offset < 0 or offset + len(words) > len(self.storage):
+            raise IndexError("Storage address out of range")
+        self.storage[offset:offset + len(words)] = list(words)
+
+    def get_state(self):
+        return list(self.storage)
+
+    def set_state(self, state):
+        self.storage = list(state)
+
+class BlockStorage(Peripheral):
+    # Sector device over a disk image (e.g. a FAT16 image from image_create.py), memory-mapped from the host file.
+    # Ports: 0 = sector number, 1 = buffer address (writing it transfers the sector into memory),
+    #        2 = status (0 = success, 1 = error), 3 = sector count (read only),
+    #        4 = write buffer address (writing it transfers SECTOR_SIZE words from memory into the sector).
+    # A transfer stores the SECTOR_SIZE bytes of the sector as SECTOR_SIZE memory words in one bulk copy.
+    # Sectors go through an LRU cache of `cache_sectors` entries (0 disables it). A miss that continues a
+    # sequential run also loads the next `read_ahead` sectors. Written sectors stay in the cache until they are
+    # evicted or flush() runs; the CPU flushes on HALT and before taking a snapshot.
+    SECTOR_SIZE = 512
+    SECTOR_PORT = 0
+    BUFFER_PORT = 1
+    STATUS_PORT = 2
+    COUNT_PORT = 3
+    WRITE_PORT = 4
+    STATUS_OK = 0
+    STATUS_ERROR = 1
+
+    def __init__(self, base_address, image_path=None, cache_sectors=64, read_ahead=8):
+        super().__init__(base_address)
+        self.cpu = None
+        self.image = None
+        self.file = None
+        self.writable = False
+        self.sector_count = 0
+        self.sector = 0
+        self.buffer_address = 0
+        self.status = BlockStorage.STATUS_OK
+        self.cache_sectors = cache_sectors
+        self.read_ahead = min(read_ahead, max(cache_sectors - 1, 0))
+        self.cache = OrderedDict()  # sector -> array('q') of SECTOR_SIZE words, least recently used first
+        self.dirty = set()  # Cached sectors not yet written back to the image
+        self.last_sector = None
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.writebacks = 0
+        if image_path is not None:
+            self.open_image(image_path)
+
+    def open_image(self, image_path):
+        self.close()
+        try:
+            self.file = open(image_path, 'r+b')
+            self.writable = True
+        except PermissionError:
+            self.file = open(image_path, 'rb')
+            self.writable = False
+        size = os.fstat(self.file.fileno()).st_size
+        if size:
+            access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+            self.image = mmap.mmap(self.file.fileno(), 0, access=access)
+        self.sector_count = size // BlockStorage.SECTOR_SIZE
+
+    def close(self):
+        self.flush()
+        self.cache.clear()
+        self.last_sector = None
+        if self.image is not None:
+            self.image.close()
+            self.image = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.sector_count = 0
+
+    def attach(self, cpu):
+        self.cpu = cpu
+
+    def read_sectors(self, sector, count):
+        # `count` sectors from the image as a list of word arrays, one word per byte
+        size = BlockStorage.SECTOR_SIZE
+        data = np.frombuffer(self.image, np.uint8, count * size, sector * size).astype(np.int64)
+        sectors = []
+        for index in range(count):
+            words = array('q')
+            words.frombytes(data[index * size:(index + 1) * size].tobytes())
+            sectors.append(words)
+        return sectors
+
+    def write_back(self, sector, words):
+        offset = sector * BlockStorage.SECTOR_SIZE
+        self.image[offset:offset + BlockStorage.SECTOR_SIZE] = np.frombuffer(words, np.int64).astype(np.uint8).tobytes()
+        self.writebacks += 1
+
+    def cache_insert(self, sector, words):
+        cache = self.cache
+        cache[sector] = words
+        cache.move_to_end(sector)
+        while len(cache) > self.cache_sectors:
+            old_sector, old_words = cache.popitem(last=False)
+            if old_sector in self.dirty:
+                self.dirty.discard(old_sector)
+                self.write_back(old_sector, old_words)
+
+    def read_sector(self, sector):
+        # Sector contents as an array of words, one per byte; None if the sector does not exist
+        if not (0 <= sector < self.sector_count):
+            return None
+        if not self.cache_sectors:
+            return self.read_sectors(sector, 1)[0]
+        words = self.cache.get(sector)
+        if words is not None:
+            self.cache.move_to_end(sector)
+            self.hits += 1
+        else:
+            self.misses += 1
+            count = 1
+            if self.read_ahead and self.last_sector is not None and sector == self.last_sector + 1:
+                count = min(1 + self.read_ahead, self.sector_count - sector)
+            sectors = self.read_sectors(sector, count)
+            for offset in range(1, count):
+                if sector + offset not in self.cache:  # Never replace a cached (possibly dirty) sector
+                    self.cache_insert(sector + offset, sectors[offset])
+                    self.prefetched += 1
+            words = sectors[0]
+            self.cache_insert(sector, words)
+        self.last_sector = sector
+        return words
+
+    def write_sector(self, sector, words):
+        # Stores SECTOR_SIZE words as bytes (each word truncated to its low 8 bits); False if not possible
+        if not (0 <= sector < self.sector_count) or not self.writable:
+            return False
+        words = array('q', np.frombuffer(words, np.int64).astype(np.uint8).astype(np.int64).tobytes())
+        if not self.cache_sectors:
+            self.write_back(sector, words)
+        else:
+            self.cache_insert(sector, words)
+            self.dirty.add(sector)
+        self.last_sector = sector
+        return True
+
+    def flush(self):
+        for sector in sorted(self.dirty):
+            self.write_back(sector, self.cache[sector])
+        self.dirty.clear()
+        if self.image is not None and self.writable:
+            self.image.flush()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'prefetched': self.prefetched,
+                'writebacks': self.writebacks, 'cached': len(self.cache), 'dirty': len(self.dirty)}
+
+    def transfer(self):
+        words = self.read_sector(self.sector)
+        if words is None or self.cpu is None:
+            self.status = BlockStorage.STATUS_ERROR
+            return
+        try:
+            self.cpu.memory.load_block(self.buffer_address, words)
+        except IndexError:
+            self.status = BlockStorage.STATUS_ERROR
+            return
+        self.status = BlockStorage.STATUS_OK
+
+    def transfer_out(self):
+        if self.cpu is None:
+            self.status = BlockStorage.STATUS_ERROR
+            return
+        try:
+            words = self.cpu.memory.read_block(self.buffer_address, BlockStorage.SECTOR_SIZE)
+        except IndexError:
+            self.status = BlockStorage.STATUS_ERROR
+            return
+        ok = self.write_sector(self.sector, words)
+        self.status = BlockStorage.STATUS_OK if ok else BlockStorage.STATUS_ERROR
+
+    def read(self, offset):
+        if offset == BlockStorage.SECTOR_PORT:
+            return self.sector
+        elif offset == BlockStorage.BUFFER_PORT or offset == BlockStorage.WRITE_PORT:
+            return self.buffer_address
+        elif offset == BlockStorage.STATUS_PORT:
+            return self.status
+        elif offset == BlockStorage.COUNT_PORT:
+            return self.sector_count
+        raise IndexError("Block storage port out of range")
+
+    def write(self, offset, value):
+        if offset == BlockStorage.SECTOR_PORT:
+            self.sector = value
+        elif offset == BlockStorage.BUFFER_PORT:
+            self.buffer_address = value
+            self.transfer()
+        elif offset == BlockStorage.WRITE_PORT:
+            self.buffer_address = value
+            self.transfer_out()
+        elif offset not in (BlockStorage.STATUS_PORT, BlockStorage.COUNT_PORT):
+            raise IndexError("Block storage port out of range")
+
+    def get_state(self):
+        # The image itself lives on the host and is not part of the snapshot
+        return {'sector': self.sector, 'buffer_address': self.buffer_address, 'status': self.status}
+
+    def set_state(self, state):
+        self.sector = state['sector']
+        self.buffer_address = state['buffer_address']
+        self.status = state['status']
+
+
+class DMAController(Peripheral):
+    # Block copies between memory and device ports, done as one bulk host operation per transfer.
+    # Ports: 0 = source, 1 = destination, 2 = length in words,
+    #        3 = control (writing it with CONTROL_START set runs the transfer),
+    #        4 = status (0 = done, 1 = error), 5 = interrupt line (invalid line numbers are ignored),
+    #        6 = words moved by the last transfer.
+    # Control bits: CONTROL_SOURCE_IO / CONTROL_DESTINATION_IO make that side an I/O address (a range of
+    # device ports decoded through the bus) instead of a memory address; CONTROL_INTERRUPT raises the
+    # interrupt line once the transfer is complete. Devices move data with read_block/write_block.
+    SOURCE_PORT = 0
+    DESTINATION_PORT = 1
+    LENGTH_PORT = 2
+    CONTROL_PORT = 3
+    STATUS_PORT = 4
+    IRQ_PORT = 5
+    MOVED_PORT = 6
+    CONTROL_START = 1
+    CONTROL_SOURCE_IO = 2
+    CONTROL_DESTINATION_IO = 4
+    CONTROL_INTERRUPT = 8
+    STATUS_DONE = 0
+    STATUS_ERROR = 1
+
+    def __init__(self, base_address, irq=5):
+        super().__init__(base_address)
+        self.cpu = None
+        self.registers = [0] * 7
+        self.registers[DMAController.IRQ_PORT] = irq
+
+    def attach(self, cpu):
+        self.cpu = cpu
+
+    def device_range(self, address, length):
+        # (device, offset) for `length` ports starting at an I/O address; the range must stay inside one device
+        start, end, device = self.cpu.bus.lookup(address)
+        if address + length > end:
+            raise IndexError("DMA range crosses a device boundary")
+        return device, address - start
+
+    def transfer(self, control):
+        source = self.registers[DMAController.SOURCE_PORT]
+        destination = self.registers[DMAController.DESTINATION_PORT]
+        length = self.registers[DMAController.LENGTH_PORT]
+        if length < 0:
+            raise IndexError("Negative DMA length")
+        if not control & (DMAController.CONTROL_SOURCE_IO | DMAController.CONTROL_DESTINATION_IO):
+            # Memory to memory keeps float words floats; read_block/load_block would leave only their bits
+            if length:
+                memory = self.cpu.memory
+                words, is_float = memory.gather(source, length, 1)
+                values = memory.float_values(words, is_float) if is_float is not None else None
+                memory.scatter(destination, 1, words, values, is_float)
+            return length
+        if control & DMAController.CONTROL_SOURCE_IO:
+            device, offset = self.device_range(source, length)
+            words = device.read_block(offset, length)
+        else:
+            words = self.cpu.memory.read_block(source, length)
+        if control & DMAController.CONTROL_DESTINATION_IO:
+            device, offset = self.device_range(destination, length)
+            device.write_block(offset, words)
+        else:
+            self.cpu.memory.load_block(destination, words)
+        return length
+
+    def write(self, address, value):
+        if address == DMAController.CONTROL_PORT:
+            self.registers[address] = value
+            if value & DMAController.CONTROL_START:
+                try:
+                    moved = self.transfer(value) if self.cpu is not None else None
+                except (IndexError, ValueError):
+                    moved = None
+                if moved is None:
+                    self.registers[DMAController.STATUS_PORT] = DMAController.STATUS_ERROR
+                    self.registers[DMAController.MOVED_PORT] = 0
+                else:
+                    self.registers[DMAController.STATUS_PORT] = DMAController.STATUS_DONE
+                    self.registers[DMAController.MOVED_PORT] = moved
+                self.registers[DMAController.CONTROL_PORT] &= ~DMAController.CONTROL_START
+                if value & DMAController.CONTROL_INTERRUPT and self.cpu is not None:
+                    self.cpu.request_interrupt(self.registers[DMAController.IRQ_PORT])
+        elif address == DMAController.IRQ_PORT:
+            if InterruptController.valid_line(value):
+                self.registers[address] = value
+        elif 0 <= address < len(self.registers) and address not in (DMAController.STATUS_PORT, DMAController.MOVED_PORT):
+            self.registers[address] = value
+        else:
+            raise IndexError("DMA port out of range")
+
+    def read(self, address):
+        if 0 <= address < len(self.registers):
+            return self.registers[address]
+        raise IndexError("DMA port out of range")
+
+    def get_state(self):
+        return list(self.registers)
+
+    def set_state(self, state):
+        self.registers = list(state)
+
+
 class RandomNumberGenerator(Peripheral):
     def __init__(self, base_address):
         self.base_address = base_address
@@ -104,51 +670,153 @@ class RandomNumberGenerator(Peripheral):
 class Display(Peripheral):
     TEXT_MODE = 0
     GRAPHICS_MODE = 1
+    PRESENT_REGISTER = 1  # Writing any value publishes the changes made since the last present to the viewer
+    ADDRESS_SPACE = 0x400
 
-    def __init__(self, base_address, width=80, height=25):
+    def __init__(self, base_address, width=80, height=25, backend=None):
         super().__init__(base_address)
         self.width = width
         self.height = height
         self.registers = [0] * 10  # 10 registers, including mode register and 9 additional registers
         self.mode = Display.TEXT_MODE
-        self.text_buffer = [' '] * (width * height)
-        self.graphics_buffer = np.zeros((height, width, 3), dtype=np.int32)
-        self.queue = multiprocessing.Queue()
-        self.buffer_queue = multiprocessing.Queue()
-        self.process = multiprocessing.Process(target=video_buffer_process, args=(self.queue, self.buffer_queue))
-        self.process.start()
+        self.backend = TkBackend() if backend is None else backend
+        self.shm = None
+        self.closed = False
+        # Both buffers are views of one block; a shared memory block when the backend's viewer maps it too
+        if self.backend.SHARED_FRAMEBUFFER:
+            self.shm = shared_memory.SharedMemory(create=True, size=framebuffer_size(width, height))
+            buffer = self.shm.buf
+        else:
+            buffer = bytearray(framebuffer_size(width, height))
+        self.text_buffer, self.graphics_buffer = framebuffer_views(buffer, width, height)
+        self.text_buffer[:] = ord(' ')
+        self.mark_all_dirty()
+        self.backend.open(self)
 
     def __del__(self):
-        self.process.join()
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.backend.close()
+        if self.shm is not None:
+            self.text_buffer = self.text_buffer.copy()  # Release the views so the block can be unmapped
+            self.graphics_buffer = self.graphics_buffer.copy()
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
 
     def read(self, address):
         if 0 <= address <= 9:  # Unified registers
             return self.registers[address]
         elif self.mode == Display.TEXT_MODE:
-            return ord(self.text_buffer[address - 10])
+            return int(self.text_buffer[address - 10])
         else:
-            return self.graphics_buffer.flat[address - 10]
+            return int(self.graphics_buffer.flat[address - 10])
 
     def write(self, address, value):
-        if address == 0:  # Mode register
+        if address >= 10:
+            index = address - 10
+            if self.mode == Display.TEXT_MODE:
+                self.text_buffer[index] = value
+            else:
+                self.graphics_buffer.flat[index] = value
+            # Dirty span as a range of buffer indices, turned into a rectangle by present()
+            if index < self.dirty_low:
+                self.dirty_low = index
+            if index > self.dirty_high:
+                self.dirty_high = index
+        elif address == 0:  # Mode register
             if value == Display.TEXT_MODE:
                 self.mode = Display.TEXT_MODE
             elif value == Display.GRAPHICS_MODE:
                 self.mode = Display.GRAPHICS_MODE
             else:
                 raise ValueError("Invalid mode")
-        elif 1 <= address <= 9:  # Additional registers
+            self.mark_all_dirty()
+        else:  # Additional registers
             self.registers[address] = value
-        elif self.mode == Display.TEXT_MODE:
-            self.text_buffer[address - 10] = chr(value)
-            self.update_text_buffer()
-        else:
-            self.graphics_buffer.flat[address - 10] = value
-            self.buffer_queue.put(self.graphics_buffer)
+            if address == Display.PRESENT_REGISTER:
+                self.present()
+
+    def read_block(self, address, count):
+        if address < 10:
+            return super().read_block(address, count)
+        index = address - 10
+        buffer = self.text_buffer if self.mode == Display.TEXT_MODE else self.graphics_buffer.reshape(-1)
+        if index + count > buffer.size:
+            raise IndexError("Display address out of range")
+        return array('q', buffer[index:index + count].astype(np.int64).tobytes())
+
+    def write_block(self, address, words):
+        # One NumPy slice assignment into the framebuffer; the span is marked dirty like single writes
+        count = len(words)
+        if address < 10:
+            super().write_block(address, words)
+            return
+        index = address - 10
+        buffer = self.text_buffer if self.mode == Display.TEXT_MODE else self.graphics_buffer.reshape(-1)
+        if index + count > buffer.size:
+            raise IndexError("Display address out of range")
+        if count == 0:
+            return
+        buffer[index:index + count] = np.frombuffer(words, np.int64)
+        if index < self.dirty_low:
+            self.dirty_low = index
+        if index + count - 1 > self.dirty_high:
+            self.dirty_high = index + count - 1
+
+    def mark_all_dirty(self):
+        self.dirty_low = 0
+        self.dirty_high = self.graphics_buffer.size - 1
 
-    def update_text_buffer(self):
-        text = ''.join(self.text_buffer)
-        self.buffer_queue.put(text)
+    def dirty_rect(self):
+        # (x0, y0, x1, y1) covering the dirty span, or None when nothing changed since the last present
+        if self.dirty_high < self.dirty_low:
+            return None
+        per_cell = 1 if self.mode == Display.TEXT_MODE else 3
+        cells = self.width * self.height
+        low = min(self.dirty_low // per_cell, cells - 1)
+        high = min(self.dirty_high // per_cell, cells - 1)
+        y0, y1 = low // self.width, high // self.width + 1
+        if y1 - y0 == 1:
+            return low % self.width, y0, high % self.width + 1, y1
+        return 0, y0, self.width, y1
+
+    def present(self):
+        # Called on writes to PRESENT_REGISTER and once per frame by the CPU's render loop
+        rect = self.dirty_rect()
+        if rect is None:
+            return
+        self.backend.present(self.mode, rect)
+        self.dirty_low = self.graphics_buffer.size
+        self.dirty_high = -1
+
+    def render(self):
+        self.present()
+
+    def screen_text(self):
+        # Text cells as lines with trailing blanks removed, for checking screen output
+        rows = self.text_buffer.reshape(self.height, self.width)
+        return [''.join(map(chr, row.tolist())).rstrip() for row in rows]
+
+    def get_state(self):
+        return {
+            'registers': list(self.registers),
+            'mode': self.mode,
+            'text_buffer': self.text_buffer.copy(),
+            'graphics_buffer': self.graphics_buffer.copy(),
+        }
+
+    def set_state(self, state):
+        self.registers = list(state['registers'])
+        self.mode = state['mode']
+        self.text_buffer[:] = state['text_buffer']
+        self.graphics_buffer[:] = state['graphics_buffer']
+        self.mark_all_dirty()
+        self.present()
 
     def input_process(self, queue):
         pid = os.getpid()
@@ -165,28 +833,377 @@ class Display(Peripheral):
             queue.put(message)  # Put the value and port number in the queue
 
 
-class Keyboard(Peripheral):
+class InterruptController(Peripheral):
+    # Interrupt lines 0..LINES-1 with pending bits, a mask, per-line priorities and a global enable.
+    # The CPU owns one (cpu.interrupt_controller) whether or not it is mapped on the bus.
+    # Ports: 0 = pending bits (writing 1s clears them), 1 = mask (1 = line enabled), 2 = global enable,
+    #        3 = raise (write a line number), 4 = line in service (-1 when none), 0x10 + n = priority of line n.
+    # The highest-priority pending, unmasked line is delivered first; ties go to the lower line number.
+    # Delivery clears the global enable until IRET, so handlers are not re-entered by other interrupts.
+    # cpu.interrupt_pending is kept equal to "enabled and pending & mask", the one test the run loops make.
+    # Line numbers outside 0..LINES-1 are ignored, wherever they come from, so a guest cannot fault the CPU with one.
+    LINES = 32
+    PENDING_PORT = 0
+    MASK_PORT = 1
+    ENABLE_PORT = 2
+    RAISE_PORT = 3
+    IN_SERVICE_PORT = 4
+    PRIORITY_PORT = 0x10
+
     def __init__(self, base_address):
         super().__init__(base_address)
-        self.buffer = ""
+        self.cpu = None
+        self.lock = threading.Lock()  # raise_line may run on device threads
+        self.reset()
 
-    def read(self, address):
-        # Implement the read method for the keyboard device
-        if address == self.base_address:
-            if self.buffer:
-                return self.buffer[0]
-            else:
+    def reset(self):
+        self.pending = 0
+        self.mask = (1 << InterruptController.LINES) - 1
+        self.enabled = 1
+        self.in_service = []  # Lines whose handlers have not returned yet, innermost last
+        self.priorities = [0] * InterruptController.LINES
+        self.order = list(range(InterruptController.LINES))  # Lines by descending priority
+        self.raised_at = [None] * InterruptController.LINES  # cpu.retired when each line last became pending
+        self.update()
+
+    def attach(self, cpu):
+        self.cpu = cpu
+        self.update()
+
+    def update(self):
+        if self.cpu is not None:
+            self.cpu.interrupt_pending = bool(self.enabled and self.pending & self.mask)
+
+    @staticmethod
+    def valid_line(line):
+        return 0 <= line < InterruptController.LINES
+
+    def raise_line(self, line):
+        if not InterruptController.valid_line(line):
+            return
+        with self.lock:
+            if self.cpu is not None and not self.pending >> line & 1:
+                self.raised_at[line] = self.cpu.retired
+            self.pending |= 1 << line
+            self.update()
+        if self.cpu is not None:
+            self.cpu.wakeup.set()
+
+    def acknowledge(self):
+        # Line to deliver now, or None; clears its pending bit and disables interrupts until end_of_interrupt
+        with self.lock:
+            active = self.pending & self.mask if self.enabled else 0
+            if not active:
+                self.update()
                 return None
+            for line in self.order:
+                if active >> line & 1:
+                    break
+            self.pending &= ~(1 << line)
+            self.enabled = 0
+            self.in_service.append(line)
+            self.update()
+            return line
+
+    def enter(self, line):
+        # Software interrupt (INT) taken synchronously
+        with self.lock:
+            self.enabled = 0
+            self.in_service.append(line)
+            self.update()
+
+    def end_of_interrupt(self):
+        with self.lock:
+            if self.in_service:
+                self.in_service.pop()
+            self.enabled = 1
+            self.update()
+
+    def read(self, address):
+        if address == InterruptController.PENDING_PORT:
+            return self.pending
+        elif address == InterruptController.MASK_PORT:
+            return self.mask
+        elif address == InterruptController.ENABLE_PORT:
+            return self.enabled
+        elif address == InterruptController.IN_SERVICE_PORT:
+            return self.in_service[-1] if self.in_service else -1
+        elif InterruptController.PRIORITY_PORT <= address < InterruptController.PRIORITY_PORT + InterruptController.LINES:
+            return self.priorities[address - InterruptController.PRIORITY_PORT]
+        elif address == InterruptController.RAISE_PORT:
+            return 0
+        raise IndexError("Interrupt controller port out of range")
+
+    def write(self, address, value):
+        if address == InterruptController.PENDING_PORT:
+            with self.lock:
+                self.pending &= ~value
+                self.update()
+        elif address == InterruptController.MASK_PORT:
+            self.mask = value
+            self.update()
+        elif address == InterruptController.ENABLE_PORT:
+            self.enabled = 1 if value else 0
+            self.update()
+        elif address == InterruptController.RAISE_PORT:
+            self.raise_line(value)
+        elif InterruptController.PRIORITY_PORT <= address < InterruptController.PRIORITY_PORT + InterruptController.LINES:
+            self.priorities[address - InterruptController.PRIORITY_PORT] = value
+            self.order = sorted(range(InterruptController.LINES), key=lambda line: (-self.priorities[line], line))
         else:
-            raise IndexError("Address out of range")
-    
+            raise IndexError("Interrupt controller port out of range")
+
+    def get_state(self):
+        return {'pending': self.pending, 'mask': self.mask, 'enabled': self.enabled,
+                'in_service': list(self.in_service), 'priorities': list(self.priorities)}
+
+    def set_state(self, state):
+        self.pending = state['pending']
+        self.mask = state['mask']
+        self.enabled = state['enabled']
+        self.in_service = list(state['in_service'])
+        if state['priorities'] != self.priorities:
+            self.priorities = list(state['priorities'])
+            self.order = sorted(range(InterruptController.LINES), key=lambda line: (-self.priorities[line], line))
+        self.update()
+
+
+class Timer(Peripheral):
+    # Counts retired instructions and raises interrupt `irq` when `period` of them have passed.
+    # Ports: 0 = period, 1 = control (bit 0 = run, bit 1 = periodic; one-shot otherwise),
+    #        2 = instructions left until it fires (read only), 3 = interrupt line (invalid line numbers are ignored).
+    # The CPU ends its batches at the nearest timer deadline (CPU.next_deadline), so counting costs nothing
+    # per instruction. Writing the control or period register restarts the count.
+    PERIOD_PORT = 0
+    CONTROL_PORT = 1
+    REMAINING_PORT = 2
+    IRQ_PORT = 3
+    CONTROL_RUN = 1
+    CONTROL_PERIODIC = 2
+
+    def __init__(self, base_address, irq=1):
+        super().__init__(base_address)
+        self.cpu = None
+        self.period = 0
+        self.control = 0
+        self.irq = irq
+        self.deadline = None  # cpu.retired value at which the timer fires, None while stopped
+        self.fired = 0
+
+    def attach(self, cpu):
+        self.cpu = cpu
+        cpu.timers.append(self)
+        self.restart()
+
+    def detach(self, cpu):
+        if self in cpu.timers:
+            cpu.timers.remove(self)
+        self.cpu = None
+
+    def restart(self, remaining=None):
+        if self.cpu is None or not self.control & Timer.CONTROL_RUN or self.period <= 0:
+            self.deadline = None
+        else:
+            self.deadline = self.cpu.retired + (self.period if remaining is None else remaining)
+            self.cpu.schedule(self.deadline)
+
+    def expire(self):
+        # Called by the CPU once cpu.retired reaches self.deadline
+        self.fired += 1
+        self.cpu.request_interrupt(self.irq)
+        if self.control & Timer.CONTROL_PERIODIC:
+            self.deadline += self.period
+            if self.deadline <= self.cpu.retired:
+                self.deadline = self.cpu.retired + self.period
+        else:
+            self.control &= ~Timer.CONTROL_RUN
+            self.deadline = None
+
+    def read(self, address):
+        if address == Timer.PERIOD_PORT:
+            return self.period
+        elif address == Timer.CONTROL_PORT:
+            return self.control
+        elif address == Timer.REMAINING_PORT:
+            return self.deadline - self.cpu.retired if self.deadline is not None else 0
+        elif address == Timer.IRQ_PORT:
+            return self.irq
+        raise IndexError("Timer port out of range")
+
     def write(self, address, value):
-        # Implement the write method for the keyboard device
-        if address == self.base_address:
-            self.buffer += chr(value)
+        if address == Timer.PERIOD_PORT:
+            self.period = value
+            self.restart()
+        elif address == Timer.CONTROL_PORT:
+            self.control = value
+            self.restart()
+        elif address == Timer.IRQ_PORT:
+            if InterruptController.valid_line(value):
+                self.irq = value
+        elif address != Timer.REMAINING_PORT:
+            raise IndexError("Timer port out of range")
+
+    def get_state(self):
+        remaining = self.deadline - self.cpu.retired if self.deadline is not None and self.cpu is not None else None
+        return {'period': self.period, 'control': self.control, 'irq': self.irq, 'remaining': remaining}
+
+    def set_state(self, state):
+        self.period = state['period']
+        self.control = state['control']
+        self.irq = state['irq']
+        if state['remaining'] is None:
+            self.deadline = None
+        else:
+            self.restart(state['remaining'])
+
+
+class Keyboard(Peripheral):
+    # Fixed-size ring buffer of key codes. Ports: 0 = number of buffered keys, 1 = next key (0 when empty;
+    # writing it injects a key), 2 = control (bit 0 enables the keyboard interrupt).
+    # Keys come from a scripted input (load_script, topped up as the guest consumes them) or from a host reader
+    # thread on the controlling terminal. Every arrival raises interrupt `irq`, vector 0x80 + irq; it is raised
+    # again after a read that leaves keys behind, so none are stranded when interrupts were already pending.
+    STATUS_PORT = 0
+    DATA_PORT = 1
+    CONTROL_PORT = 2
+    CONTROL_IRQ_ENABLE = 1
+
+    def __init__(self, base_address, capacity=256, irq=0):
+        super().__init__(base_address)
+        self.capacity = capacity
+        self.ring = array('q', bytes(capacity * 8))
+        self.head = 0  # Total keys consumed; only the CPU thread moves it
+        self.tail = 0  # Total keys stored; only the producer moves it
+        self.dropped = 0
+        self.irq = irq
+        self.control = Keyboard.CONTROL_IRQ_ENABLE
+        self.script = deque()  # Scripted keys not yet in the ring
+        self.cpu = None
+        self.reader = None
+        self.reader_stop = threading.Event()
+
+    def attach(self, cpu):
+        self.cpu = cpu
+        if self.tail != self.head:
+            self.raise_interrupt()
+
+    def raise_interrupt(self):
+        if self.cpu is not None and self.control & Keyboard.CONTROL_IRQ_ENABLE:
+            self.cpu.request_interrupt(self.irq)
+
+    def push(self, code):
+        # Producer side; False when the ring is full
+        if self.tail - self.head >= self.capacity:
+            self.dropped += 1
+            return False
+        self.ring[self.tail % self.capacity] = code
+        self.tail += 1
+        self.raise_interrupt()
+        return True
+
+    def pop(self):
+        if self.head == self.tail:
+            return 0
+        code = self.ring[self.head % self.capacity]
+        self.head += 1
+        if self.script:
+            self.top_up()
+        if self.head != self.tail:
+            self.raise_interrupt()
+        return code
+
+    def top_up(self):
+        while self.script and self.tail - self.head < self.capacity:
+            self.push(self.script.popleft())
+
+    def feed(self, data):
+        # Queue scripted input (str or bytes); it enters the ring as space frees up
+        self.script.extend(data.encode() if isinstance(data, str) else data)
+        self.top_up()
+
+    def load_script(self, file_path):
+        with open(file_path, 'rb') as file:
+            self.feed(file.read())
+
+    def start_host_reader(self, stream=None):
+        # Reads the host terminal without line buffering or echo in a daemon thread.
+        # The CPU counts the reader as an interrupt source, so WFI really waits for keys.
+        stream = sys.stdin if stream is None else stream
+        if self.reader is not None:
+            return
+        self.reader_stop.clear()
+        self.reader = threading.Thread(target=self.host_reader, args=(stream,), daemon=True)
+        if self.cpu is not None:
+            self.cpu.interrupt_sources += 1
+        self.reader.start()
+
+    def stop_host_reader(self):
+        if self.reader is None:
+            return
+        self.reader_stop.set()
+        self.reader.join(1)
+        self.reader = None
+        if self.cpu is not None:
+            self.cpu.interrupt_sources -= 1
+
+    def host_reader(self, stream):
+        if os.name == "nt":
+            import msvcrt
+            while not self.reader_stop.is_set():
+                if msvcrt.kbhit():
+                    self.push(ord(msvcrt.getwch()))
+                else:
+                    time.sleep(0.01)
+            return
+        import select
+        import termios
+        import tty
+        fd = stream.fileno()
+        saved = termios.tcgetattr(fd) if stream.isatty() else None
+        try:
+            if saved is not None:
+                tty.setcbreak(fd)  # Raw key input; ISIG stays on so Ctrl-C still stops the emulator
+            while not self.reader_stop.is_set():
+                ready, _, _ = select.select([fd], [], [], 0.1)
+                if ready:
+                    data = os.read(fd, 64)
+                    if not data:  # End of input
+                        break
+                    for code in data:
+                        self.push(code)
+        finally:
+            if saved is not None:
+                termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+
+    def read(self, address):
+        if address == Keyboard.DATA_PORT:
+            return self.pop()
+        elif address == Keyboard.STATUS_PORT:
+            return self.tail - self.head
+        elif address == Keyboard.CONTROL_PORT:
+            return self.control
+        raise IndexError("Address out of range")
+
+    def write(self, address, value):
+        if address == Keyboard.DATA_PORT:
+            self.push(value)
+        elif address == Keyboard.CONTROL_PORT:
+            self.control = value
         else:
             raise IndexError("Address out of range")
-        
+
+    def get_state(self):
+        keys = [self.ring[index % self.capacity] for index in range(self.head, self.tail)]
+        return {'keys': keys, 'script': bytes(self.script), 'control': self.control}
+
+    def set_state(self, state):
+        self.head = self.tail = 0
+        for code in state['keys']:
+            self.ring[self.tail % self.capacity] = code
+            self.tail += 1
+        self.script = deque(state['script'])
+        self.control = state['control']
+
     def input_process(self, queue):
         while True:
             message = queue.get()
@@ -201,10 +1218,11 @@ class Terminal(Peripheral):
     TEXT_MODE = 0
     GRAPHICS_MODE = 1
 
-    def __init__(self, base_address, width=80, height=25):
+    def __init__(self, base_address, width=80, height=25, output=sys.stdout):
         super().__init__(base_address)
         self.width = width
         self.height = height
+        self.output = output  # Stream render() prints frames to, None to discard them
         self.mode = Terminal.TEXT_MODE
         self.text_buffer = [' '] * (width * height)
         self.graphics_buffer = [(0, 0, 0)] * (width * height)  # 24-bit color (RGB)
@@ -248,16 +1266,38 @@ class Terminal(Peripheral):
             raise IndexError("Terminal address out of range")
 
     def render(self):
+        if self.output is None:
+            return
         if self.mode == Terminal.TEXT_MODE:
-            for y in range(self.height):
-                line = self.text_buffer[y * self.width:(y + 1) * self.width]
-                print(''.join(line))
+            for line in self.screen_text():
+                print(line, file=self.output)
         else:
             for y in range(self.height):
                 line = self.graphics_buffer[y * self.width:(y + 1) * self.width]
-                print(' '.join(f"({r},{g},{b})" for r, g, b in line))
+                print(' '.join(f"({r},{g},{b})" for r, g, b in line), file=self.output)
+
+    def screen_text(self):
+        return [''.join(self.text_buffer[y * self.width:(y + 1) * self.width]) for y in range(self.height)]
 
     def handle_keypress(self, key):
         self.keyboard_buffer.put(ord(key))
 
+    def get_state(self):
+        return {
+            'mode': self.mode,
+            'text_buffer': list(self.text_buffer),
+            'graphics_buffer': list(self.graphics_buffer),
+            'keyboard_buffer': list(self.keyboard_buffer.queue),
+            'current_address': self.current_address,
+        }
+
+    def set_state(self, state):
+        self.mode = state['mode']
+        self.text_buffer = list(state['text_buffer'])
+        self.graphics_buffer = list(state['graphics_buffer'])
+        self.keyboard_buffer = queue.Queue()
+        for key in state['keyboard_buffer']:
+            self.keyboard_buffer.put(key)
+        self.current_address = state['current_address']
+
 
@@ -0,0 +1,147 @@
+import bisect
+from collections import defaultdict
+
+from assembler import Assembler
+
+# Opcodes the profiled run loop reports to Profiler.before/after
+OP_INT = Assembler.INSTRUCTIONS['INT']
+OP_IRET = Assembler.INSTRUCTIONS['IRET']
+OP_IN = Assembler.INSTRUCTIONS['IN']
+OP_OUT = Assembler.INSTRUCTIONS['OUT']
+OP_CALL = Assembler.INSTRUCTIONS['CALL']
+OP_RET = Assembler.INSTRUCTIONS['RET']
+PROFILED_OPCODES = frozenset((OP_INT, OP_IRET, OP_IN, OP_OUT, OP_CALL, OP_RET))
+
+
+class Profiler:
+    # Guest profile gathered by CPU.run_profiled: retire counts per PC and opcode, a shadow call stack
+    # driven by CALL/RET, INT/IRET and delivered interrupts, port accesses and interrupt latency.
+    # Each retired instruction is charged to the current stack; inclusive and exclusive routine costs
+    # and the collapsed stacks are derived from those counts when the report is written.
+    # With a SymbolTable, routines and hot spots are named by label and source line.
+    def __init__(self, cpu, names=None, symbols=None):
+        self.cpu = cpu
+        self.symbols = symbols
+        self.names = {}  # address -> routine name; unnamed routines are shown by address
+        self.name_addresses = []
+        if names is None and symbols is not None:
+            names = symbols.names()
+        if names:
+            self.set_names(names)
+        self.clear()
+
+    def clear(self):
+        self.pc_counts = defaultdict(int)
+        self.opcode_counts = [0] * 256
+        self.stack = (self.cpu.pc,)  # Entry addresses of the active routines, outermost first
+        self.stacks = defaultdict(int)  # stack -> instructions retired with it on top
+        self.calls = defaultdict(int)  # routine entry -> times entered
+        self.port_reads = defaultdict(int)
+        self.port_writes = defaultdict(int)
+        self.latencies = defaultdict(list)  # interrupt line -> [instructions from raise to delivery]
+        self.retired = 0
+
+    def set_names(self, names):
+        self.names = dict(names)
+        self.name_addresses = sorted(self.names)
+
+    def name(self, address):
+        return self.names.get(address, f"{address:04X}")
+
+    def routine_at(self, pc):
+        # Label range holding pc (or the nearest named address at or below it), for labelling hot spots
+        if self.symbols is not None:
+            symbol = self.symbols.symbol_at(pc)
+            if symbol is None:
+                return ""
+            name, offset = symbol
+            return f"{name}+{offset:X}" if offset else name
+        index = bisect.bisect_right(self.name_addresses, pc) - 1
+        if index < 0:
+            return ""
+        address = self.name_addresses[index]
+        return self.names[address] if address == pc else f"{self.names[address]}+{pc - address:X}"
+
+    def enter(self, address):
+        self.stack = self.stack + (address,)
+        self.calls[address] += 1
+
+    def leave(self):
+        if len(self.stack) > 1:
+            self.stack = self.stack[:-1]
+
+    def before(self, opcode, operands, operands_type):
+        if opcode == OP_IN:
+            self.port_reads[operands[1]] += 1
+        elif opcode == OP_OUT:
+            port = self.cpu.registers[operands[0]] if operands_type[0] == 1 else operands[0]
+            self.port_writes[port] += 1
+
+    def after(self, opcode):
+        if opcode == OP_CALL or opcode == OP_INT:
+            self.enter(self.cpu.pc)
+        elif opcode == OP_RET or opcode == OP_IRET:
+            self.leave()
+
+    def interrupt(self, line, retired):
+        # A device interrupt was delivered before instruction number `retired`
+        raised = self.cpu.interrupt_controller.raised_at[line]
+        if raised is not None:
+            self.latencies[line].append(retired - raised)
+        self.enter(self.cpu.pc)
+
+    def routine_costs(self):
+        # {entry: [inclusive, exclusive]} in retired instructions; recursion counts once per stack
+        costs = defaultdict(lambda: [0, 0])
+        for stack, count in self.stacks.items():
+            for address in set(stack):
+                costs[address][0] += count
+            costs[stack[-1]][1] += count
+        return costs
+
+    def device_name(self, port):
+        entry = self.cpu.bus.find(port)
+        if entry is None:
+            return f"unmapped {port:04X}"
+        start, end, device = entry
+        return f"{device.__class__.__name__}@{start:04X}"
+
+    def report(self, top=20):
+        total = sum(self.stacks.values()) or 1
+        lines = [f"{self.retired} instructions retired", ""]
+        lines.append(f"Hot spots (top {top}):")
+        lines.append(f"{'count':>12} {'%':>6}  {'pc':>6}  routine")
+        for pc, count in sorted(self.pc_counts.items(), key=lambda item: -item[1])[:top]:
+            line = f"{count:>12} {100 * count / total:>6.2f}  {pc:>6X}  {self.routine_at(pc)}"
+            location = self.symbols.location(pc) if self.symbols is not None else None
+            lines.append(f"{line}  ({location})" if location else line)
+        lines += ["", "Opcodes:"]
+        names = {opcode: mnemonic for mnemonic, opcode in Assembler.INSTRUCTIONS.items()}
+        for opcode, count in sorted(enumerate(self.opcode_counts), key=lambda item: -item[1]):
+            if count:
+                lines.append(f"{count:>12} {100 * count / total:>6.2f}  {names.get(opcode, opcode)}")
+        lines += ["", "Routines:", f"{'inclusive':>12} {'exclusive':>12} {'calls':>8}  routine"]
+        costs = self.routine_costs()
+        for address, (inclusive, exclusive) in sorted(costs.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{inclusive:>12} {exclusive:>12} {self.calls.get(address, 0):>8}  {self.name(address)}")
+        if self.port_reads or self.port_writes:
+            lines += ["", "I/O:", f"{'reads':>12} {'writes':>12}  port"]
+            for port in sorted(set(self.port_reads) | set(self.port_writes)):
+                lines.append(f"{self.port_reads.get(port, 0):>12} {self.port_writes.get(port, 0):>12}  "
+                             f"{port:04X} {self.device_name(port)}")
+        if self.latencies:
+            lines += ["", "Interrupt latency (instructions from raise to delivery):",
+                      f"{'line':>6} {'delivered':>10} {'mean':>10} {'max':>8}"]
+            for line, samples in sorted(self.latencies.items()):
+                lines.append(f"{line:>6} {len(samples):>10} {sum(samples) / len(samples):>10.1f} {max(samples):>8}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, file_path, top=20):
+        with open(file_path, 'w') as file:
+            file.write(self.report(top))
+
+    def write_collapsed(self, file_path):
+        # One "outer;inner;leaf count" line per stack, the input format of flamegraph.pl and speedscope
+        with open(file_path, 'w') as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(";".join(self.name(address) for address in stack) + f" {count}\n")
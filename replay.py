@@ -0,0 +1,175 @@
+import struct
+import zlib
+from array import array
+from collections import deque
+
+from memory import to_word, float_bits
+from snapshot import Snapshot
+
+REPLAY_MAGIC = b'ADVRPL\x00\x00'
+REPLAY_VERSION = 1
+
+# File layout, all integers little-endian:
+#   header:  magic (8 bytes), version (u16), reserved (u16), snapshot length (u32)
+#   body:    the machine snapshot taken when recording started, then one zlib stream of events
+# Events are (kind u8, flags u8, reserved u16, address u32, retired u64, value i64); a MEMORY event is followed
+# by `value` packed int64 words. `retired` is the retired instruction count when the event happened.
+HEADER = struct.Struct('<8sHHI')
+EVENT = struct.Struct('<BBHIQq')
+
+READ = 1  # address = port, value = value the device returned (flags = 1: a float, value holds its bits)
+INTERRUPT = 2  # address = interrupt line delivered before the next instruction
+MEMORY = 3  # address, value = word count: memory a device wrote while the CPU accessed it (DMA)
+WAIT = 4  # a WFI that found no interrupt and stays on the same PC
+
+
+class ReplayError(Exception):
+    # The replayed guest did something the log did not record
+    pass
+
+
+class ReplayRecorder:
+    # Logs everything that makes a run depend on the host: values read from device ports, memory devices
+    # write during port accesses, the points where interrupts were delivered and WFIs that waited.
+    def __init__(self, cpu, file_path):
+        self.cpu = cpu
+        self.file = open(file_path, 'wb')
+        snapshot = cpu.snapshot().to_bytes()
+        self.file.write(HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, 0, len(snapshot)))
+        self.file.write(snapshot)
+        self.compressor = zlib.compressobj()
+        self.buffer = bytearray()
+        self.device_active = False  # True while a device runs on behalf of IN/OUT
+        self.events = 0
+        cpu.memory.add_write_listener(self.memory_written)
+
+    def event(self, kind, address, value, flags=0, data=b''):
+        self.buffer += EVENT.pack(kind, flags, 0, address, self.cpu.retired, value)
+        self.buffer += data
+        self.events += 1
+        if len(self.buffer) >= 1 << 16:
+            self.file.write(self.compressor.compress(bytes(self.buffer)))
+            self.buffer.clear()
+
+    def read(self, address):
+        self.device_active = True
+        try:
+            value = self.cpu.bus.read(address)
+        finally:
+            self.device_active = False
+        if isinstance(value, float):
+            self.event(READ, address, float_bits(value), 1)
+        else:
+            self.event(READ, address, to_word(value))
+        return value
+
+    def write(self, address, value):
+        self.device_active = True
+        try:
+            self.cpu.bus.write(address, value)
+        finally:
+            self.device_active = False
+
+    def memory_written(self, address, length):
+        if self.device_active:
+            self.event(MEMORY, address, length, data=self.cpu.memory.read_block(address, length).tobytes())
+
+    def interrupt(self, line):
+        self.event(INTERRUPT, line, 0)
+
+    def waited(self):
+        self.event(WAIT, 0, 0)
+
+    def close(self):
+        self.cpu.memory.remove_write_listener(self.memory_written)
+        self.file.write(self.compressor.compress(bytes(self.buffer)))
+        self.file.write(self.compressor.flush())
+        self.file.close()
+
+
+class ReplayPlayer:
+    # Feeds a recorded log back: port reads return the logged values and devices are not consulted,
+    # port writes are dropped, logged device memory writes are stored again, and interrupts are delivered
+    # at their recorded instruction counts. It sits in cpu.timers, so batches end exactly at those counts.
+    def __init__(self, cpu, file_path):
+        self.cpu = cpu
+        with open(file_path, 'rb') as file:
+            data = file.read()
+        magic, version, _, snapshot_length = HEADER.unpack_from(data, 0)
+        if magic != REPLAY_MAGIC:
+            raise ValueError(f"{file_path} is not a replay log")
+        if version != REPLAY_VERSION:
+            raise ValueError(f"Unsupported replay log version {version}")
+        offset = HEADER.size
+        self.snapshot = Snapshot.from_bytes(data[offset:offset + snapshot_length])
+        events = zlib.decompress(data[offset + snapshot_length:])
+        self.accesses = deque()  # (kind, address, retired, value or words) for READ and MEMORY, in order
+        self.interrupts = deque()  # (retired, line)
+        self.waits = deque()  # retired counts of WFIs that waited
+        offset = 0
+        while offset < len(events):
+            kind, flags, _, address, retired, value = EVENT.unpack_from(events, offset)
+            offset += EVENT.size
+            if kind == READ:
+                if flags & 1:
+                    value = struct.unpack('<d', struct.pack('<q', value))[0]
+                self.accesses.append((READ, address, retired, value))
+            elif kind == MEMORY:
+                words = array('q')
+                words.frombytes(events[offset:offset + value * 8])
+                offset += value * 8
+                self.accesses.append((MEMORY, address, retired, words))
+            elif kind == INTERRUPT:
+                self.interrupts.append((retired, address))
+            elif kind == WAIT:
+                self.waits.append(retired)
+            else:
+                raise ValueError(f"Unknown replay event {kind}")
+        self.deadline = None
+
+    def start(self):
+        # Puts the machine back in its recorded starting state
+        self.cpu.restore(self.snapshot)
+        self.restart()
+
+    def restart(self):
+        self.deadline = self.interrupts[0][0] if self.interrupts else None
+
+    def expire(self):
+        cpu = self.cpu
+        while self.interrupts and self.interrupts[0][0] <= cpu.retired:
+            retired, line = self.interrupts.popleft()
+            cpu.interrupt_controller.enter(line)
+            cpu.enter_interrupt(line)
+        self.restart()
+
+    def store_memory(self, retired):
+        accesses = self.accesses
+        while accesses and accesses[0][0] == MEMORY and accesses[0][2] <= retired:
+            kind, address, retired_at, words = accesses.popleft()
+            self.cpu.memory.load_block(address, words)
+
+    def read(self, address):
+        retired = self.cpu.retired
+        self.store_memory(retired)
+        if not self.accesses:
+            raise ReplayError(f"Replay log exhausted: read of port {address:04X} at instruction {retired}")
+        kind, logged_address, logged_retired, value = self.accesses[0]
+        if kind != READ or logged_address != address or logged_retired != retired:
+            raise ReplayError(f"Replay diverged at instruction {retired}: read of port {address:04X}, "
+                              f"log has port {logged_address:04X} at instruction {logged_retired}")
+        self.accesses.popleft()
+        return value
+
+    def write(self, address, value):
+        self.store_memory(self.cpu.retired)
+
+    def waited(self):
+        # True when the recorded run's WFI at this instruction waited
+        if self.waits and self.waits[0] == self.cpu.retired:
+            self.waits.popleft()
+            return True
+        return False
+
+    def finished(self):
+        return not (self.accesses or self.interrupts or self.waits)
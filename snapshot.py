@@ -0,0 +1,67 @@
+import pickle
+import struct
+import sys
+import zlib
+from array import array
+
+SNAPSHOT_MAGIC = b'ADVSNAP1'
+
+# File layout, all integers little-endian:
+#   header:  magic (8 bytes), state length (u32), page count (u32)
+#   state:   zlib-compressed pickle of registers, flags, PC, ROM, float words and peripheral states
+#   pages:   page count x (page index u32, data length u32, zlib-compressed page of int64 words)
+HEADER = struct.Struct('<8sII')
+PAGE_HEADER = struct.Struct('<II')
+
+
+class Snapshot:
+    # Complete machine state taken by CPU.snapshot(). Held in memory it shares its pages copy-on-write
+    # with the CPU's paged memory, so snapshot and restore cost is proportional to the pages written since.
+    def __init__(self, state, memory):
+        self.state = state  # dict of CPU and peripheral state
+        self.memory = memory  # (pages, floats) from Memory.snapshot()
+
+    def to_bytes(self):
+        pages, floats = self.memory
+        state = dict(self.state, floats=floats)
+        state_data = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+        chunks = [HEADER.pack(SNAPSHOT_MAGIC, len(state_data), len(pages)), state_data]
+        for index in sorted(pages):
+            page = pages[index]
+            if sys.byteorder != 'little':
+                page = array('q', page)
+                page.byteswap()
+            data = zlib.compress(page.tobytes())
+            chunks.append(PAGE_HEADER.pack(index, len(data)))
+            chunks.append(data)
+        return b''.join(chunks)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, state_length, page_count = HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Not a machine snapshot")
+        offset = HEADER.size
+        state = pickle.loads(zlib.decompress(data[offset:offset + state_length]))
+        offset += state_length
+        pages = {}
+        for _ in range(page_count):
+            index, length = PAGE_HEADER.unpack_from(data, offset)
+            offset += PAGE_HEADER.size
+            page = array('q')
+            page.frombytes(zlib.decompress(data[offset:offset + length]))
+            if sys.byteorder != 'little':
+                page.byteswap()
+            pages[index] = page
+            offset += length
+        floats = state.pop('floats')
+        return cls(state, (pages, floats))
+
+    def save(self, file_path):
+        with open(file_path, 'wb') as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'rb') as file:
+            return cls.from_bytes(file.read())
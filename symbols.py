@@ -0,0 +1,92 @@
+import bisect
+import json
+import os
+
+SYMBOLS_VERSION = 1
+
+
+def symbols_path(program_path):
+    # The assembler writes prog.sym next to prog.hex / prog.bin
+    return os.path.splitext(program_path)[0] + '.sym'
+
+
+class SymbolTable:
+    # Labels and source lines of an assembled program. Each label covers the addresses up to the next
+    # label, so any PC can be named as LABEL+offset; the line table maps emitted addresses to file:line.
+    # File format (JSON): {"version", "files": [path], "symbols": [{"name", "start", "end"}],
+    #                      "lines": [[address, file index, line]]}
+    def __init__(self, symbols=None, lines=None):
+        self.symbols = sorted(symbols or [], key=lambda symbol: symbol[0])  # [(start, end, name)], stable for shared addresses
+        self.starts = [symbol[0] for symbol in self.symbols]
+        self.lines = dict(lines or {})  # address -> (file, line)
+
+    @classmethod
+    def from_labels(cls, labels, lines, end):
+        # Ranges from a label -> address map; end is one past the last emitted address
+        addresses = sorted(set(labels.values()))
+        symbols = []
+        for name, start in labels.items():
+            index = bisect.bisect_right(addresses, start)
+            symbols.append((start, addresses[index] if index < len(addresses) else max(end, start + 1), name))
+        return cls(symbols, lines)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path, 'r') as file:
+            data = json.load(file)
+        if data.get('version') != SYMBOLS_VERSION:
+            raise ValueError(f"Unsupported symbol file version {data.get('version')}")
+        files = data['files']
+        symbols = [(symbol['start'], symbol['end'], symbol['name']) for symbol in data['symbols']]
+        lines = {address: (files[index], line) for address, index, line in data['lines']}
+        return cls(symbols, lines)
+
+    @classmethod
+    def for_program(cls, program_path):
+        # Symbol table saved next to a program, or None when there is none
+        path = symbols_path(program_path)
+        return cls.load(path) if os.path.exists(path) else None
+
+    def save(self, file_path):
+        files = sorted(set(source for source, line in self.lines.values()))
+        index = {source: position for position, source in enumerate(files)}
+        data = {
+            'version': SYMBOLS_VERSION,
+            'files': files,
+            'symbols': [{'name': name, 'start': start, 'end': end} for start, end, name in self.symbols],
+            'lines': [[address, index[source], line] for address, (source, line) in sorted(self.lines.items())],
+        }
+        with open(file_path, 'w') as file:
+            json.dump(data, file, indent=1)
+
+    def names(self):
+        # address -> label, the first label when several share an address
+        names = {}
+        for start, end, name in self.symbols:
+            names.setdefault(start, name)
+        return names
+
+    def symbol_at(self, address):
+        # (name, offset) of the label whose range holds address, or None
+        index = bisect.bisect_right(self.starts, address) - 1
+        if index < 0 or address >= self.symbols[index][1]:
+            return None
+        start = self.starts[index]
+        index = bisect.bisect_left(self.starts, start)  # First of the labels sharing this address
+        return self.symbols[index][2], address - start
+
+    def location(self, address):
+        # "file:line" of the source line that emitted address, or None
+        entry = self.lines.get(address)
+        return f"{entry[0]}:{entry[1]}" if entry is not None else None
+
+    def describe(self, address):
+        symbol = self.symbol_at(address)
+        text = f"{address:04X}"
+        if symbol is not None:
+            name, offset = symbol
+            text += f" {name}+{offset:X}" if offset else f" {name}"
+        location = self.location(address)
+        if location is not None:
+            text += f" ({location})"
+        return text
@@ -0,0 +1,82 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from array import array
+
+from assembler import Assembler
+from binary_image import Image, Segment, is_image, read_image, write_image, SEGMENT_TEXT, SEGMENT_STATIC
+from cpu import CPU
+
+SOURCE = """
+.text
+.org 0x100
+START:
+        MOV %R1, 0x3
+        HALT
+.static
+.org 0x180
+TABLE:
+        MOV %R2, 0x2A
+"""
+
+
+class BinaryImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.paths = []
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def temp_path(self, suffix):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        os.close(handle)
+        self.paths.append(path)
+        return path
+
+    def test_round_trip(self):
+        path = self.temp_path('.img')
+        segments = [Segment(SEGMENT_TEXT, 0x100, array('q', [1, -1, 1 << 62])),
+                    Segment(SEGMENT_STATIC, 0x800, array('q', [-(1 << 63)]))]
+        for entry in (0x100, 0, None):
+            write_image(path, Image(segments, entry))
+            self.assertTrue(is_image(path))
+            image = read_image(path)
+            self.assertEqual(image.entry, entry)
+            self.assertEqual([(s.kind, s.address, list(s.words)) for s in image.segments],
+                             [(s.kind, s.address, list(s.words)) for s in segments])
+
+    def test_rejects_other_files(self):
+        path = self.temp_path('.hex')
+        with open(path, 'w') as file:
+            file.write("0100 0000000000000000\n")
+        self.assertFalse(is_image(path))
+        with self.assertRaises(ValueError):
+            read_image(path)
+
+    def test_image_loads_like_hex_dump(self):
+        hex_path, image_path = self.temp_path('.hex'), self.temp_path('.img')
+        assembler = Assembler()
+        with contextlib.redirect_stdout(io.StringIO()):
+            lines = assembler.preprocess(SOURCE.splitlines())
+            assembler.first_pass(lines)
+            assembler.second_pass(lines)
+            assembler.write_output(hex_path)
+            assembler.write_image(image_path)
+        cpus = []
+        for path in (hex_path, image_path):
+            cpu = CPU()
+            cpu.load_memory_dump(path)
+            cpus.append(cpu)
+        self.assertIsNone(cpus[0].load_memory_dump(hex_path))
+        self.assertEqual(cpus[1].load_memory_dump(image_path), 0x100)
+        self.assertEqual([cpus[0].memory.read(a) for a in range(0x100, 0x200)],
+                         [cpus[1].memory.read(a) for a in range(0x100, 0x200)])
+        self.assertNotEqual(cpus[1].memory.read(0x180), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+
+from bus import Bus
+from cpu import CPU
+from peripherial import Peripheral, Storage
+
+
+class Ports(Peripheral):
+    # Remembers the last value written to each port
+    def __init__(self, base_address):
+        super().__init__(base_address)
+        self.values = {}
+
+    def read(self, address):
+        return self.values.get(address, address)
+
+    def write(self, address, value):
+        self.values[address] = value
+
+
+class BusTest(unittest.TestCase):
+
+    def test_overlapping_ranges_are_rejected(self):
+        bus = Bus()
+        bus.map(Ports(0x400), 0x400, 0x10)
+        for base, size in ((0x408, 0x10), (0x3F8, 0x10), (0x400, 1), (0x300, 0x200)):
+            with self.assertRaises(ValueError):
+                bus.map(Ports(base), base, size)
+        bus.map(Ports(0x410), 0x410, 0x10)  # Adjacent ranges are fine
+        with self.assertRaises(ValueError):
+            bus.map(Ports(0x500), 0x500, 0)
+
+    def test_unmapped_addresses_raise_index_error(self):
+        bus = Bus()
+        device = Ports(0x420)
+        bus.map(device, 0x420, 4)
+        for address in (0x41F, 0x424, 0x0, 0x9000):
+            with self.assertRaises(IndexError):
+                bus.read(address)
+            with self.assertRaises(IndexError):
+                bus.write(address, 1)
+        bus.write(0x423, 5)
+        self.assertEqual(device.values, {3: 5})
+        self.assertEqual(bus.read(0x421), 1)
+
+    def test_decode_cache_follows_map_and_unmap(self):
+        bus = Bus()
+        with self.assertRaises(IndexError):
+            bus.read(0x610)  # Caches the page as unmapped
+        device = Ports(0x600)
+        bus.map(device, 0x600, 0x20)
+        self.assertEqual(bus.read(0x610), 0x10)
+        bus.unmap(device)
+        with self.assertRaises(IndexError):
+            bus.read(0x610)
+
+    def test_cpu_rejects_overlapping_peripherals(self):
+        cpu = CPU()
+        cpu.add_peripheral(Storage(base_address=0x400, size=1024))
+        with self.assertRaises(ValueError):
+            cpu.add_peripheral(Ports(0x500), size=1)
+        with self.assertRaises(IndexError):
+            cpu.read_from_peripheral(0x900)
+
+
+if __name__ == '__main__':
+    unittest.main()
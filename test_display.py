@@ -0,0 +1,54 @@
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from peripherial import Display, HeadlessBackend, NullBackend, Terminal
+
+
+class DisplayBackendTest(unittest.TestCase):
+
+    def write_text(self, display, text, offset=0):
+        for index, char in enumerate(text):
+            display.write(10 + offset + index, ord(char))
+
+    def test_null_backend_keeps_screen_text(self):
+        display = Display(base_address=0x1000, width=8, height=2, backend=NullBackend())
+        self.write_text(display, "hi", offset=8)
+        display.write(Display.PRESENT_REGISTER, 1)
+        self.assertEqual(display.screen_text(), ["", "hi"])
+        display.close()
+
+    def test_headless_backend_dumps_every_frame(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.dump_frames(directory)
+
+    def dump_frames(self, directory):
+        pattern = os.path.join(directory, "frame{frame}.raw")
+        display = Display(base_address=0x1000, width=4, height=2, backend=HeadlessBackend(pattern, every=1))
+        self.write_text(display, "ab")
+        display.write(Display.PRESENT_REGISTER, 1)
+        display.write(Display.PRESENT_REGISTER, 1)  # Nothing changed: no frame is presented
+        self.write_text(display, "c", offset=5)
+        display.present()
+        display.close()
+        self.assertEqual(sorted(os.listdir(directory)), ["frame1.raw", "frame2.raw"])
+        with open(pattern.format(frame=2), 'rb') as file:
+            cells = np.frombuffer(file.read(), dtype=np.uint32)
+        self.assertEqual(''.join(map(chr, cells.tolist())), "ab   c  ")
+
+    def test_terminal_output_stream(self):
+        terminal = Terminal(base_address=0x2000, width=3, height=1, output=None)
+        terminal.write(2, ord('o'))
+        terminal.write(3, ord('k'))
+        terminal.render()
+        self.assertEqual(terminal.screen_text(), ["ok "])
+        terminal.output = io.StringIO()
+        terminal.render()
+        self.assertEqual(terminal.output.getvalue(), "ok \n")
+
+
+if __name__ == '__main__':
+    unittest.main()
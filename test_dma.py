@@ -0,0 +1,34 @@
+import unittest
+
+from cpu import CPU, DMA_BASE
+from memory import Memory
+from peripherial import DMAController
+
+
+class DMAControllerTest(unittest.TestCase):
+
+    def copy(self, cpu, source, destination, length, control=DMAController.CONTROL_START):
+        dma = cpu.peripherals[DMA_BASE]
+        dma.write(DMAController.SOURCE_PORT, source)
+        dma.write(DMAController.DESTINATION_PORT, destination)
+        dma.write(DMAController.LENGTH_PORT, length)
+        dma.write(DMAController.CONTROL_PORT, control)
+        return dma.read(DMAController.STATUS_PORT), dma.read(DMAController.MOVED_PORT)
+
+    def test_memory_copy_keeps_float_words(self):
+        for backing in Memory.BACKINGS:
+            with self.subTest(backing=backing):
+                cpu = CPU(memory_backing=backing)
+                cpu.add_peripheral(DMAController(base_address=DMA_BASE))
+                words = [7, 2.5, -3, 0.0, 1 << 40]
+                for offset, value in enumerate(words):
+                    cpu.memory.load(0x900 + offset, value)
+                cpu.memory.load(0xA02, 9.75)  # Float overwritten by an integer word
+                self.assertEqual(self.copy(cpu, 0x900, 0xA00, len(words)), (DMAController.STATUS_DONE, len(words)))
+                copied = [cpu.memory.read(0xA00 + offset) for offset in range(len(words))]
+                self.assertEqual(copied, words)
+                self.assertEqual([type(value) for value in copied], [type(value) for value in words])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import tempfile
+import unittest
+
+from cpu import CPU, STOP_HALT, TIMER_BASE, INTERRUPT_CONTROLLER_BASE
+from peripherial import InterruptController, Keyboard, Timer
+from test_jit import assemble
+
+
+class InterruptControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cpu = CPU()
+        self.controller = self.cpu.interrupt_controller
+
+    def test_priority_then_lower_line(self):
+        self.controller.write(InterruptController.PRIORITY_PORT + 3, 5)
+        for line in (1, 3, 2):
+            self.controller.raise_line(line)
+        self.assertEqual(self.controller.acknowledge(), 3)
+        self.controller.end_of_interrupt()
+        self.assertEqual(self.controller.acknowledge(), 1)
+        self.controller.end_of_interrupt()
+        self.assertEqual(self.controller.acknowledge(), 2)
+
+    def test_mask_holds_line_pending(self):
+        self.controller.write(InterruptController.MASK_PORT, ~(1 << 4))
+        self.controller.raise_line(4)
+        self.assertFalse(self.cpu.interrupt_pending)
+        self.assertIsNone(self.controller.acknowledge())
+        self.controller.write(InterruptController.MASK_PORT, -1)
+        self.assertTrue(self.cpu.interrupt_pending)
+        self.assertEqual(self.controller.acknowledge(), 4)
+
+    def test_delivery_disables_until_end_of_interrupt(self):
+        self.controller.raise_line(0)
+        self.controller.raise_line(1)
+        self.assertEqual(self.controller.acknowledge(), 0)
+        self.assertEqual(self.controller.read(InterruptController.IN_SERVICE_PORT), 0)
+        self.assertIsNone(self.controller.acknowledge())
+        self.controller.end_of_interrupt()
+        self.assertEqual(self.controller.read(InterruptController.IN_SERVICE_PORT), -1)
+        self.assertEqual(self.controller.acknowledge(), 1)
+
+    def test_invalid_lines_are_ignored(self):
+        for line in (-1, InterruptController.LINES, 0x28):
+            self.controller.write(InterruptController.RAISE_PORT, line)
+        self.assertEqual(self.controller.pending, 0)
+        timer = Timer(base_address=TIMER_BASE)
+        timer.write(Timer.IRQ_PORT, 0x28)
+        self.assertEqual(timer.read(Timer.IRQ_PORT), 1)
+
+
+class GuestInterruptTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.program = tempfile.mkstemp(suffix='.hex')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.program)
+
+    def run_guest(self, source, cycles=1000):
+        assemble(source, self.program)
+        cpu = CPU()
+        cpu.frame_interval = 0
+        cpu.load_memory_dump(self.program)
+        cpu.pc = 0x100
+        cpu.registers[14] = 0x7F0
+        for line in range(InterruptController.LINES):
+            cpu.memory.load(cpu.INTERRUPT_VECTOR_BASE + line, 0x400)
+        cpu.add_peripheral(cpu.interrupt_controller)
+        cpu.add_peripheral(Timer(base_address=TIMER_BASE))
+        return cpu, cpu.run_until(cycles=cycles)
+
+    def test_guest_raising_invalid_line_does_not_fault(self):
+        cpu, reason = self.run_guest(f"""
+.text
+.org 0x100
+START:
+        MOV %R1, 0x28
+        OUT #{INTERRUPT_CONTROLLER_BASE + InterruptController.RAISE_PORT:#x}, %R1
+        MOV %R1, 0x3
+        OUT #{INTERRUPT_CONTROLLER_BASE + InterruptController.RAISE_PORT:#x}, %R1
+        HALT
+.org 0x400
+ISR:
+        ADDI %R5, %R5, 0x1
+        IRET
+""")
+        self.assertEqual(reason, STOP_HALT)
+        self.assertIsNone(cpu.fault)
+        self.assertEqual(cpu.registers[5], 1)
+
+    def test_interrupt_before_guest_sets_stack(self):
+        # A key typed before the first instruction is taken on the reset stack instead of faulting
+        assemble("""
+.text
+.org 0x100
+START:
+        HALT
+.org 0x400
+ISR:
+        IN %R1, #0x201
+        IRET
+""", self.program)
+        cpu = CPU()
+        cpu.load_memory_dump(self.program)
+        cpu.pc = 0x100
+        cpu.memory.load(cpu.INTERRUPT_VECTOR_BASE, 0x400)
+        keyboard = Keyboard(base_address=0x200)
+        cpu.add_peripheral(keyboard)
+        keyboard.feed(b"k")
+        self.assertEqual(cpu.run_until(cycles=100), STOP_HALT)
+        self.assertEqual(cpu.registers[1], ord('k'))
+        self.assertEqual(cpu.registers[14], cpu.reset_sp())
+
+    def test_timer_fires_at_its_deadline(self):
+        # One-shot timer with a period of 4 instructions, counted from the OUT that starts it
+        cpu, reason = self.run_guest(f"""
+.text
+.org 0x100
+START:
+        MOV %R1, 0x4
+        OUT #{TIMER_BASE + Timer.PERIOD_PORT:#x}, %R1
+        MOV %R1, 0x1
+        OUT #{TIMER_BASE + Timer.CONTROL_PORT:#x}, %R1
+        ADDI %R2, %R2, 0x1
+        ADDI %R2, %R2, 0x1
+        ADDI %R2, %R2, 0x1
+        ADDI %R2, %R2, 0x1
+        ADDI %R2, %R2, 0x1
+        HALT
+.org 0x400
+ISR:
+        MOV %R6, %R2
+        ADDI %R5, %R5, 0x1
+        IRET
+""")
+        self.assertEqual(reason, STOP_HALT)
+        self.assertEqual(cpu.registers[5], 1)
+        self.assertEqual(cpu.registers[6], 4)
+        self.assertEqual(cpu.peripherals[TIMER_BASE].fired, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from assembler import Assembler
+from cpu import CPU, STOP_HALT
+from peripherial import Keyboard
+
+
+def assemble(source, path):
+    assembler = Assembler()
+    with contextlib.redirect_stdout(io.StringIO()):
+        lines = assembler.preprocess(source.splitlines())
+        assembler.first_pass(lines)
+        assembler.second_pass(lines)
+        assembler.write_output(path)
+
+
+class JitEquivalenceTest(unittest.TestCase):
+    # Each program runs once in the interpreter and once through the JIT; both must end in the same state
+
+    def setUp(self):
+        handle, self.program = tempfile.mkstemp(suffix='.hex')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.program)
+
+    def run_both(self, source, setup=None, cycles=1000):
+        assemble(source, self.program)
+        results = []
+        for jit in (False, True):
+            cpu = CPU()
+            cpu.frame_interval = 0
+            if jit:
+                cpu.enable_jit()
+            cpu.load_memory_dump(self.program)
+            cpu.pc = 0x100
+            cpu.registers[14] = 0x7F0
+            if setup is not None:
+                setup(cpu)
+            reason = cpu.run_until(cycles=cycles)
+            results.append((reason, list(cpu.registers), cpu.retired))
+        self.assertEqual(results[0], results[1])
+        return results[0]
+
+    def test_store_into_running_block(self):
+        # The STORE patches the ADDI that follows it in the same block into MOV %R1, 0x5
+        source = """
+.text
+.org 0x100
+START:
+        MOV %R1, 0x0
+        MOV %R4, 0x0
+        LOAD %R3, %R4, 0x200
+        STORE %R3, %R4, 0x104
+        ADDI %R1, %R1, 0x1
+        HALT
+.org 0x200
+PATCH:
+        MOV %R1, 0x5
+"""
+        reason, registers, retired = self.run_both(source)
+        self.assertEqual(reason, STOP_HALT)
+        self.assertEqual(registers[1], 5)
+        self.assertEqual(retired, 6)
+
+    def test_interrupt_raised_by_port_read(self):
+        # Popping a key while another is buffered raises the keyboard interrupt again; it has to be
+        # delivered before the HALT that follows the IN
+        source = """
+.text
+.org 0x100
+START:
+        IN %R1, #0x201
+        HALT
+.org 0x400
+ISR:
+        ADDI %R5, %R5, 0x1
+        IRET
+"""
+
+        def setup(cpu):
+            cpu.memory.load(cpu.INTERRUPT_VECTOR_BASE, 0x400)
+            keyboard = Keyboard(base_address=0x200)
+            cpu.add_peripheral(keyboard)
+            keyboard.feed(b"ab")
+
+        reason, registers, retired = self.run_both(source, setup)
+        self.assertEqual(reason, STOP_HALT)
+        self.assertEqual(registers[1], ord('a'))
+        self.assertEqual(registers[5], 2)
+        self.assertEqual(retired, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+
+from memory import Memory
+
+
+class PimRangeTest(unittest.TestCase):
+    # Range PIM has to give the same result on every backing
+
+    def test_overlapping_ranges_read_before_store(self):
+        for backing in Memory.BACKINGS:
+            with self.subTest(backing=backing):
+                memory = Memory(size=1 << 16, backing=backing)
+                memory.load_block(0x400, [1] * 5)
+                memory.pim_range('add', 0x400, 0x400, 0x401, 4)
+                self.assertEqual([memory.read(0x400 + offset) for offset in range(5)], [1, 2, 2, 2, 2])
+
+    def test_division_by_zero_stores_nothing(self):
+        for backing in Memory.BACKINGS:
+            with self.subTest(backing=backing):
+                memory = Memory(size=1 << 16, backing=backing)
+                memory.load_block(0x430, [1, 7])
+                memory.load_block(0x440, [10, 0])
+                with self.assertRaises(ZeroDivisionError):
+                    memory.pim_range('div', 0x430, 0x440, 0x430, 2)
+                self.assertEqual([memory.read(0x430), memory.read(0x431)], [1, 7])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+
+from cpu import CPU, STOP_FAULT, STOP_HALT, DMA_BASE, TIMER_BASE
+from peripherial import DMAController, InterruptController, Keyboard, RandomNumberGenerator, Timer
+from replay import ReplayError
+from test_jit import assemble
+
+# Sums random numbers and keys while a periodic timer interrupts the loop, then copies memory with DMA
+SOURCE = f"""
+.text
+.org 0x100
+START:
+        MOV %R2, 0x25
+        OUT #{TIMER_BASE + Timer.PERIOD_PORT:#x}, %R2
+        MOV %R2, 0x3
+        OUT #{TIMER_BASE + Timer.CONTROL_PORT:#x}, %R2
+        MOV %R6, 0x0
+        MOV %R7, 0x40
+        MOV %R9, 0x1
+LOOP:
+        IN %R3, #0x600
+        ADD %R6, %R6, %R3
+        IN %R4, #0x201
+        ADD %R6, %R6, %R4
+        SUB %R7, %R7, %R9
+        JNZ LOOP
+        MOV %R2, 0x900
+        OUT #{DMA_BASE + DMAController.SOURCE_PORT:#x}, %R2
+        MOV %R2, 0xA00
+        OUT #{DMA_BASE + DMAController.DESTINATION_PORT:#x}, %R2
+        MOV %R2, 0x4
+        OUT #{DMA_BASE + DMAController.LENGTH_PORT:#x}, %R2
+        MOV %R2, 0x1
+        OUT #{DMA_BASE + DMAController.CONTROL_PORT:#x}, %R2
+        IN %R8, #{DMA_BASE + DMAController.STATUS_PORT:#x}
+        HALT
+.org 0x400
+ISR:
+        ADDI %R5, %R5, 0x1
+        IRET
+"""
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.program = tempfile.mkstemp(suffix='.hex')
+        os.close(handle)
+        handle, self.log = tempfile.mkstemp(suffix='.rpl')
+        os.close(handle)
+        assemble(SOURCE, self.program)
+
+    def tearDown(self):
+        os.remove(self.program)
+        os.remove(self.log)
+
+    def record(self):
+        cpu = CPU()
+        cpu.frame_interval = 0
+        cpu.load_memory_dump(self.program)
+        cpu.pc = 0x100
+        cpu.registers[14] = 0x7F0
+        for line in range(InterruptController.LINES):
+            cpu.memory.load(cpu.INTERRUPT_VECTOR_BASE + line, 0x400)
+        keyboard = Keyboard(base_address=0x200)
+        cpu.add_peripheral(keyboard)
+        cpu.add_peripheral(RandomNumberGenerator(base_address=0x600))
+        cpu.add_peripheral(cpu.interrupt_controller)
+        cpu.add_peripheral(Timer(base_address=TIMER_BASE))
+        cpu.add_peripheral(DMAController(base_address=DMA_BASE))
+        cpu.memory.load_block(0x900, [11, 22, 33, 44])
+        keyboard.feed(b"hello")
+        cpu.start_recording(self.log)
+        self.assertEqual(cpu.run_until(cycles=100000), STOP_HALT)
+        cpu.stop_recording()
+        return cpu
+
+    def state(self, cpu):
+        return list(cpu.registers), cpu.retired, [cpu.memory.read(0xA00 + i) for i in range(4)]
+
+    def test_replay_matches_recording(self):
+        recorded = self.record()
+        self.assertGreater(recorded.registers[5], 0)  # The timer and keyboard did interrupt the loop
+        for jit in (False, True):
+            with self.subTest(jit=jit):
+                cpu = CPU()  # No peripherals attached: everything comes from the log
+                cpu.frame_interval = 0
+                if jit:
+                    cpu.enable_jit()
+                player = cpu.start_replay(self.log)
+                self.assertEqual(cpu.run_until(cycles=100000), STOP_HALT)
+                self.assertIsNone(cpu.fault)
+                self.assertTrue(player.finished())
+                self.assertEqual(self.state(cpu), self.state(recorded))
+
+    def test_divergence_faults(self):
+        self.record()
+        cpu = CPU()
+        cpu.frame_interval = 0
+        cpu.start_replay(self.log)
+        cpu.run_until(cycles=20)
+        cpu.registers[7] = 1  # Leave the loop early: the next port read no longer matches the log
+        self.assertEqual(cpu.run_until(cycles=100000), STOP_FAULT)
+        self.assertIsInstance(cpu.fault, ReplayError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+from cpu import CPU, TIMER_BASE
+from memory import Memory
+from peripherial import Timer
+from snapshot import Snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def machine(self, backing):
+        cpu = CPU(memory_backing=backing)
+        cpu.add_peripheral(cpu.interrupt_controller)
+        cpu.add_peripheral(Timer(base_address=TIMER_BASE))
+        cpu.registers[3] = 42
+        cpu.floating_point_registers[2] = 1.5
+        cpu.flags['Z'] = 1
+        cpu.pc = 0x123
+        cpu.memory.load(0x500, 7)
+        cpu.memory.load(0x501, 2.5)
+        cpu.memory.load(0x12345, -9)
+        cpu.rom.load(3, 0x77)
+        cpu.interrupt_controller.raise_line(2)
+        timer = cpu.peripherals[TIMER_BASE]
+        timer.write(Timer.PERIOD_PORT, 50)
+        timer.write(Timer.CONTROL_PORT, Timer.CONTROL_RUN)
+        return cpu
+
+    def scramble(self, cpu):
+        cpu.registers[3] = 0
+        cpu.floating_point_registers[2] = 0.0
+        cpu.flags['Z'] = 0
+        cpu.pc = 0
+        cpu.memory.load(0x500, 0)
+        cpu.memory.load(0x501, 0)
+        cpu.memory.load(0x40000, 1)
+        cpu.rom.load(3, 0)
+        cpu.interrupt_controller.reset()
+        cpu.peripherals[TIMER_BASE].write(Timer.CONTROL_PORT, 0)
+        cpu.retired += 10
+
+    def assert_restored(self, cpu):
+        self.assertEqual(cpu.registers[3], 42)
+        self.assertEqual(cpu.floating_point_registers[2], 1.5)
+        self.assertEqual(cpu.flags['Z'], 1)
+        self.assertEqual(cpu.pc, 0x123)
+        self.assertEqual([cpu.memory.read(0x500), cpu.memory.read(0x501)], [7, 2.5])
+        self.assertIsInstance(cpu.memory.read(0x501), float)
+        self.assertEqual(cpu.memory.read(0x12345), -9)
+        self.assertEqual(cpu.memory.read(0x40000), 0)
+        self.assertEqual(cpu.rom.read(3), 0x77)
+        self.assertEqual(cpu.interrupt_controller.pending, 1 << 2)
+        self.assertEqual(cpu.peripherals[TIMER_BASE].read(Timer.REMAINING_PORT), 50)
+
+    def test_restore_in_memory(self):
+        for backing in Memory.BACKINGS:
+            with self.subTest(backing=backing):
+                cpu = self.machine(backing)
+                snapshot = cpu.snapshot()
+                self.scramble(cpu)
+                cpu.restore(snapshot)
+                self.assert_restored(cpu)
+
+    def test_round_trip_through_bytes(self):
+        for backing in Memory.BACKINGS:
+            with self.subTest(backing=backing):
+                snapshot = Snapshot.from_bytes(self.machine(backing).snapshot().to_bytes())
+                cpu = CPU(memory_backing=backing)
+                cpu.add_peripheral(cpu.interrupt_controller)
+                cpu.add_peripheral(Timer(base_address=TIMER_BASE))
+                cpu.restore(snapshot)
+                self.assert_restored(cpu)
+
+    def test_rejects_other_files(self):
+        with self.assertRaises(ValueError):
+            Snapshot.from_bytes(b'NOTASNAP' + bytes(8))
+
+
+if __name__ == '__main__':
+    unittest.main()
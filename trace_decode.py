@@ -0,0 +1,114 @@
+import argparse
+import json
+import struct
+import sys
+
+from assembler import Assembler
+from symbols import SymbolTable
+from tracer import read_trace, INSTRUCTION, REGISTER, FLOAT_REGISTER, FLAGS, MEMORY, MEMORY_BLOCK, PORT_IN, PORT_OUT, \
+    INTERRUPT, FLAG_BITS
+
+MNEMONICS = {opcode: mnemonic for mnemonic, opcode in Assembler.INSTRUCTIONS.items()}
+
+
+def bits_float(bits):
+    return struct.unpack('<d', struct.pack('<q', bits))[0]
+
+
+def disassemble(word):
+    # Instruction word in the CPU's decode layout: opcode, two operand types, three 12-bit operands
+    word &= (1 << 64) - 1
+    opcode = word >> 56
+    types = ((word >> 52) & 0xF, (word >> 48) & 0xF)
+    fields = ((word >> 36) & 0xFFF, (word >> 24) & 0xFFF, (word >> 12) & 0xFFF)
+    operands = []
+    for index, value in enumerate(fields):
+        kind = types[index] if index < 2 else 0
+        operands.append(f"R{value}" if kind == 1 else f"0x{value:X}")
+    return f"{MNEMONICS.get(opcode, f'OP{opcode}')} {', '.join(operands)}"
+
+
+def decode_instructions(first_retired, records):
+    # Yields one dict per instruction with its effects
+    instruction = None
+    retired = first_retired
+    for kind, index, address, value in zip(records['kind'].tolist(), records['index'].tolist(),
+                                           records['address'].tolist(), records['value'].tolist()):
+        if kind == INSTRUCTION:
+            if instruction is not None:
+                yield instruction
+                retired += 1
+            instruction = {'retired': retired, 'pc': address, 'word': value & ((1 << 64) - 1),
+                           'text': disassemble(value), 'effects': []}
+            continue
+        if instruction is None:
+            continue
+        if kind == INTERRUPT:
+            effect = {'interrupt': index, 'handler': address}
+        elif kind == REGISTER:
+            effect = {'register': f"R{index}", 'value': bits_float(value) if address else value}
+        elif kind == FLOAT_REGISTER:
+            effect = {'register': f"F{index}", 'value': bits_float(value)}
+        elif kind == FLAGS:
+            effect = {'flags': {name: int(bool(value & bit)) for name, bit in FLAG_BITS}}
+        elif kind == MEMORY:
+            effect = {'memory': address, 'value': bits_float(value) if index else value}
+        elif kind == MEMORY_BLOCK:
+            effect = {'memory': address, 'length': value}
+        elif kind == PORT_IN:
+            effect = {'in': address, 'value': value}
+        elif kind == PORT_OUT:
+            effect = {'out': address, 'value': value}
+        else:
+            effect = {'kind': kind, 'index': index, 'address': address, 'value': value}
+        instruction['effects'].append(effect)
+    if instruction is not None:
+        yield instruction
+
+
+def format_effect(effect):
+    if 'register' in effect:
+        return f"{effect['register']}={effect['value']}"
+    if 'flags' in effect:
+        return "flags=" + "".join(name for name, value in effect['flags'].items() if value)
+    if 'length' in effect:
+        return f"[{effect['memory']:04X}..+{effect['length']}]"
+    if 'memory' in effect:
+        return f"[{effect['memory']:04X}]={effect['value']}"
+    if 'in' in effect:
+        return f"in {effect['in']:04X}->{effect['value']}"
+    if 'out' in effect:
+        return f"out {effect['out']:04X}<-{effect['value']}"
+    if 'interrupt' in effect:
+        return f"interrupt {effect['interrupt']} -> {effect['handler']:04X}"
+    return json.dumps(effect)
+
+
+def format_instruction(instruction, symbols=None):
+    where = symbols.describe(instruction['pc']) if symbols is not None else f"{instruction['pc']:04X}"
+    effects = "  ".join(format_effect(effect) for effect in instruction['effects'])
+    return f"{instruction['retired']:>10}  {where:<32} {instruction['text']:<28} {effects}".rstrip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode a binary execution trace")
+    parser.add_argument("trace_file", type=str, help="Trace written by the emulator's --trace-file")
+    parser.add_argument("--json", action="store_true", help="One JSON object per instruction instead of text")
+    parser.add_argument("--symbols", type=str, help="Symbol file to name PCs by label and source line")
+    parser.add_argument("--last", type=int, help="Only the last n instructions")
+    args = parser.parse_args()
+
+    first_retired, records = read_trace(args.trace_file)
+    symbols = SymbolTable.load(args.symbols) if args.symbols else None
+    instructions = decode_instructions(first_retired, records)
+    if args.last:
+        instructions = list(instructions)[-args.last:]
+    for instruction in instructions:
+        if args.json:
+            sys.stdout.write(json.dumps(instruction) + "\n")
+        else:
+            sys.stdout.write(format_instruction(instruction, symbols) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import struct
+
+import numpy as np
+
+from memory import float_bits, to_word
+
+TRACE_MAGIC = b'ADVTRC\x00\x00'
+TRACE_VERSION = 1
+
+# File layout, all integers little-endian:
+#   header:   magic (8 bytes), version (u16), record size (u16), reserved (u32), retired count of the first instruction (u64)
+#   records:  fixed-size records (kind u8, index u8, reserved u16, address u32, value i64) until the end of the file
+# Every retired instruction starts with an INSTRUCTION record; the records after it, up to the next one,
+# are its effects. A ring dump starts at the oldest complete instruction still in the ring.
+HEADER = struct.Struct('<8sHHIQ')
+RECORD = struct.Struct('<BBHIq')
+RECORD_DTYPE = np.dtype([('kind', 'u1'), ('index', 'u1'), ('reserved', '<u2'), ('address', '<u4'), ('value', '<i8')])
+
+INSTRUCTION = 1  # address = pc, value = instruction word
+REGISTER = 2  # index = register, value = new value (address = 1: a float, value holds its bits)
+FLOAT_REGISTER = 3  # index = register, value = IEEE-754 bits of the new value
+FLAGS = 4  # value = Z | N << 1 | C << 2 | V << 3
+MEMORY = 5  # address, value = word written (index = 1: a float word, value holds its bits)
+MEMORY_BLOCK = 6  # address, value = number of words written by one bulk store
+PORT_IN = 7  # address = port, value = value read
+PORT_OUT = 8  # address = port, value = value written
+INTERRUPT = 9  # index = line, address = handler address
+KIND_NAMES = {INSTRUCTION: 'instruction', REGISTER: 'register', FLOAT_REGISTER: 'float_register', FLAGS: 'flags',
+              MEMORY: 'memory', MEMORY_BLOCK: 'memory_block', PORT_IN: 'in', PORT_OUT: 'out', INTERRUPT: 'interrupt'}
+
+FLAG_BITS = (('Z', 1), ('N', 2), ('C', 4), ('V', 8))
+BLOCK_RECORD_LIMIT = 16  # Bulk stores longer than this are recorded as one MEMORY_BLOCK record
+STREAM_CHUNK = 1 << 16  # Records buffered before a streamed trace is written out
+
+
+def flag_bits(flags):
+    return sum(bit for name, bit in FLAG_BITS if flags.get(name))
+
+
+def word_bits(value):
+    # Record value of a register or word: floats as their IEEE-754 bits, integers wrapped to 64 bits
+    return float_bits(value) if isinstance(value, float) else to_word(int(value))
+
+
+class TraceRecorder:
+    # Binary execution trace fed by CPU.run_traced. With ring_records the newest records are kept in a
+    # fixed in-memory ring and written by save(); otherwise records are streamed to file_path as they come.
+    def __init__(self, cpu, file_path=None, ring_records=None):
+        if file_path is None and not ring_records:
+            raise ValueError("A trace needs a file, a ring buffer or both")
+        self.cpu = cpu
+        self.file_path = file_path
+        self.count = 0  # Records written so far, including those the ring has dropped
+        self.first_retired = None  # Retired count of the first recorded instruction
+        self.instructions = 0
+        self.file = None
+        if ring_records:
+            self.ring = bytearray(ring_records * RECORD.size)
+        else:
+            self.ring = bytearray(STREAM_CHUNK * RECORD.size)
+            self.file = open(file_path, 'wb')
+            self.file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, RECORD.size, 0, 0))
+        self.position = 0  # Next record slot in self.ring
+        self.slots = len(self.ring) // RECORD.size
+        self.pack_into = RECORD.pack_into
+
+    def attach(self):
+        self.cpu.memory.add_write_listener(self.memory_written)
+
+    def detach(self):
+        self.cpu.memory.remove_write_listener(self.memory_written)
+
+    def record(self, kind, index, address, value):
+        self.pack_into(self.ring, self.position * RECORD.size, kind, index, 0, address & 0xFFFFFFFF, value)
+        self.count += 1
+        self.position += 1
+        if self.position == self.slots:
+            if self.file is not None:
+                self.file.write(self.ring)
+            self.position = 0
+
+    def instruction(self, pc, word, retired):
+        if self.first_retired is None:
+            self.first_retired = retired
+        self.instructions += 1
+        self.record(INSTRUCTION, 0, pc, to_word(word))
+
+    def memory_written(self, address, length):
+        if length > BLOCK_RECORD_LIMIT:
+            self.record(MEMORY_BLOCK, 0, address, length)
+            return
+        read = self.cpu.memory.read
+        for addr in range(address, address + length):
+            value = read(addr)
+            self.record(MEMORY, isinstance(value, float), addr, word_bits(value))
+
+    def records(self):
+        # Recorded records in order as a NumPy structured array, starting at the oldest complete instruction
+        if self.file is not None:
+            self.flush()
+            return read_trace(self.file_path)[1]
+        if self.count <= self.slots:
+            data = self.ring[:self.position * RECORD.size]
+        else:
+            split = self.position * RECORD.size
+            data = self.ring[split:] + self.ring[:split]
+        records = np.frombuffer(bytes(data), dtype=RECORD_DTYPE)
+        starts = np.flatnonzero(records['kind'] == INSTRUCTION)
+        return records[starts[0]:] if len(starts) else records[:0]
+
+    def first_instruction(self, records):
+        # Retired count of the first instruction in records
+        if self.first_retired is None:
+            return 0
+        return self.first_retired + self.instructions - int(np.count_nonzero(records['kind'] == INSTRUCTION))
+
+    def flush(self):
+        if self.file is not None:
+            self.file.write(self.ring[:self.position * RECORD.size])
+            self.position = 0
+            self.file.flush()
+
+    def save(self, file_path=None):
+        # Writes the ring (or finishes the stream) as a trace file
+        if self.file is not None:
+            self.flush()
+            self.file.seek(0)
+            self.file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, RECORD.size, 0, self.first_retired or 0))
+            self.file.seek(0, 2)
+            return
+        records = self.records()
+        with open(file_path or self.file_path, 'wb') as file:
+            file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, RECORD.size, 0, self.first_instruction(records)))
+            file.write(records.tobytes())
+
+    def close(self):
+        self.save()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_trace(file_path):
+    # (retired count of the first instruction, structured array of records)
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    magic, version, record_size, _, first_retired = HEADER.unpack_from(data, 0)
+    if magic != TRACE_MAGIC:
+        raise ValueError(f"{file_path} is not an execution trace")
+    if version != TRACE_VERSION or record_size != RECORD.size:
+        raise ValueError(f"Unsupported trace version {version} (record size {record_size})")
+    body = data[HEADER.size:]
+    body = body[:len(body) - len(body) % RECORD.size]
+    return first_retired, np.frombuffer(body, dtype=RECORD_DTYPE)